@@ -1,25 +1,44 @@
 from flask import Flask
+from sqlalchemy import inspect, text
 from .extensions import db, migrate, login_manager
 from .main import main_bp
 from .auth import auth_bp
 from .store import store_bp
 from .dashboard import dashboard_bp
 from .admin import admin_bp
+from . import database, routing
 from config import Config
 import os
 
 
-def create_app():
+def create_app(config_class=Config):
     app = Flask(__name__, instance_relative_config=True)
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
     
     # Initialize extensions
+    database.configure(app)
     db.init_app(app)
+    database.init_app(app, db)
+    routing.init_app(app, db)
     migrate.init_app(app, db)
     login_manager.init_app(app)
     
     # Import models to ensure they are registered with SQLAlchemy
-    from . import models
+    from . import models, entitlements, catalog, page_cache, payments, webhooks, jobs, media, passwords, identity, stats, search, assets, images, ebook_pages, packaging
+    passwords.init_app(app)
+    identity.init_app(app)
+    entitlements.init_app(app)
+    payments.init_app(app)
+    webhooks.init_app(app)
+    jobs.init_app(app)
+    catalog.init_app(app)
+    stats.init_app(app)
+    search.init_app(app)
+    page_cache.init_app(app)
+    assets.init_app(app)
+    images.init_app(app)
+    ebook_pages.init_app(app)
+    packaging.init_app(app)
     
     # Register blueprints
     app.register_blueprint(main_bp)
@@ -36,10 +55,63 @@ def create_app():
                 os.makedirs(app.instance_path)
             
             # Create database tables
-            db.create_all()
+            needs_backfill = not inspect(db.engine).has_table('entitlement')
+            needs_stats = not inspect(db.engine).has_table('stat_counter')
+            db.create_all(bind_key=None)  # the primary only; replica binds have no tables of their own
+            widen_columns()
+            ensure_indexes()
+            if needs_backfill:
+                entitlements.backfill()
+            if needs_stats:
+                stats.rebuild()
+            search.prepare()
             print("✓ Database initialized successfully")
         except Exception as e:
             print(f"⚠️ Database initialization warning: {e}")
             print("Database will be created when first accessed")
     
     return app
+
+
+def narrow_columns():
+    """(table, column, database length, model length) for string columns created shorter than the model"""
+    inspector = inspect(db.engine)
+    narrow = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name']: column['type'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            length = getattr(column.type, 'length', None)
+            current = getattr(existing.get(column.name), 'length', None)
+            if length and current and current < length:
+                narrow.append((table.name, column.name, current, length))
+    return narrow
+
+
+def widen_columns():
+    """Widen string columns of tables that predate a longer model column (create_all never alters them).
+
+    e.g. user.password_hash was 128 characters; scrypt hashes need more.
+    SQLite does not enforce VARCHAR lengths, so only other databases are altered.
+    """
+    dialect = db.engine.dialect
+    if dialect.name == 'sqlite':
+        return
+    quote = dialect.identifier_preparer.quote
+    with db.engine.begin() as connection:
+        for table_name, column_name, _, _ in narrow_columns():
+            column = db.metadata.tables[table_name].c[column_name]
+            type_sql = column.type.compile(dialect=dialect)
+            if dialect.name == 'mysql':
+                change = f'MODIFY COLUMN {quote(column_name)} {type_sql}{"" if column.nullable else " NOT NULL"}'
+            else:
+                change = f'ALTER COLUMN {quote(column_name)} TYPE {type_sql}'
+            connection.execute(text(f'ALTER TABLE {quote(table_name)} {change}'))
+
+
+def ensure_indexes():
+    """Create model indexes missing from tables that predate them"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
@@ -1,12 +1,19 @@
 import os
-import uuid
 from flask import render_template, request, redirect, url_for, flash, current_app, jsonify, send_from_directory
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
 from . import admin_bp
-from ..models import Product, User
+from ..models import Order, Product, Upload, User
 from ..extensions import db
+from ..blobs import store_stream, assign, release, release_many, is_blob
+from ..catalog import bump_version
+from ..images import save_product_image
+from .. import analytics, bulk_import, packaging, search, stats
+from ..page_cache import purge, purge_products, clear as clear_page_cache
+from ..payments import get_gateway
+from ..uploads import attach
+from ..routing import use_replica
 from datetime import datetime
+from sqlalchemy import delete, exists, func, select, tuple_, update
 
 # File upload configuration
 ALLOWED_EXTENSIONS = {
@@ -20,8 +27,8 @@ def allowed_file(filename, file_type):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS.get(file_type, [])
 
 def is_admin(user):
-    """Check if user is admin - for now, check if username is 'admin'"""
-    return user.is_authenticated and user.username == 'admin'
+    """Check if user is admin - the cached Identity decides (username 'admin' for now)"""
+    return user.is_authenticated and user.is_admin
 
 @admin_bp.before_request
 def require_admin():
@@ -37,10 +44,13 @@ def require_admin():
 @admin_bp.route('/')
 def dashboard():
     """Admin dashboard"""
-    total_products = Product.query.count()
-    total_ebooks = Product.query.filter_by(category='ebook').count()
-    total_courses = Product.query.filter_by(category='course').count()
-    total_users = User.query.count()
+    # Running totals from the stats table instead of COUNTs over the whole tables
+    counters = stats.snapshot()
+    stats.verify_if_due(counters)
+    total_products = int(counters.get('products', 0))
+    total_ebooks = int(counters.get('products:ebook', 0))
+    total_courses = int(counters.get('products:course', 0))
+    total_users = int(counters.get('users', 0))
     
     recent_products = Product.query.order_by(Product.created_at.desc()).limit(5).all()
     
@@ -51,20 +61,206 @@ def dashboard():
                          total_users=total_users,
                          recent_products=recent_products)
 
+@admin_bp.route('/stats/daily')
+def stats_daily():
+    """Daily rollups (new users, orders, completed orders, revenue) for charts"""
+    days = min(max(request.args.get('days', 30, type=int), 1), 366)
+    return jsonify(stats.daily(days))
+
+@admin_bp.route('/analytics/revenue')
+def analytics_revenue():
+    """Orders, revenue and conversion per hour/day/month from the columnar rollups"""
+    try:
+        series = analytics.revenue_series(request.args.get('grain', 'daily'), request.args.get('start'),
+                                          request.args.get('end'), request.args.get('product_id', type=int))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(series)
+
+@admin_bp.route('/analytics/products')
+def analytics_products():
+    """Best-selling products over a period"""
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 500)
+    try:
+        sales = analytics.product_sales(request.args.get('grain', 'daily'), request.args.get('start'),
+                                        request.args.get('end'), limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    names = dict(db.session.query(Product.id, Product.name)
+                 .filter(Product.id.in_([row['product_id'] for row in sales])))
+    for row in sales:
+        row['name'] = names.get(row['product_id'])
+    return jsonify({'products': sales})
+
+@admin_bp.route('/gateway/metrics')
+def gateway_metrics():
+    """Razorpay client latency, outcome counters and circuit-breaker state"""
+    gateway = get_gateway()
+    metrics = gateway.metrics.snapshot()
+    metrics['breaker'] = gateway.breaker.state
+    return jsonify(metrics)
+
+PRODUCTS_PER_PAGE = 25
+BULK_ACTIONS = ('activate', 'deactivate', 'reprice', 'delete')
+
+def product_filters(args):
+    """WHERE criteria for the admin listing's category/status filters"""
+    criteria = []
+    if args.get('category') in ('ebook', 'course'):
+        criteria.append(Product.category == args['category'])
+    if args.get('status') in ('active', 'inactive'):
+        criteria.append(Product.is_active.is_(args['status'] == 'active'))
+    return criteria
+
+def encode_cursor(product):
+    return f"{product.created_at.isoformat()}_{product.id}"
+
+def decode_cursor(value):
+    try:
+        created_at, _, product_id = value.rpartition('_')
+        return datetime.fromisoformat(created_at), int(product_id)
+    except (AttributeError, ValueError):
+        return None
+
 @admin_bp.route('/products')
+@use_replica
 def products():
-    """List all products"""
-    page = request.args.get('page', 1, type=int)
+    """List products newest first, PRODUCTS_PER_PAGE at a time"""
     category = request.args.get('category', '')
+    status = request.args.get('status', '')
+    after = decode_cursor(request.args.get('after'))
+    before = decode_cursor(request.args.get('before')) if after is None else None
+    
+    # Keyset pagination on (created_at, id): every page is one index range scan, however deep
+    key = tuple_(Product.created_at, Product.id)
+    query = Product.query.filter(*product_filters(request.args))
+    if before is not None:
+        items = query.filter(key > tuple_(*before)).order_by(Product.created_at, Product.id) \
+            .limit(PRODUCTS_PER_PAGE + 1).all()
+        has_more = len(items) > PRODUCTS_PER_PAGE
+        items = items[:PRODUCTS_PER_PAGE][::-1]
+        has_prev, has_next = has_more, True
+    else:
+        if after is not None:
+            query = query.filter(key < tuple_(*after))
+        items = query.order_by(Product.created_at.desc(), Product.id.desc()).limit(PRODUCTS_PER_PAGE + 1).all()
+        has_next = len(items) > PRODUCTS_PER_PAGE
+        items = items[:PRODUCTS_PER_PAGE]
+        has_prev = after is not None
     
-    query = Product.query
-    if category:
-        query = query.filter_by(category=category)
+    counters = stats.snapshot()
+    return render_template('admin/products.html', products=items, category=category, status=status,
+                           prev_cursor=encode_cursor(items[0]) if items and has_prev else None,
+                           next_cursor=encode_cursor(items[-1]) if items and has_next else None,
+                           counts={'all': int(counters.get('products', 0)),
+                                   'ebook': int(counters.get('products:ebook', 0)),
+                                   'course': int(counters.get('products:course', 0))})
+
+@admin_bp.route('/products/bulk', methods=['POST'])
+def bulk_products():
+    """Activate, deactivate, reprice or delete the selected products, the filtered view, or (scope=all) every product"""
+    action = request.form.get('action')
+    filters = {name: request.form.get(name, '') for name in ('category', 'status')}
+    back = redirect(url_for('admin.products', **{k: v for k, v in filters.items() if v}))
+    if action not in BULK_ACTIONS:
+        flash('Choose a bulk action', 'error')
+        return back
+    scope = request.form.get('scope')
+    if scope == 'filter':
+        criteria = product_filters(filters)
+        if not criteria:
+            # An unfiltered view is the whole catalog; that has to be asked for explicitly
+            flash('Choose a category or status filter, or apply to all products', 'error')
+            return back
+    elif scope == 'all':
+        criteria = []
+    else:
+        ids = request.form.getlist('product_ids', type=int)
+        if not ids:
+            flash('Select at least one product', 'error')
+            return back
+        criteria = [Product.id.in_(ids)]
     
-    products = query.order_by(Product.created_at.desc()).paginate(
-        page=page, per_page=10, error_out=False)
+    try:
+        if action == 'reprice':
+            values = _reprice_values(request.form)
+        else:
+            values = {'is_active': action == 'activate'}
+        if action == 'delete':
+            rows, kept = _bulk_delete(criteria)
+        else:
+            rows = db.session.execute(update(Product.__table__).where(*criteria).values(**values)
+                                      .returning(Product.id, Product.category)).all()
+            kept = 0
+            search.reindex([row.id for row in rows])
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        flash(str(e), 'error')
+        return back
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Bulk {action} failed: {str(e)}', 'error')
+        return back
     
-    return render_template('admin/products.html', products=products, category=category)
+    if rows:
+        bump_version()
+        if len(rows) > 100:
+            clear_page_cache()
+        else:
+            purge('featured', *{f'category:{row.category}' for row in rows}, *(f'product:{row.id}' for row in rows))
+    if action == 'delete':
+        _remove_legacy_files(rows)
+    done = {'activate': 'activated', 'deactivate': 'deactivated', 'reprice': 'repriced', 'delete': 'deleted'}[action]
+    flash(f'{len(rows)} product{"" if len(rows) == 1 else "s"} {done}.', 'success')
+    if kept:
+        flash(f'{kept} product{"" if kept == 1 else "s"} with orders kept; deactivate them instead.', 'info')
+    return back
+
+def _reprice_values(form):
+    try:
+        if form.get('price'):
+            price = round(float(form['price']), 2)
+            if price < 0:
+                raise ValueError
+            return {'price': price}
+        factor = 1 + float(form.get('percent', '')) / 100
+        if factor < 0:
+            raise ValueError
+        return {'price': func.round(Product.price * factor, 2)}
+    except ValueError:
+        raise ValueError('Enter a new price or a percentage change for repricing')
+
+def _bulk_delete(criteria):
+    """Delete matching products that have no orders; returns (deleted rows, number kept)"""
+    has_orders = exists().where(Order.product_id == Product.id)
+    doomed = select(Product.id).where(*criteria, ~has_orders)
+    release_many(doomed)
+    db.session.execute(update(Upload.__table__).where(Upload.product_id.in_(doomed)).values(product_id=None))
+    kept = db.session.scalar(select(func.count()).select_from(Product).where(*criteria, has_orders))
+    rows = db.session.execute(delete(Product.__table__).where(Product.id.in_(doomed))
+                              .returning(Product.id, Product.category, Product.file_url, Product.image_url)).all()
+    # Core statements skip the flush hooks that keep the counters and the search index current
+    deltas = {('products', None): -len(rows)}
+    for row in rows:
+        deltas[(f'products:{row.category}', None)] = deltas.get((f'products:{row.category}', None), 0) - 1
+    stats.adjust(deltas)
+    search.reindex([row.id for row in rows])
+    return rows, kept
+
+def _remove_legacy_files(rows):
+    """Files that predate the content store belong to one product; blobs are left to gc_content.py"""
+    for row in rows:
+        paths = []
+        if row.file_url and not is_blob(row.file_url):
+            paths.append(os.path.join(current_app.config['CONTENT_DIR'], os.path.relpath(row.file_url, '/content')))
+        if row.image_url and row.image_url.startswith('/static/'):
+            paths.append(os.path.join(current_app.root_path, row.image_url.lstrip('/')))
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
 
 @admin_bp.route('/upload')
 def upload_form():
@@ -88,47 +284,26 @@ def upload_content():
         # Handle file uploads
         content_file = request.files.get('content_file')
         image_file = request.files.get('image_file')
+        # Set instead of content_file when the file was sent through the resumable upload API
+        upload_id = request.form.get('upload_id')
         
         file_url = None
         image_url = None
         
-        # Upload content file
-        if content_file and content_file.filename:
+        # Upload content file (stored once per distinct content, named by its hash)
+        if content_file and content_file.filename and not upload_id:
             if category == 'ebook' and allowed_file(content_file.filename, 'pdf'):
-                filename = secure_filename(content_file.filename)
-                unique_filename = f"{uuid.uuid4()}_{filename}"
-                file_path = os.path.join(current_app.root_path, '..', 'content', 'ebooks', unique_filename)
-                
-                # Ensure directory exists
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                content_file.save(file_path)
-                file_url = f"/content/ebooks/{unique_filename}"
+                file_url = store_stream('ebooks', content_file.stream, content_file.filename)
                 
             elif category == 'course' and allowed_file(content_file.filename, 'video'):
-                filename = secure_filename(content_file.filename)
-                unique_filename = f"{uuid.uuid4()}_{filename}"
-                file_path = os.path.join(current_app.root_path, '..', 'content', 'videos', unique_filename)
-                
-                # Ensure directory exists
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                content_file.save(file_path)
-                file_url = f"/content/videos/{unique_filename}"
+                file_url = store_stream('videos', content_file.stream, content_file.filename)
             else:
                 flash(f'Invalid file type for {category}', 'error')
                 return redirect(url_for('admin.upload_form'))
         
         # Upload image file
         if image_file and image_file.filename and allowed_file(image_file.filename, 'image'):
-            filename = secure_filename(image_file.filename)
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            
-            # Create static/images/products directory if it doesn't exist
-            images_dir = os.path.join(current_app.root_path, 'static', 'images', 'products')
-            os.makedirs(images_dir, exist_ok=True)
-            
-            file_path = os.path.join(images_dir, unique_filename)
-            image_file.save(file_path)
-            image_url = f"/static/images/products/{unique_filename}"
+            image_url = save_product_image(image_file)
         
         # Create product in database
         product = Product(
@@ -136,13 +311,20 @@ def upload_content():
             description=description,
             price=price,
             category=category,
-            file_url=file_url,
             image_url=image_url,
-            is_active=True
+            # Resumable uploads go live once the background job has processed the file
+            is_active=not upload_id
         )
         
         db.session.add(product)
+        if file_url:
+            assign(product, file_url)
         db.session.commit()
+        if upload_id and not attach(product, upload_id):
+            flash(f'{category.title()} saved; it will be published once the file is processed.', 'info')
+            return redirect(url_for('admin.products'))
+        bump_version()
+        purge_products(product)
         
         flash(f'{category.title()} uploaded successfully!', 'success')
         return redirect(url_for('admin.products'))
@@ -173,39 +355,26 @@ def update_product(product_id):
         content_file = request.files.get('content_file')
         image_file = request.files.get('image_file')
         
+        upload_id = request.form.get('upload_id')
+        
         # Update content file if provided
-        if content_file and content_file.filename:
+        if content_file and content_file.filename and not upload_id:
             if product.category == 'ebook' and allowed_file(content_file.filename, 'pdf'):
-                filename = secure_filename(content_file.filename)
-                unique_filename = f"{uuid.uuid4()}_{filename}"
-                file_path = os.path.join(current_app.root_path, '..', 'content', 'ebooks', unique_filename)
-                
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                content_file.save(file_path)
-                product.file_url = f"/content/ebooks/{unique_filename}"
+                assign(product, store_stream('ebooks', content_file.stream, content_file.filename))
                 
             elif product.category == 'course' and allowed_file(content_file.filename, 'video'):
-                filename = secure_filename(content_file.filename)
-                unique_filename = f"{uuid.uuid4()}_{filename}"
-                file_path = os.path.join(current_app.root_path, '..', 'content', 'videos', unique_filename)
-                
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                content_file.save(file_path)
-                product.file_url = f"/content/videos/{unique_filename}"
+                assign(product, store_stream('videos', content_file.stream, content_file.filename))
         
         # Update image if provided
         if image_file and image_file.filename and allowed_file(image_file.filename, 'image'):
-            filename = secure_filename(image_file.filename)
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            
-            images_dir = os.path.join(current_app.root_path, 'static', 'images', 'products')
-            os.makedirs(images_dir, exist_ok=True)
-            
-            file_path = os.path.join(images_dir, unique_filename)
-            image_file.save(file_path)
-            product.image_url = f"/static/images/products/{unique_filename}"
+            product.image_url = save_product_image(image_file)
         
         db.session.commit()
+        bump_version()
+        purge_products(product)
+        if upload_id and not attach(product, upload_id):
+            flash('Product updated; the new file will replace the old one once it is processed.', 'info')
+            return redirect(url_for('admin.products'))
         flash('Product updated successfully!', 'success')
         return redirect(url_for('admin.products'))
         
@@ -214,25 +383,39 @@ def update_product(product_id):
         flash(f'Update failed: {str(e)}', 'error')
         return redirect(url_for('admin.edit_product', product_id=product_id))
 
+@admin_bp.route('/product/<int:product_id>/packaging', methods=['GET', 'POST'])
+def product_packaging(product_id):
+    """HLS/DASH packaging progress of a course video as JSON; POST queues it again"""
+    product = Product.query.get_or_404(product_id)
+    if product.category != 'course' or not product.file_url:
+        return jsonify({'error': 'Product has no course video'}), 404
+    if request.method == 'POST':
+        packaging.queue_package(product.file_url)
+    return jsonify(packaging.package_status(product.file_url))
+
 @admin_bp.route('/product/<int:product_id>/delete', methods=['POST'])
 def delete_product(product_id):
     """Delete product"""
     product = Product.query.get_or_404(product_id)
     
     try:
-        # Delete associated files
-        if product.file_url:
-            file_path = os.path.join(current_app.root_path, '..', product.file_url.lstrip('/'))
+        # Content files may be shared with other products; gc_content.py removes them once unreferenced
+        if product.file_url and not is_blob(product.file_url):
+            file_path = os.path.join(current_app.config['CONTENT_DIR'], os.path.relpath(product.file_url, '/content'))
             if os.path.exists(file_path):
                 os.remove(file_path)
+        release(product)
         
         if product.image_url and product.image_url.startswith('/static/'):
             image_path = os.path.join(current_app.root_path, product.image_url.lstrip('/'))
             if os.path.exists(image_path):
                 os.remove(image_path)
         
+        product_keys = (f'product:{product.id}', f'category:{product.category}', 'featured')
         db.session.delete(product)
         db.session.commit()
+        bump_version()
+        purge(*product_keys)
         
         flash('Product deleted successfully!', 'success')
     except Exception as e:
@@ -248,58 +431,42 @@ def bulk_upload_form():
 
 @admin_bp.route('/bulk-upload', methods=['POST'])
 def bulk_upload():
-    """Handle bulk upload of multiple files"""
-    try:
-        files = request.files.getlist('files')
-        category = request.form.get('category')
-        
-        if not files or not category:
-            flash('Please select files and category', 'error')
-            return redirect(url_for('admin.bulk_upload_form'))
-        
-        uploaded_count = 0
-        
-        for file in files:
-            if file and file.filename:
-                # Generate product name from filename
-                name = os.path.splitext(file.filename)[0].replace('_', ' ').replace('-', ' ').title()
-                
-                # Save file
-                filename = secure_filename(file.filename)
-                unique_filename = f"{uuid.uuid4()}_{filename}"
-                
-                if category == 'ebook' and allowed_file(file.filename, 'pdf'):
-                    file_path = os.path.join(current_app.root_path, '..', 'content', 'ebooks', unique_filename)
-                    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                    file.save(file_path)
-                    file_url = f"/content/ebooks/{unique_filename}"
-                    
-                elif category == 'course' and allowed_file(file.filename, 'video'):
-                    file_path = os.path.join(current_app.root_path, '..', 'content', 'videos', unique_filename)
-                    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                    file.save(file_path)
-                    file_url = f"/content/videos/{unique_filename}"
-                else:
-                    continue  # Skip invalid files
-                
-                # Create product
-                product = Product(
-                    name=name,
-                    description=f"Auto-uploaded {category}",
-                    price=49.0,  # Default price
-                    category=category,
-                    file_url=file_url,
-                    is_active=False  # Require manual activation
-                )
-                
-                db.session.add(product)
-                uploaded_count += 1
-        
-        db.session.commit()
-        flash(f'Successfully uploaded {uploaded_count} files!', 'success')
-        return redirect(url_for('admin.products'))
-        
-    except Exception as e:
-        db.session.rollback()
-        flash(f'Bulk upload failed: {str(e)}', 'error')
+    """Import multiple files, with details from an optional CSV/JSON manifest; reports each file"""
+    files = [file for file in request.files.getlist('files') if file and file.filename]
+    category = request.form.get('category')
+    wants_json = request.args.get('format') == 'json'
+
+    def fail(message):
+        if wants_json:
+            return jsonify({'error': message}), 400
+        flash(message, 'error')
         return redirect(url_for('admin.bulk_upload_form'))
+
+    if not files or category not in bulk_import.KINDS:
+        return fail('Please select files and category')
+    manifest = {}
+    manifest_file = request.files.get('manifest')
+    try:
+        if manifest_file and manifest_file.filename:
+            manifest = bulk_import.parse_manifest(manifest_file)
+        default_price = request.form.get('default_price', '').strip() or None
+        if default_price is not None and float(default_price) < 0:
+            raise ValueError('Default price cannot be negative')
+    except ValueError as e:
+        return fail(str(e))
+    if not manifest and default_price is None:
+        return fail('Upload a manifest or set a default price')
+
+    results = bulk_import.import_files(category, files, manifest, default_price,
+                                       default_active=request.form.get('is_active') == 'on')
+    created = sum(result.status == 'created' for result in results)
+    if created:
+        bump_version()
+        purge(f'category:{category}', 'featured')
+    if wants_json:
+        return jsonify({'created': created, 'results': [result._asdict() for result in results]})
+    if created:
+        flash(f'Imported {created} of {len(files)} files', 'success' if created == len(files) else 'warning')
+    else:
+        flash('No files were imported', 'error')
+    return render_template('admin/bulk_upload.html', results=results, category=category)
@@ -0,0 +1,100 @@
+"""
+tus-style resumable upload endpoints for the admin content forms.
+
+    POST   /admin/uploads          Upload-Length, Upload-Metadata -> 201 + Location
+    HEAD   /admin/uploads/<id>     -> Upload-Offset (where to resume)
+    PATCH  /admin/uploads/<id>     Upload-Offset + application/offset+octet-stream body
+    DELETE /admin/uploads/<id>     abandon an unfinished upload
+"""
+import base64
+import binascii
+from flask import request, current_app, jsonify, url_for, abort
+from . import admin_bp
+from ..extensions import db
+from ..models import Upload
+from ..uploads import UploadError, OffsetMismatch, create_upload, current_offset, append_chunk, delete_upload
+
+TUS_VERSION = '1.0.0'
+
+
+def parse_metadata(header):
+    """'filename d29ybGQ=,kind ZWJvb2tz' -> {'filename': 'world', 'kind': 'ebooks'}"""
+    metadata = {}
+    for pair in filter(None, (header or '').split(',')):
+        key, _, value = pair.strip().partition(' ')
+        try:
+            metadata[key] = base64.b64decode(value).decode('utf-8') if value else ''
+        except (binascii.Error, UnicodeDecodeError):
+            raise UploadError(f'Invalid Upload-Metadata value for {key}')
+    return metadata
+
+
+def tus_response(status=204, body=None, **headers):
+    response = jsonify(body) if body is not None else current_app.response_class(status=status)
+    response.status_code = status
+    response.headers['Tus-Resumable'] = TUS_VERSION
+    response.headers['Cache-Control'] = 'no-store'
+    for name, value in headers.items():
+        response.headers[name.replace('_', '-')] = str(value)
+    return response
+
+
+@admin_bp.errorhandler(UploadError)
+def upload_error(error):
+    headers = {'Upload_Offset': error.offset} if isinstance(error, OffsetMismatch) else {}
+    return tus_response(error.status, {'error': str(error)}, **headers)
+
+
+def get_upload(upload_id):
+    upload = db.session.get(Upload, upload_id)
+    if upload is None:
+        abort(404)
+    return upload
+
+
+@admin_bp.route('/uploads', methods=['OPTIONS'])
+def upload_options():
+    return tus_response(204, Tus_Version=TUS_VERSION, Tus_Extension='creation,termination',
+                        Tus_Max_Size=current_app.config['UPLOAD_MAX_SIZE'])
+
+
+@admin_bp.route('/uploads', methods=['POST'])
+def upload_create():
+    """Start a resumable upload"""
+    try:
+        length = int(request.headers['Upload-Length'])
+    except (KeyError, ValueError):
+        raise UploadError('Upload-Length header is required')
+    metadata = parse_metadata(request.headers.get('Upload-Metadata'))
+    product_id = metadata.get('product_id')
+    upload = create_upload(metadata.get('kind'), metadata.get('filename'), length,
+                           product_id=int(product_id) if product_id and product_id.isdigit() else None)
+    return tus_response(201, {'id': upload.id}, Location=url_for('admin.upload_patch', upload_id=upload.id),
+                        Upload_Offset=current_offset(upload))
+
+
+@admin_bp.route('/uploads/<upload_id>', methods=['HEAD'])
+def upload_status(upload_id):
+    upload = get_upload(upload_id)
+    return tus_response(200, Upload_Offset=current_offset(upload), Upload_Length=upload.length,
+                        Upload_Status=upload.status)
+
+
+@admin_bp.route('/uploads/<upload_id>', methods=['PATCH'])
+def upload_patch(upload_id):
+    """Append a chunk; the body is streamed to disk, never buffered in memory"""
+    upload = get_upload(upload_id)
+    if request.mimetype != 'application/offset+octet-stream':
+        raise UploadError('Content-Type must be application/offset+octet-stream', 415)
+    try:
+        offset = int(request.headers['Upload-Offset'])
+    except (KeyError, ValueError):
+        raise UploadError('Upload-Offset header is required')
+    new_offset = append_chunk(upload, offset, request.stream)
+    return tus_response(204, Upload_Offset=new_offset, Upload_Status=upload.status)
+
+
+@admin_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+def upload_delete(upload_id):
+    delete_upload(get_upload(upload_id))
+    return tus_response(204)
@@ -0,0 +1,379 @@
+"""
+Sales analytics from columnar rollups.
+
+Orders are rolled up per (time bucket, product) into hourly, daily and
+monthly tables: orders created, orders completed and completed revenue
+(conversion = completed / created). Each table is stored under
+STATE_DIR/analytics as one flat binary file per column (int32 bucket and
+product id, int32 counts, float64 revenue), sorted by bucket, so a query for
+a date range is two binary searches plus a vectorized reduction over the
+slice; it never touches the Order table.
+
+build() is incremental: it only re-aggregates orders created since the last
+build minus ANALYTICS_SETTLE_HOURS (recent orders may still change status),
+copies the older rows of each column file unchanged and appends the fresh
+ones. Status changes older than that window are picked up by a rebuild.
+Each build writes a new generation directory and switches meta.json to it
+atomically, so readers never see a half-written table.
+
+NumPy (in requirements.txt) does the aggregation. The pure-Python fallback
+exists only so development checkouts and tests run without it; it is far
+too slow for production order volumes.
+"""
+import array
+import bisect
+import calendar
+import fcntl
+import json
+import os
+import shutil
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select
+from .extensions import db
+from .models import Order
+
+try:
+    import numpy
+except ImportError:  # development only; production installs numpy
+    numpy = None
+
+GRAINS = ('hourly', 'daily', 'monthly')
+# (name, array typecode, numpy dtype)
+COLUMNS = (
+    ('bucket', 'i', '<i4'),
+    ('product_id', 'i', '<i4'),
+    ('orders', 'i', '<i4'),
+    ('completed', 'i', '<i4'),
+    ('revenue', 'd', '<f8'),
+)
+EPOCH = datetime(1970, 1, 1)
+WRITE_BATCH = 65536
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+class AnalyticsBusy(Exception):
+    """Another build holds the lock"""
+
+
+def hour_of(moment):
+    return calendar.timegm(moment.utctimetuple()) // 3600
+
+
+def coarsen(grain, hour):
+    """Bucket of `grain` that contains the given epoch hour"""
+    if grain == 'hourly':
+        return hour
+    if grain == 'daily':
+        return hour // 24
+    moment = EPOCH + timedelta(hours=hour)
+    return moment.year * 12 + moment.month - 1
+
+
+def first_hour(grain, bucket):
+    """Epoch hour at which a bucket of `grain` starts"""
+    if grain == 'hourly':
+        return bucket
+    if grain == 'daily':
+        return bucket * 24
+    return hour_of(datetime(bucket // 12, bucket % 12 + 1, 1))
+
+
+def label(grain, bucket):
+    if grain == 'monthly':
+        return f'{bucket // 12:04d}-{bucket % 12 + 1:02d}'
+    moment = EPOCH + timedelta(hours=first_hour(grain, bucket))
+    return moment.isoformat() if grain == 'hourly' else moment.date().isoformat()
+
+
+def bucket_for(grain, value):
+    """Bucket for a datetime or an ISO date/datetime string (None passes through)"""
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return coarsen(grain, hour_of(value))
+
+
+def _directory():
+    return os.path.join(current_app.config['STATE_DIR'], 'analytics')
+
+
+def _read_meta(directory):
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _column_path(directory, generation, grain, column):
+    return os.path.join(directory, f'g{generation}', f'{grain}.{column}')
+
+
+class Table:
+    """One grain's columns, as numpy arrays (or array.array without numpy)"""
+
+    def __init__(self, grain, columns):
+        self.grain = grain
+        self.columns = columns
+        self.rows = len(columns['bucket'])
+
+    @classmethod
+    def load(cls, directory, generation, grain):
+        columns = {}
+        for name, typecode, dtype in COLUMNS:
+            path = _column_path(directory, generation, grain, name)
+            if numpy is not None:
+                columns[name] = numpy.fromfile(path, dtype=dtype)
+            else:
+                values = array.array(typecode)
+                with open(path, 'rb') as f:
+                    values.frombytes(f.read())
+                columns[name] = values
+        return cls(grain, columns)
+
+    def span(self, start=None, end=None):
+        """Row range [lo, hi) for buckets in [start, end)"""
+        bucket = self.columns['bucket']
+        if numpy is not None:
+            lo = 0 if start is None else int(numpy.searchsorted(bucket, start, 'left'))
+            hi = self.rows if end is None else int(numpy.searchsorted(bucket, end, 'left'))
+        else:
+            lo = 0 if start is None else bisect.bisect_left(bucket, start)
+            hi = self.rows if end is None else bisect.bisect_left(bucket, end)
+        return lo, hi
+
+    def rows_between(self, lo, hi):
+        columns = [self.columns[name][lo:hi] for name, _, _ in COLUMNS]
+        return zip(*(c.tolist() for c in columns))
+
+
+def get_table(grain):
+    """The current table for `grain`, cached per generation; None before the first build"""
+    directory = _directory()
+    meta = _read_meta(directory)
+    if meta is None:
+        return None
+    key = (directory, meta['generation'], grain)
+    table = _loaded.get(key)
+    if table is None:
+        with _loaded_lock:
+            table = _loaded.get(key)
+            if table is None:
+                table = Table.load(directory, meta['generation'], grain)
+                for stale in [k for k in _loaded if k[0] == directory and k[2] == grain]:
+                    del _loaded[stale]
+                _loaded[key] = table
+    return table
+
+
+# -- building ---------------------------------------------------------------
+
+def _hourly_rows(since_hour):
+    """Stream (hour, product_id, orders, completed, revenue) from Order, sorted"""
+    query = (select(Order.created_at, Order.product_id, Order.payment_status, Order.amount)
+             .where(Order.created_at.isnot(None))
+             .order_by(Order.created_at))
+    if since_hour is not None:
+        query = query.where(Order.created_at >= EPOCH + timedelta(hours=since_hour))
+    current_hour, totals = None, {}
+    for created_at, product_id, status, amount in db.session.execute(
+            query.execution_options(yield_per=WRITE_BATCH)):
+        hour = hour_of(created_at)
+        if hour != current_hour:
+            yield from _flush(current_hour, totals)
+            current_hour, totals = hour, {}
+        entry = totals.setdefault(product_id, [0, 0, 0.0])
+        entry[0] += 1
+        if status == 'completed':
+            entry[1] += 1
+            entry[2] += amount or 0.0
+    yield from _flush(current_hour, totals)
+
+
+def _flush(bucket, totals):
+    for product_id in sorted(totals):
+        orders, completed, revenue = totals[product_id]
+        yield bucket, product_id, orders, completed, revenue
+
+
+def _coarse_rows(grain, hourly_rows):
+    """Re-bucket sorted hourly rows into a coarser grain, still sorted"""
+    current, totals = None, {}
+    for hour, product_id, orders, completed, revenue in hourly_rows:
+        bucket = coarsen(grain, hour)
+        if bucket != current:
+            yield from _flush(current, totals)
+            current, totals = bucket, {}
+        entry = totals.setdefault(product_id, [0, 0, 0.0])
+        entry[0] += orders
+        entry[1] += completed
+        entry[2] += revenue
+    yield from _flush(current, totals)
+
+
+def _write(directory, generation, grain, previous, keep, rows):
+    """Write a grain: the first `keep` rows of the previous generation, then `rows`"""
+    files = {name: open(_column_path(directory, generation, grain, name), 'wb') for name, _, _ in COLUMNS}
+    try:
+        if keep:
+            for name, typecode, _ in COLUMNS:
+                with open(_column_path(directory, previous, grain, name), 'rb') as source:
+                    remaining = keep * array.array(typecode).itemsize
+                    while remaining:
+                        chunk = source.read(min(remaining, 1 << 20))
+                        files[name].write(chunk)
+                        remaining -= len(chunk)
+        buffers = {name: array.array(typecode) for name, typecode, _ in COLUMNS}
+        written = keep
+        for row in rows:
+            for (name, _, _), value in zip(COLUMNS, row):
+                buffers[name].append(value)
+            written += 1
+            if len(buffers['bucket']) >= WRITE_BATCH:
+                for name, buffer in buffers.items():
+                    buffer.tofile(files[name])
+                    del buffer[:]
+        for name, buffer in buffers.items():
+            buffer.tofile(files[name])
+        for f in files.values():
+            f.flush()
+            os.fsync(f.fileno())
+    finally:
+        for f in files.values():
+            f.close()
+    return written
+
+
+def build(rebuild=False):
+    """Bring the rollups up to date; returns the new meta"""
+    directory = _directory()
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'build.lock'), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise AnalyticsBusy('An analytics build is already running')
+        return _build(directory, rebuild)
+
+
+def _build(directory, rebuild):
+    latest = _read_meta(directory)
+    # A rebuild still writes a new generation; readers may have the current one loaded
+    previous = latest['generation'] if latest else None
+    generation = (previous or 0) + 1
+    meta = None if rebuild else latest
+    now_hour = hour_of(datetime.utcnow())
+    since = None
+    if meta is not None:
+        since = min(meta['watermark'], now_hour - current_app.config['ANALYTICS_SETTLE_HOURS'])
+    os.makedirs(os.path.join(directory, f'g{generation}'), exist_ok=True)
+
+    rows = {}
+    keep = Table.load(directory, previous, 'hourly').span(None, since)[1] if meta else 0
+    rows['hourly'] = _write(directory, generation, 'hourly', previous, keep, _hourly_rows(since))
+    hourly = Table.load(directory, generation, 'hourly')
+    for grain in GRAINS[1:]:
+        keep, start = 0, None
+        if meta:
+            start = coarsen(grain, since)
+            keep = Table.load(directory, previous, grain).span(None, start)[1]
+        lo, hi = hourly.span(None if start is None else first_hour(grain, start), None)
+        rows[grain] = _write(directory, generation, grain, previous, keep,
+                             _coarse_rows(grain, hourly.rows_between(lo, hi)))
+
+    db.session.rollback()
+    new_meta = {'generation': generation, 'watermark': now_hour, 'rows': rows,
+                'built_at': datetime.utcnow().isoformat()}
+    tmp_path = os.path.join(directory, f'meta.json.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(new_meta, f)
+    os.replace(tmp_path, os.path.join(directory, 'meta.json'))
+    # Keep the previous generation for readers that loaded it a moment ago
+    for entry in os.listdir(directory):
+        if entry.startswith('g') and entry[1:].isdigit() and int(entry[1:]) < generation - 1:
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+    return new_meta
+
+
+# -- queries ----------------------------------------------------------------
+
+def _conversion(orders, completed):
+    return round(completed / orders, 4) if orders else 0.0
+
+
+def revenue_series(grain='daily', start=None, end=None, product_id=None):
+    """Orders, completions, revenue and conversion per bucket in [start, end)"""
+    if grain not in GRAINS:
+        raise ValueError(f'Unknown grain {grain!r}')
+    table = get_table(grain)
+    series = {'grain': grain, 'buckets': [], 'orders': [], 'completed': [], 'revenue': [], 'conversion': []}
+    if table is None:
+        return series
+    lo, hi = table.span(bucket_for(grain, start), bucket_for(grain, end))
+    columns = {name: table.columns[name][lo:hi] for name, _, _ in COLUMNS}
+
+    if numpy is not None:
+        if product_id is not None:
+            mask = columns['product_id'] == product_id
+            columns = {name: values[mask] for name, values in columns.items()}
+        buckets, inverse = numpy.unique(columns['bucket'], return_inverse=True)
+        totals = [numpy.bincount(inverse, weights=columns[name], minlength=len(buckets)).tolist()
+                  for name in ('orders', 'completed', 'revenue')]
+        rows = zip(buckets.tolist(), *totals)
+    else:
+        grouped = {}
+        for bucket, pid, orders, completed, revenue in zip(*(columns[name] for name, _, _ in COLUMNS)):
+            if product_id is None or pid == product_id:
+                entry = grouped.setdefault(bucket, [0, 0, 0.0])
+                entry[0] += orders
+                entry[1] += completed
+                entry[2] += revenue
+        rows = ((bucket, *grouped[bucket]) for bucket in sorted(grouped))
+
+    for bucket, orders, completed, revenue in rows:
+        series['buckets'].append(label(grain, bucket))
+        series['orders'].append(int(orders))
+        series['completed'].append(int(completed))
+        series['revenue'].append(round(revenue, 2))
+        series['conversion'].append(_conversion(orders, completed))
+    return series
+
+
+def product_sales(grain='daily', start=None, end=None, limit=20):
+    """Per-product totals over [start, end), best revenue first"""
+    if grain not in GRAINS:
+        raise ValueError(f'Unknown grain {grain!r}')
+    table = get_table(grain)
+    if table is None:
+        return []
+    lo, hi = table.span(bucket_for(grain, start), bucket_for(grain, end))
+    columns = {name: table.columns[name][lo:hi] for name, _, _ in COLUMNS}
+
+    if numpy is not None:
+        if not len(columns['product_id']):
+            return []
+        ids = columns['product_id']
+        totals = {name: numpy.bincount(ids, weights=columns[name]) for name in ('orders', 'completed', 'revenue')}
+        present = numpy.nonzero(totals['orders'])[0]
+        ranked = present[numpy.argsort(-totals['revenue'][present], kind='stable')][:limit]
+        rows = [(int(pid), totals['orders'][pid], totals['completed'][pid], totals['revenue'][pid])
+                for pid in ranked]
+    else:
+        grouped = {}
+        for pid, orders, completed, revenue in zip(columns['product_id'], columns['orders'],
+                                                   columns['completed'], columns['revenue']):
+            entry = grouped.setdefault(pid, [0, 0, 0.0])
+            entry[0] += orders
+            entry[1] += completed
+            entry[2] += revenue
+        ranked = sorted(grouped, key=lambda pid: (-grouped[pid][2], pid))[:limit]
+        rows = [(pid, *grouped[pid]) for pid in ranked]
+
+    return [{'product_id': pid, 'orders': int(orders), 'completed': int(completed),
+             'revenue': round(float(revenue), 2), 'conversion': _conversion(orders, completed)}
+            for pid, orders, completed, revenue in rows]
@@ -0,0 +1,159 @@
+"""
+Fingerprinted, precompressed static assets.
+
+build_assets.py copies every file under app/static (except runtime uploads
+in images/products) to static/dist/<dir>/<name>.<hash>.<ext>, where <hash>
+is taken from the file's SHA-256, and writes .gz and (with the brotli
+package) .br variants next to each compressible file. A manifest maps the
+original names to the hashed ones:
+
+    {"files": {"js/resumable_upload.js": "js/resumable_upload.1f3a9c0d2b7e.js"},
+     "encodings": {"js/resumable_upload.1f3a9c0d2b7e.js": ["br", "gzip"]}}
+
+With the manifest present, url_for('static', filename=...) points at the
+hashed copy, which is served with the best precompressed variant the client
+accepts and a one-year immutable Cache-Control. Files of older builds are
+left in place so pages rendered before a deploy keep working. Without a
+manifest (development) static files are served by Flask as usual.
+
+The manifest is read when the app starts: run the build before starting or
+restarting workers.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+from flask import current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+EXTENSION_KEY = 'assets'
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+SKIP = ('dist', 'images/products')  # build output, admin uploads
+COMPRESSIBLE = {'.css', '.js', '.mjs', '.json', '.map', '.svg', '.txt', '.html', '.xml', '.ico', '.ttf', '.otf'}
+MIN_COMPRESS_SIZE = 512  # smaller files gain nothing over the extra round of headers
+HASH_LENGTH = 12
+MAX_AGE = 365 * 24 * 3600
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))  # in order of preference
+
+
+def fingerprint(relative_path, data):
+    """js/app.js -> js/app.<hash>.js"""
+    stem, extension = os.path.splitext(relative_path)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{extension}'
+
+
+def _write(path, data):
+    """Write path atomically, skipping files a previous build already wrote"""
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def _compress(data):
+    """{encoding: bytes} for the variants that come out smaller than data"""
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: compressed for encoding, compressed in variants.items() if len(compressed) < len(data)}
+
+
+def build(static_folder):
+    """Fingerprint and precompress static_folder into static_folder/dist; returns the manifest"""
+    dist = os.path.join(static_folder, DIST)
+    manifest = {'files': {}, 'encodings': {}}
+    for root, directories, filenames in os.walk(static_folder):
+        relative_root = os.path.relpath(root, static_folder).replace(os.sep, '/')
+        relative_root = '' if relative_root == '.' else f'{relative_root}/'
+        directories[:] = sorted(d for d in directories if f'{relative_root}{d}' not in SKIP)
+        for filename in sorted(filenames):
+            if filename.startswith('.'):
+                continue
+            relative_path = f'{relative_root}{filename}'
+            with open(os.path.join(root, filename), 'rb') as f:
+                data = f.read()
+            hashed = fingerprint(relative_path, data)
+            target = os.path.join(dist, *hashed.split('/'))
+            _write(target, data)
+            manifest['files'][relative_path] = hashed
+            if os.path.splitext(filename)[1].lower() in COMPRESSIBLE and len(data) >= MIN_COMPRESS_SIZE:
+                variants = _compress(data)
+                for encoding, suffix in ENCODINGS:
+                    if encoding in variants:
+                        _write(target + suffix, variants[encoding])
+                if variants:
+                    manifest['encodings'][hashed] = [encoding for encoding, _ in ENCODINGS if encoding in variants]
+    os.makedirs(dist, exist_ok=True)
+    temporary = os.path.join(dist, f'{MANIFEST}.tmp')
+    with open(temporary, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temporary, os.path.join(dist, MANIFEST))
+    return manifest
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, DIST, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return {'files': manifest.get('files', {}), 'encodings': manifest.get('encodings', {}),
+            'hashed': set(manifest.get('files', {}).values())}
+
+
+def init_app(app):
+    """Point url_for('static') at the fingerprinted build, if there is one"""
+    manifest = load_manifest(app.static_folder)
+    app.extensions[EXTENSION_KEY] = manifest
+    if manifest is None:
+        return
+
+    @app.url_defaults
+    def _fingerprint(endpoint, values):
+        if endpoint == 'static':
+            hashed = manifest['files'].get(values.get('filename'))
+            if hashed is not None:
+                values['filename'] = f'{DIST}/{hashed}'
+
+    app.view_functions['static'] = serve_static
+
+
+def _pick_encoding(available):
+    """The preferred encoding among the precompressed variants that the client accepts"""
+    accepted = request.accept_encodings
+    for encoding, suffix in ENCODINGS:
+        if encoding in available and accepted[encoding]:
+            return encoding, suffix
+    return None, ''
+
+
+def serve_static(filename):
+    """Static files: hashed build output gets its precompressed variant and immutable caching"""
+    app = current_app._get_current_object()
+    manifest = app.extensions.get(EXTENSION_KEY)
+    prefix = f'{DIST}/'
+    if manifest is None or not filename.startswith(prefix) or filename[len(prefix):] not in manifest['hashed']:
+        return app.send_static_file(filename)
+
+    hashed = filename[len(prefix):]
+    available = manifest['encodings'].get(hashed, ())
+    encoding, suffix = _pick_encoding(available)
+    mimetype = mimetypes.guess_type(hashed)[0] or 'application/octet-stream'
+    response = send_from_directory(os.path.join(app.static_folder, DIST), hashed + suffix,
+                                   mimetype=mimetype, max_age=MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if available:
+        response.vary.add('Accept-Encoding')
+    return response
@@ -1,9 +1,16 @@
 from flask import render_template, request, redirect, url_for, flash
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash
 from . import auth_bp
 from ..models import User
 from ..extensions import db
+from ..passwords import HasherBusy
+
+@auth_bp.errorhandler(HasherBusy)
+def hasher_busy(error):
+    """Shed load instead of queueing more password hashes than the pool can take"""
+    flash('We are handling a lot of sign-ins right now. Please try again in a moment.', 'error')
+    template = 'register.html' if request.endpoint == 'auth.register' else 'login.html'
+    return render_template(template), 503, {'Retry-After': '5'}
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -16,6 +23,8 @@ def login():
         user = User.query.filter_by(email=email).first()
         
         if user and user.check_password(password):
+            if db.session.is_modified(user):
+                db.session.commit()  # password hash upgraded to the current parameters
             login_user(user)
             flash('Login successful!', 'success')
             return redirect(url_for('dashboard.dashboard_home'))
@@ -0,0 +1,293 @@
+"""
+Content-addressed storage for ebook and video files.
+
+Files are stored once under their SHA-256 (content/ebooks/<sha256>.pdf), so
+uploading the same file twice, or through both the single and the bulk
+upload, keeps a single copy. A BlobRef row links each product to the blob its
+file_url points at and Blob.refcount counts them; deleting or re-pointing a
+product only drops the reference. gc() later removes blobs that have had no
+references for BLOB_GC_GRACE seconds (python gc_content.py).
+
+The file name is the hash, so the hash doubles as a strong ETag that never
+changes and clients can revalidate without the server touching the file.
+"""
+import hashlib
+import os
+import re
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import bindparam, case, delete, exists, func, insert, or_, select, update
+from . import jobs
+from .downloads import CONTENT_KINDS, split_content_path
+from .entitlements import move_content
+from .extensions import db
+from .models import Blob, BlobRef, Product, Upload
+from .utils import content_dir
+
+BLOB_NAME_RE = re.compile(r'^([0-9a-f]{64})\.([0-9a-z]+)$')
+CHUNK_SIZE = 1024 * 1024
+
+
+def blob_etag(filename):
+    """The SHA-256 of a content-addressed file name, or None for other files"""
+    match = BLOB_NAME_RE.match(filename)
+    return match.group(1) if match else None
+
+
+def is_blob(content_path):
+    parts = split_content_path(content_path)
+    return parts is not None and blob_etag(parts[1]) is not None
+
+
+def hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def place_file(kind, path, extension, sha256):
+    """Move a hashed file into the store (files only, no session: safe in worker threads).
+
+    Returns (content_path, size); if the same content is already stored,
+    path is simply removed.
+    """
+    extension = extension.lower()
+    filename = f'{sha256}.{extension}'
+    target = os.path.join(content_dir(kind), filename)
+    size = os.path.getsize(path)
+    if os.path.realpath(path) != os.path.realpath(target):
+        if os.path.exists(target):
+            os.remove(path)
+        else:
+            os.replace(path, target)
+    return f'/content/{kind}/{filename}', size
+
+
+def store_file(kind, path, extension, sha256=None):
+    """Move the file at path into the store and return its content path.
+
+    If the same content is already stored, path is simply removed. The Blob
+    row is added to the session; the caller commits.
+    """
+    sha256 = sha256 or hash_file(path)
+    content_path, size = place_file(kind, path, extension, sha256)
+    blob = db.session.get(Blob, content_path)
+    if blob is None:
+        db.session.add(Blob(content_path=content_path, sha256=sha256, size=size,
+                            refcount=0, released_at=datetime.utcnow()))
+        _added(content_path)
+    elif blob.refcount <= 0:
+        # Stored again while unreferenced: restart the grace period so gc() leaves it to be attached
+        blob.released_at = datetime.utcnow()
+    return content_path
+
+
+def _added(content_path):
+    """Queue post-processing for a newly stored blob (PDF page index, video packaging)"""
+    if content_path.startswith('/content/ebooks/') and content_path.endswith('.pdf'):
+        jobs.enqueue('ebooks.index', content_path=content_path)
+    elif content_path.startswith('/content/videos/'):
+        from .packaging import queue_package
+        queue_package(content_path)
+
+
+def _removed(kind, filename):
+    """Delete what post-processing derived from a blob that is being removed"""
+    if kind == 'ebooks':
+        from .ebook_pages import remove_derived
+        remove_derived(filename)
+    else:
+        from .packaging import remove_package
+        remove_package(filename)
+
+
+def store_stream(kind, stream, filename):
+    """Stream an uploaded file (e.g. a werkzeug FileStorage) into the store"""
+    staging = os.path.join(content_dir(kind), '.uploads')
+    os.makedirs(staging, exist_ok=True)
+    path = os.path.join(staging, f'{uuid.uuid4().hex}.part')
+    hasher = hashlib.sha256()
+    try:
+        with open(path, 'wb') as f:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                f.write(chunk)
+                hasher.update(chunk)
+        return store_file(kind, path, filename.rsplit('.', 1)[-1], hasher.hexdigest())
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _adjust(content_path, delta):
+    db.session.execute(
+        update(Blob)
+        .where(Blob.content_path == content_path)
+        .values(refcount=Blob.refcount + delta,
+                released_at=case((Blob.refcount + delta <= 0, datetime.utcnow()), else_=None)))
+
+
+def assign(product, content_path):
+    """Point product.file_url at content_path, keeping references and grants in step (caller commits)"""
+    if product.id is None:
+        db.session.add(product)
+        db.session.flush()
+    old_path = product.file_url
+    ref = db.session.get(BlobRef, product.id)
+    if ref is not None and ref.content_path != content_path:
+        _adjust(ref.content_path, -1)
+        db.session.delete(ref)
+        db.session.flush()
+        ref = None
+    if ref is None and is_blob(content_path):
+        db.session.add(BlobRef(product_id=product.id, content_path=content_path))
+        _adjust(content_path, 1)
+    move_content(old_path, content_path, product_id=product.id)
+    product.file_url = content_path
+
+
+def release(product):
+    """Drop the product's blob reference (caller commits); the file goes at the next gc()"""
+    ref = db.session.get(BlobRef, product.id)
+    if ref is not None:
+        _adjust(ref.content_path, -1)
+        db.session.delete(ref)
+
+
+def release_many(product_ids):
+    """release() for every product matched by `product_ids` (a list or a subquery), set-based (caller commits)"""
+    counts = db.session.execute(
+        select(BlobRef.content_path, func.count())
+        .where(BlobRef.product_id.in_(product_ids))
+        .group_by(BlobRef.content_path)).all()
+    adjust_many({path: -count for path, count in counts})
+    db.session.execute(delete(BlobRef).where(BlobRef.product_id.in_(product_ids)))
+
+
+def adjust_many(deltas):
+    """_adjust() for {content_path: delta} in one executemany"""
+    if not deltas:
+        return
+    now = datetime.utcnow()
+    db.session.execute(
+        update(Blob.__table__)
+        .where(Blob.content_path == bindparam('path'))
+        .values(refcount=Blob.refcount + bindparam('delta'),
+                released_at=case((Blob.refcount + bindparam('delta') <= 0, now), else_=None)),
+        [{'path': path, 'delta': delta} for path, delta in deltas.items()])
+
+
+def add_blobs(blobs):
+    """Insert Blob rows for {content_path: (sha256, size)} not stored yet (caller commits)"""
+    paths = list(blobs)
+    existing = set(db.session.scalars(select(Blob.content_path).where(Blob.content_path.in_(paths))))
+    now = datetime.utcnow()
+    missing = [{'content_path': path, 'sha256': blobs[path][0], 'size': blobs[path][1], 'refcount': 0,
+                'released_at': now} for path in paths if path not in existing]
+    if existing:
+        # As in store_file: unreferenced blobs stored again get a fresh grace period
+        db.session.execute(update(Blob.__table__)
+                           .where(Blob.content_path.in_(existing), Blob.refcount <= 0)
+                           .values(released_at=now))
+    if missing:
+        db.session.execute(insert(Blob.__table__), missing)
+        for row in missing:
+            _added(row['content_path'])
+
+
+def reference_many(refs):
+    """assign() for freshly inserted products: [(product_id, content_path)] (caller commits)"""
+    refs = [(product_id, path) for product_id, path in refs if is_blob(path)]
+    if not refs:
+        return
+    db.session.execute(insert(BlobRef.__table__), [{'product_id': product_id, 'content_path': path}
+                                                   for product_id, path in refs])
+    counts = {}
+    for _, path in refs:
+        counts[path] = counts.get(path, 0) + 1
+    adjust_many(counts)
+
+
+def gc(grace=None, dry_run=False):
+    """Delete unreferenced blobs released more than `grace` seconds ago; returns their paths"""
+    grace = current_app.config['BLOB_GC_GRACE'] if grace is None else grace
+    cutoff = datetime.utcnow() - timedelta(seconds=grace)
+    candidates = db.session.scalars(
+        select(Blob).where(
+            Blob.released_at <= cutoff,
+            ~exists().where(BlobRef.content_path == Blob.content_path),
+            # Products written by older scripts may point at a blob without a ref
+            ~exists().where(Product.file_url == Blob.content_path),
+            ~_pending_upload(Blob.content_path))).all()
+
+    removed = []
+    for blob in candidates:
+        kind, filename = split_content_path(blob.content_path)
+        if not dry_run:
+            try:
+                os.remove(os.path.join(content_dir(kind), filename))
+            except FileNotFoundError:
+                pass
+            _removed(kind, filename)
+            db.session.delete(blob)
+        removed.append(blob.content_path)
+
+    # Hash-named files with no Blob row (e.g. a request that failed before committing)
+    tracked = set(db.session.scalars(select(Blob.content_path)))
+    for kind in CONTENT_KINDS:
+        directory = content_dir(kind)
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.scandir(directory):
+            content_path = f'/content/{kind}/{entry.name}'
+            if (blob_etag(entry.name) and content_path not in tracked
+                    and entry.stat().st_mtime <= cutoff.timestamp()
+                    and not is_referenced(content_path)):
+                if not dry_run:
+                    os.remove(entry.path)
+                    _removed(kind, entry.name)
+                removed.append(content_path)
+    if not dry_run:
+        db.session.commit()
+    return removed
+
+
+def _pending_upload(content_path):
+    """EXISTS clause: a finished resumable upload of content_path not yet attached to a product"""
+    return exists().where(Upload.file_url == content_path,
+                          or_(Upload.product_id.is_(None), Upload.status != 'ready'))
+
+
+def is_referenced(content_path):
+    return db.session.query(exists().where(Product.file_url == content_path)).scalar() \
+        or db.session.query(_pending_upload(content_path)).scalar()
+
+
+def adopt_legacy():
+    """Move product files saved as <uuid>_<name> into the store, merging duplicates"""
+    adopted = 0
+    for product in Product.query.filter(Product.file_url.isnot(None)).all():
+        parts = split_content_path(product.file_url)
+        if parts is None:
+            continue
+        kind, filename = parts
+        path = os.path.join(content_dir(kind), filename)
+        if is_blob(product.file_url):
+            if db.session.get(Blob, product.file_url) is None and os.path.exists(path):
+                store_file(kind, path, filename.rsplit('.', 1)[-1], blob_etag(filename))
+                db.session.flush()
+            if db.session.get(BlobRef, product.id) is None and db.session.get(Blob, product.file_url):
+                db.session.add(BlobRef(product_id=product.id, content_path=product.file_url))
+                _adjust(product.file_url, 1)
+            continue
+        if not os.path.exists(path) or '.' not in filename:
+            continue
+        content_path = store_file(kind, path, filename.rsplit('.', 1)[-1])
+        db.session.flush()
+        # Buyers of this product keep access: their grants follow the file
+        assign(product, content_path)
+        adopted += 1
+    db.session.commit()
+    return adopted
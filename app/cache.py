@@ -0,0 +1,96 @@
+"""
+In-process caching helpers shared by the content, catalog and auth layers
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe LRU cache with an optional per-entry TTL (in seconds)"""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+
+class VersionStamp:
+    """Cross-process version counter stored in a small file.
+
+    Readers only stat() the file and re-read it when it changes, so checking
+    the version costs no database query. bump() writes a strictly larger
+    nanosecond timestamp through an atomic rename, so concurrent bumps from
+    different workers never collapse into the same value.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._stat_key = None
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def current(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return 0
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key != self._stat_key:
+            try:
+                with open(self.path) as f:
+                    value = int(f.read().strip() or 0)
+            except (OSError, ValueError):
+                return self._value
+            with self._lock:
+                self._stat_key, self._value = key, value
+        return self._value
+
+    def bump(self):
+        value = max(time.time_ns(), self.current() + 1)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(value))
+        os.replace(tmp_path, self.path)
+        return value
@@ -0,0 +1,149 @@
+"""
+Versioned, in-process repository of every product the store can show.
+
+Database products and the catalogs kept in code (STATIC_PRODUCTS in
+store/routes.py and main/routes.py, EBOOKS in ebooks_catalog.py) are loaded
+once per catalog version into one immutable Catalog of CatalogProduct
+records, indexed by id (database rows win over static entries with the same
+id) and grouped by category for the storefront listings. Admin writes call
+bump_version(); every worker notices the new version on its next request (a
+stat() of a file in STATE_DIR) and reloads, so steady-state catalog pages
+and product lookups run no queries at all.
+"""
+import os
+import threading
+from types import MappingProxyType
+from typing import NamedTuple, Optional
+from datetime import datetime
+from flask import current_app
+from .cache import VersionStamp
+from .extensions import db
+from .models import Product
+from .routing import primary
+
+EXTENSION_KEY = 'catalog'
+FEATURED_COUNT = 4
+
+
+class CatalogProduct(NamedTuple):
+    """Read-only product snapshot used by catalog templates and store routes"""
+    id: int
+    name: str
+    description: str
+    price: float
+    category: str
+    image_url: Optional[str] = None
+    file_url: Optional[str] = None
+    is_active: bool = True
+    created_at: Optional[datetime] = None
+    title: Optional[str] = None  # display title of some static products
+
+    @classmethod
+    def from_model(cls, product):
+        return cls(product.id, product.name, product.description, product.price,
+                   product.category, product.image_url, product.file_url,
+                   bool(product.is_active), product.created_at)
+
+    @classmethod
+    def from_dict(cls, data):
+        fields = {field: data[field] for field in cls._fields if field in data}
+        fields.setdefault('name', data.get('title'))
+        fields['price'] = float(fields['price'])
+        return cls(**fields)
+
+
+class Catalog(NamedTuple):
+    version: int
+    featured: tuple
+    by_category: MappingProxyType  # listed (active) products per category, in storefront order
+    by_id: MappingProxyType  # every product from every source, active or not
+
+    def category(self, name):
+        return self.by_category.get(name, ())
+
+    def get(self, product_id):
+        return self.by_id.get(product_id)
+
+
+class _CatalogState:
+    def __init__(self, stamp):
+        self.stamp = stamp
+        self.catalog = None
+        self.lock = threading.Lock()
+
+
+def init_app(app):
+    stamp = VersionStamp(os.path.join(app.config['STATE_DIR'], 'catalog.version'))
+    app.extensions[EXTENSION_KEY] = _CatalogState(stamp)
+
+
+def _state():
+    return current_app.extensions[EXTENSION_KEY]
+
+
+def bump_version():
+    """Invalidate the catalog in every worker; call after committing product changes"""
+    state = _state()
+    with state.lock:
+        state.catalog = None
+    return state.stamp.bump()
+
+
+def static_products():
+    """(record, listed) for the catalogs kept in code, highest precedence first"""
+    from ebooks_catalog import EBOOKS
+    from .main.routes import STATIC_PRODUCTS as MAIN_PRODUCTS
+    from .store.routes import STATIC_PRODUCTS as STORE_PRODUCTS
+    # Only main.routes' entries are listed on the storefront; the others are reachable by id
+    return ([(CatalogProduct.from_dict(data), False) for data in STORE_PRODUCTS.values()]
+            + [(CatalogProduct.from_dict(data), True) for data in MAIN_PRODUCTS.values()]
+            + [(CatalogProduct.from_dict(data), False) for data in EBOOKS])
+
+
+def _load(version):
+    # Kept until the next version bump, so never built from a lagging replica
+    with primary():
+        products = Product.query.order_by(Product.id).all()
+    db_products = tuple(CatalogProduct.from_model(p) for p in products)
+    static = static_products()
+
+    by_id = {}
+    for product in db_products + tuple(product for product, _ in static):
+        by_id.setdefault(product.id, product)
+
+    listed = [p for p in db_products if p.is_active] + [p for p, is_listed in static if is_listed]
+    by_category = {}
+    for product in listed:
+        by_category.setdefault(product.category, []).append(product)
+    return Catalog(
+        version=version,
+        featured=tuple(p for p in db_products if p.is_active)[:FEATURED_COUNT],
+        by_category=MappingProxyType({name: tuple(items) for name, items in by_category.items()}),
+        by_id=MappingProxyType(by_id),
+    )
+
+
+def get_catalog():
+    """Return the current catalog, reloading it if the version has moved"""
+    state = _state()
+    version = state.stamp.current()
+    catalog = state.catalog
+    if catalog is not None and catalog.version == version:
+        return catalog
+    with state.lock:
+        if state.catalog is None or state.catalog.version != version:
+            state.catalog = _load(version)
+        return state.catalog
+
+
+def get_product(product_id):
+    """Product record by id from any source, or None.
+
+    Served from the catalog; only ids it does not know (a row written since
+    the last version bump without bumping it, or no such product) cost a query.
+    """
+    product = get_catalog().get(product_id)
+    if product is None:
+        row = db.session.get(Product, product_id)
+        product = CatalogProduct.from_model(row) if row is not None else None
+    return product
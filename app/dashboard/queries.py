@@ -0,0 +1,94 @@
+"""
+Read-side queries for the user dashboard and order history.
+
+Orders are always loaded with their product in the same statement, and the
+per-category / per-status figures shown on the pages are computed alongside,
+so the number of SQL statements per page does not grow with the number of
+purchases.
+"""
+from datetime import datetime
+from typing import NamedTuple, Optional
+from sqlalchemy import func, or_, and_
+from sqlalchemy.orm import joinedload
+from ..extensions import db
+from ..models import Order
+
+ORDERS_PER_PAGE = 20
+
+
+class Library(NamedTuple):
+    """Completed purchases plus the counts shown on the dashboard"""
+    orders: list
+    ebook_count: int
+    course_count: int
+
+
+class OrderSummary(NamedTuple):
+    total: int
+    completed: int
+    pending: int
+    spent: float
+
+
+class OrderPage(NamedTuple):
+    orders: list
+    summary: OrderSummary
+    next_cursor: Optional[str]
+
+
+def user_library(user_id):
+    """Completed orders for user_id, newest first, with products eager-loaded"""
+    orders = (Order.query
+              .options(joinedload(Order.product))
+              .filter(Order.user_id == user_id, Order.payment_status == 'completed')
+              .order_by(Order.created_at.desc(), Order.id.desc())
+              .all())
+    categories = [order.product.category for order in orders if order.product]
+    ebooks = categories.count('ebook')
+    courses = categories.count('course')
+    return Library(orders, ebooks, courses)
+
+
+def encode_cursor(order):
+    return f'{order.created_at.isoformat()}_{order.id}'
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, order_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(order_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def order_summary(user_id):
+    """Totals across all of a user's orders, in one grouped statement"""
+    rows = (db.session.query(Order.payment_status, func.count(Order.id), func.sum(Order.amount))
+            .filter(Order.user_id == user_id)
+            .group_by(Order.payment_status)
+            .all())
+    counts = {status: count for status, count, _ in rows}
+    return OrderSummary(
+        total=sum(counts.values()),
+        completed=counts.get('completed', 0),
+        pending=counts.get('pending', 0),
+        spent=sum(amount or 0 for _, _, amount in rows),
+    )
+
+
+def order_history(user_id, cursor=None, per_page=ORDERS_PER_PAGE):
+    """One keyset page of a user's orders, newest first"""
+    query = (Order.query
+             .options(joinedload(Order.product))
+             .filter(Order.user_id == user_id))
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        created_at, order_id = position
+        query = query.filter(or_(
+            Order.created_at < created_at,
+            and_(Order.created_at == created_at, Order.id < order_id)))
+    orders = (query.order_by(Order.created_at.desc(), Order.id.desc())
+              .limit(per_page + 1)
+              .all())
+    next_cursor = encode_cursor(orders[per_page - 1]) if len(orders) > per_page else None
+    return OrderPage(orders[:per_page], order_summary(user_id), next_cursor)
@@ -1,19 +1,22 @@
-from flask import render_template, send_file, abort, redirect
+from flask import render_template, send_file, abort, redirect, request
 from flask_login import login_required, current_user
 from . import dashboard_bp
-from ..models import Order, Product
+from ..extensions import db
+from ..models import Order, Product, User
+from ..downloads import make_download_url
+from .queries import user_library, order_history
+from ..routing import use_replica
 import os
 
 @dashboard_bp.route('/')
 @login_required
 def dashboard_home():
-    # Get user's completed orders
-    completed_orders = Order.query.filter_by(
-        user_id=current_user.id, 
-        payment_status='completed'
-    ).all()
+    # Get user's completed orders with their products in a single query
+    library = user_library(current_user.id)
     
-    return render_template('dashboard.html', orders=completed_orders)
+    return render_template('dashboard.html', orders=library.orders,
+                           ebook_count=library.ebook_count,
+                           course_count=library.course_count)
 
 @dashboard_bp.route('/download/<int:order_id>')
 @login_required
@@ -32,18 +35,21 @@ def download_content(order_id):
     if not order.product.file_url:
         abort(404)
     
-    # For now, we'll just redirect to the file URL
-    # In production, you might want to serve files securely
-    return redirect(order.product.file_url)
+    # Redirect to a signed, expiring URL so the file itself is served without
+    # another session/purchase check (and by the front proxy when offload is on)
+    download_url = make_download_url(order.product.file_url, current_user.id)
+    return redirect(download_url or order.product.file_url)
 
 @dashboard_bp.route('/profile')
 @login_required
 def profile():
-    return render_template('profile.html', user=current_user)
+    return render_template('profile.html', user=db.session.get(User, current_user.id))
 
 @dashboard_bp.route('/orders')
+@use_replica
 @login_required
 def orders():
-    # Get all user's orders
-    orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).all()
-    return render_template('orders.html', orders=orders)
+    # Get one keyset page of the user's orders, newest first
+    page = order_history(current_user.id, request.args.get('before'))
+    return render_template('orders.html', orders=page.orders, summary=page.summary,
+                           next_cursor=page.next_cursor)
@@ -0,0 +1,89 @@
+"""
+Engine tuning for the main database.
+
+SQLite (the default) gets WAL journaling, so readers never block the writer,
+synchronous=NORMAL (no fsync per commit; still crash-safe in WAL mode), a
+busy_timeout so a concurrent commit waits for the write lock instead of
+failing with "database is locked", and a larger page cache plus mmap for
+reads. The pragmas are applied on every new connection.
+
+Postgres (DATABASE_URL=postgresql://...) gets a sized QueuePool with
+pre-ping, connection recycling and a server-side statement_timeout.
+
+Read replicas (SQLALCHEMY_REPLICA_URIS) get the same treatment; see
+routing.py for which queries use them.
+
+Everything is set through Config / the environment; options given in
+SQLALCHEMY_ENGINE_OPTIONS take precedence.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from .routing import replica_binds
+
+
+def engine_options(config, uri=None):
+    """SQLAlchemy create_engine() keyword arguments for the configured backend"""
+    url = make_url(uri or config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite':
+        # Python's sqlite3 timeout is the busy handler used before the first PRAGMA runs
+        return {'connect_args': {'timeout': config['SQLITE_BUSY_TIMEOUT'] / 1000}}
+    if url.get_backend_name() == 'postgresql':
+        return {
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+            'pool_recycle': config['DB_POOL_RECYCLE'],
+            'pool_pre_ping': True,
+            'connect_args': {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT']}"},
+        }
+    return {}
+
+
+def sqlite_pragmas(config):
+    return (
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT'])}",
+        f"PRAGMA cache_size={int(config['SQLITE_CACHE_SIZE'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+    )
+
+
+def configure(app):
+    """Fill in SQLALCHEMY_ENGINE_OPTIONS; call before db.init_app(app)"""
+    app.config.setdefault('SQLITE_JOURNAL_MODE', 'WAL')
+    app.config.setdefault('SQLITE_SYNCHRONOUS', 'NORMAL')
+    app.config.setdefault('SQLITE_BUSY_TIMEOUT', 5000)
+    app.config.setdefault('SQLITE_CACHE_SIZE', -64000)
+    app.config.setdefault('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+    app.config.setdefault('DB_POOL_SIZE', 10)
+    app.config.setdefault('DB_MAX_OVERFLOW', 20)
+    app.config.setdefault('DB_POOL_TIMEOUT', 10)
+    app.config.setdefault('DB_POOL_RECYCLE', 1800)
+    app.config.setdefault('DB_STATEMENT_TIMEOUT', 5000)
+    options = engine_options(app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    # Read replicas are plain binds without models; routing.py decides when to use them
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for key, uri in zip(replica_binds(app.config), app.config.get('SQLALCHEMY_REPLICA_URIS') or ()):
+        binds[key] = dict(engine_options(app.config, uri), url=uri)
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def init_app(app, db):
+    """Apply the SQLite pragmas to each connection of the app's SQLite engines"""
+    pragmas = sqlite_pragmas(app.config)
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', on_connect)
@@ -0,0 +1,324 @@
+"""
+Page-level delivery for PDF ebooks.
+
+When a PDF enters the content store, an 'ebooks.index' job records which
+objects each page uses and where they sit in the file. The index is kept next
+to the blob, in content/ebooks/.pages/<sha256>.json. With it:
+
+  - /content/ebooks/<file>/pages/<first>-<last> sends a buyer just those
+    pages as a standalone PDF, copied object by object from the blob;
+  - /content/ebooks/<file>/index gives a reader the page count and the byte
+    ranges each page needs, for Range requests against the full file;
+  - /store/product/<id>/preview.pdf is a free excerpt of the first
+    EBOOK_PREVIEW_PAGES pages, written by the job to .pages/<sha256>.preview-<n>.pdf.
+
+Requests only read what the job has written. A blob without an index or
+preview (stored before indexing existed, or EBOOK_PREVIEW_PAGES changed) is
+queued for the job when first asked for and has no page API or preview until
+it has run. Blobs are content-addressed, so the index and previews never go stale.
+blobs.gc() removes them together with the blob. Files the reader cannot index
+(encrypted, damaged, unusual stream filters) are still downloadable whole;
+they only have no page API or preview.
+"""
+import glob
+import json
+import os
+import uuid
+from flask import current_app
+from . import jobs
+from .blobs import blob_etag
+from .cache import LRUCache
+from .downloads import split_content_path
+from .models import Product
+from .page_cache import purge_products
+from .pdf import PDFError, PDFReader, Ref, parse, refs_in, serialize
+from .utils import content_dir
+
+EXTENSION_KEY = 'ebook_pages'
+INDEX_VERSION = 1
+DERIVED_DIR = '.pages'
+MAX_EXCERPT_PAGES = 50
+COPY_CHUNK = 256 * 1024
+RANGE_GAP = 64  # merge byte ranges separated by at most this much whitespace
+REQUEUE_AFTER = 300  # a process asks for the same missing index or preview at most this often (seconds)
+HEADER = b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n'
+
+
+def init_app(app):
+    app.config.setdefault('EBOOK_PREVIEW_PAGES', 5)
+    app.extensions[EXTENSION_KEY] = LRUCache(maxsize=256)
+
+
+def derived_dir():
+    return os.path.join(content_dir('ebooks'), DERIVED_DIR)
+
+
+def _source(filename):
+    """Path of a stored ebook blob, or None"""
+    if not filename.lower().endswith('.pdf') or blob_etag(filename) is None:
+        return None
+    path = os.path.join(content_dir('ebooks'), filename)
+    return path if os.path.isfile(path) else None
+
+
+def _write_atomic(path, chunks):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        with open(temporary, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def _merge(spans):
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1] + RANGE_GAP:
+            merged[-1][1] = max(end, merged[-1][1])
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def build_index(path):
+    """Page index of the PDF at path; raises PDFError"""
+    with PDFReader(path) as reader:
+        pages = reader.pages()
+        refs = {}
+        spans = {}
+
+        def refs_of(num):
+            if num not in refs:
+                refs[num] = [ref.num for ref in refs_in(reader.get(num))]
+            return refs[num]
+
+        def span_of(num):
+            entry = reader.entries[num]
+            if entry[0] == 'c':
+                return span_of(entry[1])
+            if num not in spans:
+                spans[num] = list(reader.span(num))
+            return spans[num]
+
+        entries = {}
+        page_index = []
+        for page, inherited in pages:
+            needed = set()
+            stack = refs_of(page) + [ref.num for ref in refs_in(inherited)]
+            while stack:
+                num = stack.pop()
+                # Other pages (annotation links, /P back-references) are left out; dangling refs read as null
+                if num in needed or num in reader.tree_nodes or reader.entries.get(num, ('f',))[0] == 'f':
+                    continue
+                needed.add(num)
+                stack.extend(refs_of(num))
+            for num in needed | {page}:
+                entry = reader.entries[num]
+                entries[num] = entry
+                if entry[0] == 'c' and entry[1] not in entries:
+                    # The object stream itself, and its /Length if that is indirect
+                    entries[entry[1]] = reader.entries[entry[1]]
+                    for ref in refs_of(entry[1]):
+                        entries[ref] = reader.entries[ref]
+            page_index.append({
+                'object': page,
+                'inherit': serialize(inherited).decode('latin-1') if inherited else '',
+                'objects': sorted(needed),
+                'ranges': _merge(span_of(num) for num in needed | {page}),
+            })
+    return {
+        'version': INDEX_VERSION,
+        'size': os.path.getsize(path),
+        'next_object': max(reader.entries) + 1,
+        'pages': page_index,
+        'objects': {str(num): list(entry) for num, entry in sorted(entries.items())},
+        'spans': {str(num): span for num, span in sorted(spans.items()) if entries.get(num, ('',))[0] == 'n'},
+    }
+
+
+def _index_path(filename):
+    return os.path.join(derived_dir(), f'{blob_etag(filename)}.json')
+
+
+def _read_index(filename):
+    """The stored index of a blob (possibly an error record), or None if there is no current one"""
+    try:
+        with open(_index_path(filename)) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return index if index.get('version') == INDEX_VERSION else None
+
+
+def _queue(filename):
+    """Ask the 'ebooks.index' job for a missing index or preview"""
+    cache = current_app.extensions[EXTENSION_KEY]
+    if cache.get(('queued', filename)) is None:
+        cache.set(('queued', filename), True, ttl=REQUEUE_AFTER)
+        jobs.enqueue('ebooks.index', content_path=f'/content/ebooks/{filename}')
+
+
+def get_index(filename):
+    """Page index of a stored ebook; None until the job has indexed it, or if it cannot be indexed"""
+    cache = current_app.extensions[EXTENSION_KEY]
+    index = cache.get(filename)
+    if index is not None:
+        return index or None
+    if _source(filename) is None:
+        return None
+    index = _read_index(filename)
+    if index is None:
+        _queue(filename)
+        return None
+    index = {} if 'error' in index else index
+    cache.set(filename, index)
+    return index or None
+
+
+def page_ranges(filename):
+    """{'pages', 'size', 'ranges'} for a linearized reader, or None"""
+    index = get_index(filename)
+    if index is None:
+        return None
+    return {'pages': len(index['pages']), 'size': index['size'],
+            'ranges': [page['ranges'] for page in index['pages']]}
+
+
+def excerpt(filename, first, last):
+    """Pages first..last (1-based, inclusive) as the chunks of a standalone PDF.
+
+    The index is looked up here, so the returned generator can be streamed
+    after the request context is gone.
+    """
+    return _excerpt_chunks(filename, _source(filename), get_index(filename), first, last)
+
+
+def _excerpt_chunks(filename, path, index, first, last):
+    pages = index['pages'][first - 1:last]
+    entries = {int(num): tuple(entry) for num, entry in index['objects'].items()}
+    reader = PDFReader(path, entries=entries)
+    try:
+        page_numbers = {page['object'] for page in pages}
+        inherited = {page['object']: parse(page['inherit'].encode('latin-1') + b' ')[0] if page['inherit'] else {}
+                     for page in pages}
+        numbers = sorted(page_numbers.union(*(page['objects'] for page in pages)))
+        pages_root = index['next_object']  # above every object number in the source
+        catalog = pages_root + 1
+        offsets = {}
+        position = 0
+
+        def emit(chunk):
+            nonlocal position
+            position += len(chunk)
+            return chunk
+
+        yield emit(HEADER)
+        for num in numbers:
+            entry = entries[num]
+            generation = entry[2] if entry[0] == 'n' else 0
+            offsets[num] = (position, generation)
+            if num in page_numbers:
+                page = reader.get(num)
+                page.update(inherited[num])
+                page['Parent'] = Ref(pages_root, 0)
+                yield emit(b'%d %d obj\n' % (num, generation) + serialize(page) + b'\nendobj\n')
+            elif entry[0] == 'c':
+                yield emit(b'%d 0 obj\n' % num + reader.compressed_body(num) + b'\nendobj\n')
+            else:
+                start, end = index['spans'][str(num)]
+                while start < end:
+                    chunk = reader.read(start, min(COPY_CHUNK, end - start))
+                    if not chunk:
+                        raise PDFError(f'{filename} is shorter than its index')
+                    start += len(chunk)
+                    yield emit(chunk)
+                yield emit(b'\n')
+        kids = b' '.join(b'%d %d R' % (page['object'], offsets[page['object']][1]) for page in pages)
+        offsets[pages_root] = (position, 0)
+        yield emit(b'%d 0 obj\n<</Type /Pages /Kids [%s] /Count %d>>\nendobj\n' % (pages_root, kids, len(pages)))
+        offsets[catalog] = (position, 0)
+        yield emit(b'%d 0 obj\n<</Type /Catalog /Pages %d 0 R>>\nendobj\n' % (catalog, pages_root))
+
+        xref = [b'xref\n0 %d\n' % (catalog + 1), b'0000000000 65535 f \n']
+        for num in range(1, catalog + 1):
+            offset, generation = offsets.get(num, (0, None))
+            xref.append(b'%010d 00000 f \n' % 0 if generation is None else b'%010d %05d n \n' % (offset, generation))
+        xref.append(b'trailer\n<</Size %d /Root %d 0 R>>\nstartxref\n%d\n%%%%EOF\n' % (catalog + 1, catalog, position))
+        yield b''.join(xref)
+    finally:
+        reader.close()
+
+
+def page_count(filename):
+    index = get_index(filename)
+    return len(index['pages']) if index else 0
+
+
+def _preview_name(filename):
+    return f"{blob_etag(filename)}.preview-{current_app.config['EBOOK_PREVIEW_PAGES']}.pdf"
+
+
+def preview_file(filename):
+    """Name (in derived_dir()) of the free preview once the job has written it, else None"""
+    if current_app.config['EBOOK_PREVIEW_PAGES'] < 1 or get_index(filename) is None:
+        return None
+    name = _preview_name(filename)
+    if os.path.isfile(os.path.join(derived_dir(), name)):
+        return name
+    _queue(filename)
+    return None
+
+
+def product_ebook(product):
+    """Filename of the PDF blob behind an ebook product, or None"""
+    if getattr(product, 'category', None) != 'ebook':
+        return None
+    parts = split_content_path(getattr(product, 'file_url', None))
+    if parts is None or parts[0] != 'ebooks':
+        return None
+    return parts[1]
+
+
+def remove_derived(filename):
+    """Delete the index and previews of a blob that is being removed"""
+    sha256 = blob_etag(filename)
+    if not sha256:
+        return
+    for path in glob.glob(os.path.join(derived_dir(), f'{sha256}.*')):
+        os.remove(path)
+    current_app.extensions[EXTENSION_KEY].pop(filename)
+
+
+@jobs.handler('ebooks.index')
+def index_ebook(content_path):
+    """Index a stored ebook and write its preview; product pages are purged to link the preview"""
+    parts = split_content_path(content_path)
+    if parts is None or parts[0] != 'ebooks':
+        return
+    filename = parts[1]
+    path = _source(filename)
+    if path is None:
+        return
+    index = _read_index(filename)
+    if index is None:
+        try:
+            index = build_index(path)
+        except PDFError as e:
+            # Remembered, so an unreadable file is not re-parsed
+            current_app.logger.warning(f'Cannot index {filename}: {e}')
+            index = {'version': INDEX_VERSION, 'error': str(e)}
+        _write_atomic(_index_path(filename), [json.dumps(index, separators=(',', ':')).encode()])
+    cache = current_app.extensions[EXTENSION_KEY]
+    cache.pop(('queued', filename))
+    cache.set(filename, {} if 'error' in index else index)
+
+    count = current_app.config['EBOOK_PREVIEW_PAGES']
+    preview_path = os.path.join(derived_dir(), _preview_name(filename))
+    if 'error' in index or count < 1 or os.path.isfile(preview_path):
+        return
+    _write_atomic(preview_path, excerpt(filename, 1, min(count, len(index['pages']))))
+    purge_products(*Product.query.filter_by(file_url=content_path))
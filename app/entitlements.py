@@ -0,0 +1,123 @@
+"""
+Entitlement index for purchased content.
+
+Access checks on /content/* used to join Order and Product on every request.
+Instead, a row is written to the Entitlement table when an order moves to
+'completed', so a check is a single primary-key lookup on
+(user_id, content_path), fronted by a per-process LRU cache.
+"""
+from flask import current_app
+from sqlalchemy import and_, exists, insert, literal, select, update
+from .cache import LRUCache
+from .extensions import db
+from .models import Entitlement, Order, Product
+
+CACHE_KEY = 'entitlement_cache'
+
+
+def init_app(app):
+    """Attach the per-process entitlement cache to the app"""
+    app.config.setdefault('ENTITLEMENT_CACHE_SIZE', 10000)
+    app.config.setdefault('ENTITLEMENT_CACHE_TTL', 300)
+    app.extensions[CACHE_KEY] = LRUCache(
+        maxsize=app.config['ENTITLEMENT_CACHE_SIZE'],
+        ttl=app.config['ENTITLEMENT_CACHE_TTL'])
+
+
+def _cache():
+    return current_app.extensions[CACHE_KEY]
+
+
+def grant_for_order(order):
+    """Record entitlements for a completed order (caller commits)"""
+    product = order.product or db.session.get(Product, order.product_id)
+    if product is None or not product.file_url:
+        return
+    key = (order.user_id, product.file_url)
+    if db.session.get(Entitlement, key) is None:
+        db.session.add(Entitlement(user_id=order.user_id,
+                                   content_path=product.file_url,
+                                   order_id=order.id))
+
+
+def move_content(old_path, new_path, product_id):
+    """Carry product_id's buyers over when its file is replaced (caller commits).
+
+    Only grants that come from product_id's completed orders are touched:
+    deduplicated files can be shared by several products, and a grant for
+    old_path may have been made through another one. If no other product
+    uses old_path, those buyers' grants are re-pointed to new_path;
+    otherwise they get new grants and keep the old ones.
+    """
+    if not old_path or not new_path or old_path == new_path:
+        return
+    buyers = select(Order.user_id).where(Order.product_id == product_id, Order.payment_status == 'completed')
+    shared = db.session.query(exists().where(
+        Product.file_url == old_path, Product.id != product_id)).scalar()
+    if not shared:
+        moved = Entitlement.__table__.alias('moved')
+        db.session.execute(
+            update(Entitlement.__table__)
+            .where(Entitlement.content_path == old_path,
+                   Entitlement.user_id.in_(buyers),
+                   ~exists().where(moved.c.user_id == Entitlement.user_id,
+                                   moved.c.content_path == new_path))
+            .values(content_path=new_path))
+    already_granted = exists().where(and_(
+        Entitlement.user_id == Order.user_id,
+        Entitlement.content_path == new_path))
+    missing = (
+        select(Order.user_id, literal(new_path), db.func.min(Order.id), db.func.min(Order.created_at))
+        .where(Order.product_id == product_id,
+               Order.payment_status == 'completed',
+               ~already_granted)
+        .group_by(Order.user_id)
+    )
+    db.session.execute(insert(Entitlement).from_select(
+        ['user_id', 'content_path', 'order_id', 'granted_at'], missing))
+
+
+def has_access(user_id, content_path):
+    """Return True if the user has purchased the file at content_path"""
+    key = (user_id, content_path)
+    cache = _cache()
+    if cache.get(key):
+        return True
+    if db.session.get(Entitlement, key) is None:
+        return False
+    cache.set(key, True)
+    return True
+
+
+def _grant_completed(*criteria):
+    already_granted = exists().where(and_(
+        Entitlement.user_id == Order.user_id,
+        Entitlement.content_path == Product.file_url))
+    completed = (
+        select(Order.user_id, Product.file_url, db.func.min(Order.id),
+               db.func.min(Order.created_at))
+        .join(Product, Order.product_id == Product.id)
+        .where(Order.payment_status == 'completed',
+               Product.file_url.isnot(None),
+               ~already_granted,
+               *criteria)
+        .group_by(Order.user_id, Product.file_url)
+    )
+    result = db.session.execute(
+        insert(Entitlement).from_select(
+            ['user_id', 'content_path', 'order_id', 'granted_at'], completed))
+    return result.rowcount
+
+
+def grant_for_orders(order_ids):
+    """Record entitlements for a batch of completed orders in one statement (caller commits)"""
+    if not order_ids:
+        return 0
+    return _grant_completed(Order.id.in_(order_ids))
+
+
+def backfill():
+    """Create entitlements for completed orders that predate the index"""
+    granted = _grant_completed()
+    db.session.commit()
+    return granted
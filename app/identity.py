@@ -0,0 +1,167 @@
+"""
+Cached user identities for Flask-Login.
+
+load_user used to query the user table on every authenticated request,
+including each video range request and the admin before_request check. It
+now returns a small Identity snapshot (id, username, email, admin flag) from
+a per-process LRU with a short TTL. Commits that change a user's username,
+email or password, or delete a user, bump a cross-process version stamp, so
+every worker drops its cached identities on the next request.
+
+Sessions remember a fingerprint of the credentials they were created with;
+once the cached identity no longer matches (password or email changed,
+however that happened) the session is treated as logged out. Changes that
+bypass the ORM are picked up when the cache entry expires, so revocation
+takes at most IDENTITY_CACHE_TTL seconds.
+
+With IDENTITY_IN_SESSION the identity itself is carried in the signed
+session cookie for the same TTL, so requests cost no query even on a worker
+whose cache is cold.
+"""
+import hashlib
+import hmac
+import os
+import time
+from typing import NamedTuple
+from flask import current_app, session, has_app_context
+from flask_login import user_logged_in, user_logged_out
+from sqlalchemy import event, inspect
+from .cache import LRUCache, VersionStamp
+from .routing import primary
+
+EXTENSION_KEY = 'identity'
+FINGERPRINT_KEY = '_auth_fp'
+SESSION_KEY = '_identity'
+WATCHED_FIELDS = ('username', 'email', 'password_hash')
+_watching = []
+
+
+class Identity(NamedTuple):
+    """What request handlers and templates need to know about the logged-in user"""
+    id: int
+    username: str
+    email: str
+    fingerprint: str
+
+    # flask_login.UserMixin equivalents
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def get_id(self):
+        return str(self.id)
+
+    @property
+    def is_admin(self):
+        return self.username == 'admin'
+
+
+class _IdentityState:
+    def __init__(self, cache, stamp):
+        self.cache = cache
+        self.stamp = stamp
+
+
+def init_app(app):
+    app.config.setdefault('IDENTITY_CACHE_SIZE', 10000)
+    app.config.setdefault('IDENTITY_CACHE_TTL', 60)
+    app.config.setdefault('IDENTITY_IN_SESSION', False)
+    app.extensions[EXTENSION_KEY] = _IdentityState(
+        LRUCache(maxsize=app.config['IDENTITY_CACHE_SIZE'], ttl=app.config['IDENTITY_CACHE_TTL']),
+        VersionStamp(os.path.join(app.config['STATE_DIR'], 'identity.version')))
+    if not _watching:
+        from .extensions import db
+        watch(db.session)
+
+
+def _state():
+    return current_app.extensions[EXTENSION_KEY]
+
+
+def fingerprint(user):
+    """Short keyed digest of the credentials a session was opened with"""
+    message = f'{user.password_hash}|{user.email}'.encode()
+    return hmac.new(current_app.config['SECRET_KEY'].encode(), message, hashlib.sha256).hexdigest()[:16]
+
+
+def invalidate():
+    """Drop cached identities in every worker"""
+    state = _state()
+    state.cache.clear()
+    state.stamp.bump()
+
+
+def _load(user_id):
+    from .extensions import db
+    from .models import User
+    state = _state()
+    version = state.stamp.current()
+    cached = state.cache.get(user_id)
+    if cached is not None and cached[1] == version:
+        return cached[0]
+    with primary():
+        user = db.session.get(User, user_id)
+    identity = Identity(user.id, user.username, user.email, fingerprint(user)) if user else None
+    state.cache.set(user_id, (identity, version))
+    return identity
+
+
+def load_user(user_id):
+    """Flask-Login user_loader: an Identity, or None if the session was revoked"""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    in_session = current_app.config['IDENTITY_IN_SESSION']
+    if in_session:
+        carried = session.get(SESSION_KEY)
+        if carried and carried['id'] == user_id and carried['expires'] > time.time():
+            return Identity(carried['id'], carried['username'], carried['email'], carried['fingerprint'])
+
+    identity = _load(user_id)
+    if identity is None:
+        return None
+    expected = session.get(FINGERPRINT_KEY)
+    if expected and not hmac.compare_digest(expected, identity.fingerprint):
+        return None
+    if in_session:
+        session[SESSION_KEY] = dict(identity._asdict(),
+                                    expires=time.time() + current_app.config['IDENTITY_CACHE_TTL'])
+    return identity
+
+
+@user_logged_in.connect
+def _remember_fingerprint(app, user):
+    session[FINGERPRINT_KEY] = fingerprint(user)
+    session.pop(SESSION_KEY, None)
+
+
+@user_logged_out.connect
+def _forget_identity(app, user):
+    session.pop(FINGERPRINT_KEY, None)
+    session.pop(SESSION_KEY, None)
+
+
+def watch(session_factory):
+    """Bump the identity version after commits that change or delete users"""
+    from .models import User
+    _watching.append(session_factory)
+
+    @event.listens_for(session_factory, 'after_flush')
+    def _after_flush(db_session, flush_context):
+        changed = any(
+            isinstance(obj, User) and any(inspect(obj).attrs[name].history.has_changes()
+                                          for name in WATCHED_FIELDS)
+            for obj in db_session.dirty)
+        if changed or any(isinstance(obj, User) for obj in db_session.deleted):
+            db_session.info['identity_changed'] = True
+
+    @event.listens_for(session_factory, 'after_commit')
+    def _after_commit(db_session):
+        if db_session.info.pop('identity_changed', False) and has_app_context() \
+                and EXTENSION_KEY in current_app.extensions:
+            invalidate()
+
+    @event.listens_for(session_factory, 'after_rollback')
+    def _after_rollback(db_session):
+        db_session.info.pop('identity_changed', None)
@@ -0,0 +1,251 @@
+"""
+Responsive product image variants.
+
+Admin uploads are stored as-is in static/images/products. Catalog and admin
+templates link to width-bucketed WebP and JPEG derivatives instead,
+
+    /images/products/<width>/<image filename>.<webp|jpg>
+
+which are rendered with Pillow on first request (or by the 'images.warm'
+job queued at upload time) and kept in STATE_DIR/image_cache. That cache is
+bounded by IMAGE_CACHE_MAX_BYTES: a hit refreshes the file's mtime, and once
+the cache grows past the limit the least recently used variants are deleted.
+Upload names are unique, so variants are served as immutable.
+
+Pillow is in requirements.txt. In a development checkout without it,
+templates show their placeholder rather than a full-size original, and
+variant URLs redirect to the original image.
+"""
+import io
+import os
+import threading
+import time
+import uuid
+from typing import NamedTuple
+from flask import abort, current_app, redirect, send_from_directory
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
+from . import jobs
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # development only: placeholders in templates
+    Image = ImageOps = None
+
+EXTENSION_KEY = 'images'
+PRODUCT_IMAGES_URL = '/static/images/products/'
+WIDTHS = (160, 320, 480, 640, 960, 1280)
+FALLBACK_WIDTH = 640  # <img src> for browsers without srcset
+FORMATS = {'webp': ('WEBP', 'image/webp'), 'jpg': ('JPEG', 'image/jpeg')}
+QUALITY = {'webp': 80, 'jpg': 82}
+MAX_AGE = 365 * 24 * 3600
+TOUCH_INTERVAL = 3600  # refresh a hit's mtime at most this often (seconds)
+EVICT_TO = 0.9  # evict down to this share of the limit, so evictions are not back to back
+_LOCKS = [threading.Lock() for _ in range(64)]  # striped per-variant render locks
+
+
+class ImageSet(NamedTuple):
+    """What a template needs for one product image"""
+    src: str
+    webp: str
+    jpg: str
+
+
+class DerivativeCache:
+    """Directory of rendered variants, bounded in bytes with least-recently-used eviction.
+
+    Recency is the file mtime, so every worker process shares one LRU order.
+    Each process keeps a running estimate of the size and rescans the
+    directory (which also counts other workers' writes) when it passes the
+    limit.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = None
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.directory, *key.split('/'))
+
+    def get(self, key):
+        """Path of a cached variant, or None"""
+        path = self.path(key)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        if time.time() - mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except OSError:
+                return None
+        return path
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+        with self.lock:
+            if self.size is None:
+                self.size = self._scan_size()
+            else:
+                self.size += len(data)
+            if self.size > self.max_bytes:
+                self.size = self.evict()
+        return path
+
+    def _entries(self):
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Delete least recently used variants until under the limit; returns the new size"""
+        entries = sorted(self._entries())
+        size = sum(entry[1] for entry in entries)
+        target = self.max_bytes * EVICT_TO
+        for _, entry_size, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+        return size
+
+
+def init_app(app):
+    app.config.setdefault('IMAGE_CACHE_MAX_BYTES', 512 * 1024 ** 2)
+    app.extensions[EXTENSION_KEY] = DerivativeCache(os.path.join(app.config['STATE_DIR'], 'image_cache'),
+                                                    app.config['IMAGE_CACHE_MAX_BYTES'])
+    app.jinja_env.globals['responsive_image'] = responsive_image
+
+
+def _cache():
+    return current_app.extensions[EXTENSION_KEY]
+
+
+def product_images_dir():
+    return os.path.join(current_app.static_folder, 'images', 'products')
+
+
+def save_product_image(image_file):
+    """Save an uploaded product image, queue its variants; returns the image URL"""
+    filename = f'{uuid.uuid4()}_{secure_filename(image_file.filename)}'
+    images_dir = product_images_dir()
+    os.makedirs(images_dir, exist_ok=True)
+    image_file.save(os.path.join(images_dir, filename))
+    if Image is not None:
+        jobs.enqueue('images.warm', filename=filename)
+    return f'{PRODUCT_IMAGES_URL}{filename}'
+
+
+def _source_name(image_url):
+    """Filename of an uploaded product image that exists on disk, or None"""
+    if not image_url or not image_url.startswith(PRODUCT_IMAGES_URL):
+        return None
+    filename = image_url[len(PRODUCT_IMAGES_URL):]
+    path = safe_join(product_images_dir(), filename)
+    return filename if path and os.path.isfile(path) else None
+
+
+def variant_url(filename, width, fmt):
+    return f'/images/products/{width}/{filename}.{fmt}'
+
+
+def srcset(filename, fmt):
+    return ', '.join(f'{variant_url(filename, width, fmt)} {width}w' for width in WIDTHS)
+
+
+def responsive_image(image_url):
+    """ImageSet for a product image (template global), or None if there is no variant to show"""
+    filename = _source_name(image_url)
+    if filename is None:
+        return None
+    if Image is None:  # never hand a grid the full-size original
+        return None
+    return ImageSet(variant_url(filename, FALLBACK_WIDTH, 'jpg'), srcset(filename, 'webp'), srcset(filename, 'jpg'))
+
+
+def render(source_path, width, fmt):
+    """Encode source_path at most `width` pixels wide as fmt; returns the bytes"""
+    with Image.open(source_path) as image:
+        image.draft('RGB', (width, width * 4))  # JPEG sources decode at a reduced scale
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+        if fmt == 'jpg':
+            if has_alpha:
+                image = image.convert('RGBA')
+                flattened = Image.new('RGB', image.size, (255, 255, 255))
+                flattened.paste(image, mask=image.getchannel('A'))
+                image = flattened
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+            options = {'optimize': True, 'progressive': True}
+        else:
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+            options = {'method': 4}
+        buffer = io.BytesIO()
+        image.save(buffer, FORMATS[fmt][0], quality=QUALITY[fmt], **options)
+    return buffer.getvalue()
+
+
+def variant(filename, width, fmt):
+    """Path of the cached variant, rendering it first if needed"""
+    cache = _cache()
+    key = f'{width}/{filename}.{fmt}'
+    path = cache.get(key)
+    if path is not None:
+        return path
+    # One render per variant at a time in this process; others wait for it
+    with _LOCKS[hash(key) % len(_LOCKS)]:
+        path = cache.get(key)
+        if path is None:
+            path = cache.put(key, render(os.path.join(product_images_dir(), filename), width, fmt))
+    return path
+
+
+def serve_variant(width, name):
+    """Response for /images/products/<width>/<name>"""
+    filename, _, fmt = name.rpartition('.')
+    if width not in WIDTHS or fmt not in FORMATS or _source_name(f'{PRODUCT_IMAGES_URL}{filename}') is None:
+        abort(404)
+    if Image is None:
+        return redirect(f'{PRODUCT_IMAGES_URL}{filename}')
+    try:
+        variant(filename, width, fmt)
+    except (OSError, Image.DecompressionBombError):  # not an image Pillow can (or should) decode
+        current_app.logger.warning(f'Could not render image variant {name}')
+        abort(404)
+    response = send_from_directory(_cache().directory, f'{width}/{name}', mimetype=FORMATS[fmt][1], max_age=MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@jobs.handler('images.warm')
+def warm(filename):
+    """Render every variant of a new product image ahead of the first catalog view"""
+    if Image is None or _source_name(f'{PRODUCT_IMAGES_URL}{filename}') is None:
+        return
+    for width in WIDTHS:
+        for fmt in FORMATS:
+            variant(filename, width, fmt)
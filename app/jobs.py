@@ -0,0 +1,106 @@
+"""
+Small durable background job queue.
+
+Jobs are rows of a leased SQLite queue in STATE_DIR (queues.py), so they
+survive restarts and are shared by every worker process. Handlers are
+registered by name with @handler('name') and run with an app context by a
+background thread per process (or by run_jobs.py). A job that raises is retried with backoff up to
+max_attempts times; handlers should therefore be safe to run twice.
+"""
+import json
+import os
+import time
+from flask import current_app
+from .extensions import db
+from .queues import LeasedQueue, QueueState
+
+EXTENSION_KEY = 'jobs'
+HANDLERS = {}
+
+
+def handler(name):
+    """Register fn as the handler for jobs called `name`"""
+    def decorator(fn):
+        HANDLERS[name] = fn
+        return fn
+    return decorator
+
+
+class JobQueue(LeasedQueue):
+    """Job table: a registered handler name and its JSON payload per row"""
+
+    table = 'job'
+    schema = (
+        'CREATE TABLE IF NOT EXISTS job (id INTEGER PRIMARY KEY, name TEXT NOT NULL, '
+        'payload TEXT NOT NULL, created_at REAL, run_after REAL, claimed_until REAL, '
+        'done_at REAL, attempts INTEGER DEFAULT 0, last_error TEXT)',
+        'CREATE INDEX IF NOT EXISTS ix_job_pending ON job (done_at, run_after)',
+    )
+    fields = ('name', 'payload', 'attempts')
+    order = 'run_after, id'
+    scheduled = True
+
+    def __init__(self, path, lease=600, max_attempts=5):
+        super().__init__(path, lease, max_attempts)
+
+    def put(self, name, payload, delay=0):
+        now = time.time()
+        cursor = self._connect().execute(
+            'INSERT INTO job (name, payload, created_at, run_after) VALUES (?, ?, ?, ?)',
+            (name, json.dumps(payload), now, now + delay))
+        return cursor.lastrowid
+
+
+def _drain():
+    while run_next():
+        pass
+
+
+def init_app(app):
+    app.config.setdefault('JOBS_WORKER', True)
+    app.config.setdefault('JOBS_POLL_INTERVAL', 2.0)
+    queue = JobQueue(os.path.join(app.config['STATE_DIR'], 'jobs.sqlite'))
+    app.extensions[EXTENSION_KEY] = QueueState(queue, 'job-worker', _drain, 'JOBS_WORKER', 'JOBS_POLL_INTERVAL')
+
+
+def _state():
+    return current_app.extensions[EXTENSION_KEY]
+
+
+def get_queue():
+    return _state().queue
+
+
+def enqueue(name, **payload):
+    """Queue a job for the registered handler `name`; returns the job id"""
+    if name not in HANDLERS:
+        raise KeyError(f'No job handler registered for {name!r}')
+    job_id = get_queue().put(name, payload)
+    _state().wake()
+    return job_id
+
+
+def run_next():
+    """Run one due job in the current app context; returns False if there was none"""
+    queue = get_queue()
+    rows = queue.claim()
+    if not rows:
+        return False
+    id_, name, payload, attempts = rows[0]
+    try:
+        HANDLERS[name](**json.loads(payload))
+    except Exception as e:
+        db.session.rollback()
+        queue.fail(id_, f'{type(e).__name__}: {e}', retry_in=min(30 * 2 ** attempts, 3600))
+        current_app.logger.error(f"Job {name} #{id_} failed: {e}")
+    else:
+        queue.complete([id_])
+    return True
+
+
+def run_pending():
+    """Run every due job; returns how many ran"""
+    count = 0
+    while run_next():
+        count += 1
+    return count
@@ -1,62 +1,111 @@
-import os
-from flask import send_from_directory, abort, current_app
+from flask import abort, request, current_app, jsonify, redirect, url_for, Response
 from flask_login import login_required, current_user
 from . import main_bp
-from ..models import Order
+from .. import ebook_pages, packaging
+from ..entitlements import has_access
+from ..downloads import CONTENT_KINDS, verify_download, offload_response
+from ..streaming import (send_content, make_playback_token, verify_playback_token,
+                         PLAYBACK_COOKIE)
+from ..utils import content_dir
 
-@main_bp.route('/content/ebooks/<filename>')
-@login_required
-def serve_ebook(filename):
-    """Serve ebook files to authenticated users who have purchased them"""
+def _require_ebook_access(filename):
+    """Abort unless the current user is an admin or has purchased this ebook"""
     # Check if user is admin - no payment required
     from ..admin.routes import is_admin
     if is_admin(current_user):
-        content_dir = os.path.join(current_app.root_path, '..', 'content', 'ebooks')
-        return send_from_directory(content_dir, filename)
-    
+        return
+
     # Check if user has purchased this ebook
-    ebook_path = f"/content/ebooks/{filename}"
-    
-    # Find order with this file
-    order = Order.query.join(Order.product).filter(
-        Order.user_id == current_user.id,
-        Order.payment_status == 'completed',
-        Order.product.has(file_url=ebook_path)
-    ).first()
-    
-    if not order:
+    if not has_access(current_user.id, f"/content/ebooks/{filename}"):
         abort(403)  # Forbidden - user hasn't purchased this content
-    
+
+@main_bp.route('/content/ebooks/<filename>')
+@login_required
+def serve_ebook(filename):
+    """Serve ebook files to authenticated users who have purchased them"""
+    _require_ebook_access(filename)
+
     # Serve the file
-    content_dir = os.path.join(current_app.root_path, '..', 'content', 'ebooks')
-    return send_from_directory(content_dir, filename)
+    return send_content(content_dir('ebooks'), filename)
+
+@main_bp.route('/content/ebooks/<filename>/pages/<int:first>-<int:last>')
+@login_required
+def serve_ebook_pages(filename, first, last):
+    """Serve pages first..last of a purchased ebook as a standalone PDF"""
+    _require_ebook_access(filename)
+
+    total = ebook_pages.page_count(filename)
+    if not total:
+        abort(404)
+    if not 1 <= first <= last <= total:
+        abort(404)
+    if last - first >= ebook_pages.MAX_EXCERPT_PAGES:
+        abort(400)
+
+    response = Response(ebook_pages.excerpt(filename, first, last), mimetype='application/pdf')
+    response.headers['Content-Disposition'] = f'inline; filename="pages-{first}-{last}.pdf"'
+    response.headers['X-Total-Pages'] = str(total)
+    return response
+
+@main_bp.route('/content/ebooks/<filename>/index')
+@login_required
+def ebook_page_index(filename):
+    """Page count and per-page byte ranges of a purchased ebook, for Range requests"""
+    _require_ebook_access(filename)
+
+    ranges = ebook_pages.page_ranges(filename)
+    if ranges is None:
+        abort(404)
+    return jsonify(ranges)
 
 @main_bp.route('/content/videos/<filename>')
 @login_required
 def serve_video(filename):
     """Serve video files to authenticated users who have purchased them"""
+    video_path = f"/content/videos/{filename}"
+
+    # Range requests after the first carry a playback token (cookie scoped to
+    # this path, or ?token= for external players) and skip the purchase check
+    token = request.args.get('token') or request.cookies.get(PLAYBACK_COOKIE)
+    if token and verify_playback_token(token, current_user.id, video_path):
+        return send_content(content_dir('videos'), filename)
+
     # Check if user is admin - no payment required
     from ..admin.routes import is_admin
-    if is_admin(current_user):
-        content_dir = os.path.join(current_app.root_path, '..', 'content', 'videos')
-        return send_from_directory(content_dir, filename)
-    
-    # Check if user has purchased this course
+    if not is_admin(current_user) and not has_access(current_user.id, video_path):
+        abort(403)  # Forbidden - user hasn't purchased this course
+
+    # Serve the file and hand out a token for the player's follow-up requests
+    response = send_content(content_dir('videos'), filename)
+    response.set_cookie(PLAYBACK_COOKIE, make_playback_token(current_user.id, video_path),
+                        max_age=current_app.config['PLAYBACK_TOKEN_TTL'],
+                        path=request.path, httponly=True, samesite='Lax',
+                        secure=request.is_secure)
+    return response
+
+@main_bp.route('/content/videos/<filename>/stream')
+@login_required
+def stream_video(filename):
+    """Check the purchase once and redirect to the signed HLS (or ?format=dash) manifest"""
     video_path = f"/content/videos/{filename}"
-    
-    # Find order with this file
-    order = Order.query.join(Order.product).filter(
-        Order.user_id == current_user.id,
-        Order.payment_status == 'completed',
-        Order.product.has(file_url=video_path)
-    ).first()
-    
-    if not order:
-        abort(403)  # Forbidden - user hasn't purchased this content
-    
-    # Serve the file
-    content_dir = os.path.join(current_app.root_path, '..', 'content', 'videos')
-    return send_from_directory(content_dir, filename)
+
+    from ..admin.routes import is_admin
+    if not is_admin(current_user) and not has_access(current_user.id, video_path):
+        abort(403)  # Forbidden - user hasn't purchased this course
+
+    sha256 = packaging.ready_package(filename)
+    if sha256 is None:
+        # Not packaged (yet): play the original file
+        return redirect(url_for('main.serve_video', filename=filename))
+    fmt = 'dash' if request.args.get('format') == 'dash' else 'hls'
+    return redirect(packaging.make_stream_url(sha256, current_user.id, fmt))
+
+# Playlists and segments of a packaged video; the signed token in the path
+# replaces the session and purchase checks, so this never hits the database
+@main_bp.route('/content/stream/<sha256>/<token>/<name>')
+def serve_stream(sha256, token, name):
+    """Serve a manifest or segment through its signed stream URL"""
+    return packaging.serve_package_file(sha256, token, name)
 
 # Admin content serving (no purchase check)
 @main_bp.route('/admin/content/ebooks/<filename>')
@@ -66,9 +115,8 @@ def admin_serve_ebook(filename):
     from ..admin.routes import is_admin
     if not is_admin(current_user):
         abort(403)
-    
-    content_dir = os.path.join(current_app.root_path, '..', 'content', 'ebooks')
-    return send_from_directory(content_dir, filename)
+
+    return send_content(content_dir('ebooks'), filename)
 
 @main_bp.route('/admin/content/videos/<filename>')
 @login_required
@@ -77,6 +125,18 @@ def admin_serve_video(filename):
     from ..admin.routes import is_admin
     if not is_admin(current_user):
         abort(403)
+
+    return send_content(content_dir('videos'), filename)
+
+# Signed download links issued by dashboard.download_content; the signature
+# replaces the session and purchase checks so this route never hits the database
+@main_bp.route('/content/signed/<kind>/<filename>')
+def serve_signed(kind, filename):
+    """Serve a file through a signed, expiring URL"""
+    if kind not in CONTENT_KINDS:
+        abort(404)
+    if not verify_download(kind, filename, request.args.get('uid'),
+                           request.args.get('expires'), request.args.get('sig')):
+        abort(403)
     
-    content_dir = os.path.join(current_app.root_path, '..', 'content', 'videos')
-    return send_from_directory(content_dir, filename)
+    return offload_response(kind, filename)
@@ -1,8 +1,11 @@
-from flask import render_template, redirect, url_for, flash
+from flask import render_template, redirect, url_for, flash, request, jsonify
 from flask_login import current_user
 from . import main_bp
-from ..models import Product
 from ..extensions import db
+from ..catalog import get_catalog, static_products
+from .. import images, search as product_search
+from ..page_cache import cached_page, add_surrogate_keys, skip_cache
+from ..routing import use_replica
 
 # Static product data for MVP
 STATIC_PRODUCTS = {
@@ -10,79 +13,106 @@ STATIC_PRODUCTS = {
 }
 
 def get_static_products(category=None):
-    """Get static products, optionally filtered by category"""
-    static_products = []
-    for product_data in STATIC_PRODUCTS.values():
-        if category is None or product_data['category'] == category:
-            class StaticProduct:
-                def __init__(self, data):
-                    for key, value in data.items():
-                        setattr(self, key, value)
-            static_products.append(StaticProduct(product_data))
-    return static_products
+    """Listed static products, optionally filtered by category (used when the database is down)"""
+    return [product for product, listed in static_products()
+            if listed and (category is None or product.category == category)]
 
-@main_bp.route('/')
-def index():
+def load_catalog():
+    """Cached catalog, recreating the tables once if the database is missing them"""
     try:
-        # Get featured products for homepage
-        featured_products = Product.query.filter_by(is_active=True).limit(4).all()
+        return get_catalog()
     except Exception as e:
-        print(f"Database error in index route: {e}")
+        print(f"Database error loading catalog: {e}")
         try:
-            db.create_all()
-            featured_products = Product.query.filter_by(is_active=True).limit(4).all()
+            db.session.rollback()
+            db.create_all(bind_key=None)
+            return get_catalog()
         except Exception as e2:
             print(f"Failed to initialize database: {e2}")
-            featured_products = []
-            flash('Database connection issue. Please contact support.', 'error')
+            return None
+
+@main_bp.route('/')
+@use_replica
+@cached_page('featured')
+def index():
+    catalog = load_catalog()
+    if catalog is None:
+        flash('Database connection issue. Please contact support.', 'error')
+        skip_cache()
+        featured_products = []
+    else:
+        # Get featured products for homepage
+        featured_products = catalog.featured
+        add_surrogate_keys(*(f'product:{p.id}' for p in featured_products))
     
     return render_template('index.html', products=featured_products)
 
 
 @main_bp.route('/ebooks')
+@use_replica
+@cached_page('category:ebook')
 def ebooks():
     """Dedicated eBooks page"""
-    try:
-        db_ebooks = Product.query.filter_by(category='ebook', is_active=True).all()
-    except Exception as e:
-        print(f"Database error in ebooks route: {e}")
-        try:
-            db.create_all()
-            db_ebooks = Product.query.filter_by(category='ebook', is_active=True).all()
-        except Exception:
-            db_ebooks = []
-            flash('Unable to load eBooks. Please try again later.', 'error')
-    
-    # Add static ebooks
-    static_ebooks = get_static_products('ebook')
-    all_ebooks = list(db_ebooks) + static_ebooks
+    catalog = load_catalog()
+    if catalog is None:
+        flash('Unable to load eBooks. Please try again later.', 'error')
+        skip_cache()
+        all_ebooks = get_static_products('ebook')
+    else:
+        # Database and static ebooks, merged when the catalog is built
+        all_ebooks = catalog.category('ebook')
     
     return render_template('ebooks.html', ebooks=all_ebooks)
 
 @main_bp.route('/courses')
+@use_replica
+@cached_page('category:course')
 def courses():
     """Dedicated courses page"""
-    try:
-        db_courses = Product.query.filter_by(category='course', is_active=True).all()
-    except Exception as e:
-        print(f"Database error in courses route: {e}")
-        try:
-            db.create_all()
-            db_courses = Product.query.filter_by(category='course', is_active=True).all()
-        except Exception:
-            db_courses = []
-            flash('Unable to load courses. Please try again later.', 'error')
-    
-    # Add static courses
-    static_courses = get_static_products('course')
-    all_courses = list(db_courses) + static_courses
+    catalog = load_catalog()
+    if catalog is None:
+        flash('Unable to load courses. Please try again later.', 'error')
+        skip_cache()
+        all_courses = get_static_products('course')
+    else:
+        # Database and static courses, merged when the catalog is built
+        all_courses = catalog.category('course')
     
     return render_template('courses.html', courses=all_courses)
 
 @main_bp.route('/about')
+@cached_page('static')
 def about():
     return render_template('about.html')
 
 @main_bp.route('/contact')
+@cached_page('static')
 def contact():
     return render_template('contact.html')
+
+SEARCH_PAGE_SIZE = 20
+
+@main_bp.route('/search')
+def search():
+    """Full-text search over eBooks and courses"""
+    query = request.args.get('q', '').strip()[:200]
+    page = max(request.args.get('page', 1, type=int), 1)
+    results = []
+    if query:
+        results = product_search.search(query, limit=SEARCH_PAGE_SIZE + 1, offset=(page - 1) * SEARCH_PAGE_SIZE)
+    if request.args.get('format') == 'json':
+        return jsonify({'query': query, 'page': page, 'has_more': len(results) > SEARCH_PAGE_SIZE,
+                        'results': [hit._asdict() for hit in results[:SEARCH_PAGE_SIZE]]})
+    return render_template('search.html', query=query, page=page, results=results[:SEARCH_PAGE_SIZE],
+                           has_more=len(results) > SEARCH_PAGE_SIZE)
+
+@main_bp.route('/search/suggest')
+def search_suggest():
+    """Autocomplete for the search box"""
+    query = request.args.get('q', '').strip()[:100]
+    return jsonify({'suggestions': product_search.suggest(query) if query else []})
+
+@main_bp.route('/images/products/<int:width>/<name>')
+def product_image(width, name):
+    """Resized WebP/JPEG variant of a product image"""
+    return images.serve_variant(width, name)
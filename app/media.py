@@ -0,0 +1,83 @@
+"""
+Background post-processing for finished uploads.
+
+The 'media.process' job records size, type and checksum, probes videos with
+ffprobe and grabs a thumbnail with ffmpeg when those tools are on PATH, then
+activates the product the upload belongs to. Without ffmpeg the upload is
+still marked ready; only the video metadata and thumbnail are skipped.
+"""
+import json
+import mimetypes
+import os
+import shutil
+import subprocess
+from . import jobs
+from .downloads import split_content_path
+from .extensions import db
+from .images import product_images_dir, warm
+from .models import Upload
+from .uploads import activate_if_ready
+from .utils import content_dir
+
+PROBE_TIMEOUT = 60
+
+
+def probe_video(path):
+    """Duration and dimensions via ffprobe, or {} if it is unavailable"""
+    ffprobe = shutil.which('ffprobe')
+    if not ffprobe:
+        return {}
+    try:
+        output = subprocess.run(
+            [ffprobe, '-v', 'error', '-select_streams', 'v:0', '-print_format', 'json',
+             '-show_entries', 'stream=width,height,codec_name:format=duration', path],
+            capture_output=True, timeout=PROBE_TIMEOUT, check=True).stdout
+        data = json.loads(output or b'{}')
+    except (subprocess.SubprocessError, ValueError):
+        return {}
+    stream = (data.get('streams') or [{}])[0]
+    info = {key: stream[key] for key in ('width', 'height', 'codec_name') if key in stream}
+    if 'duration' in data.get('format', {}):
+        info['duration'] = float(data['format']['duration'])
+    return info
+
+
+def extract_thumbnail(path, name, at=1.0):
+    """Save one frame as static/images/products/<name>.jpg; returns its URL or None"""
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        return None
+    images_dir = product_images_dir()
+    os.makedirs(images_dir, exist_ok=True)
+    target = os.path.join(images_dir, f'{name}.jpg')
+    try:
+        subprocess.run([ffmpeg, '-y', '-v', 'error', '-ss', str(at), '-i', path,
+                        '-frames:v', '1', '-vf', 'scale=640:-2', target],
+                       capture_output=True, timeout=PROBE_TIMEOUT, check=True)
+    except subprocess.SubprocessError:
+        return None
+    return f'/static/images/products/{name}.jpg' if os.path.exists(target) else None
+
+
+@jobs.handler('media.process')
+def process_upload(upload_id):
+    upload = db.session.get(Upload, upload_id)
+    if upload is None or upload.status not in ('processing', 'ready'):
+        return
+    kind, filename = split_content_path(upload.file_url)
+    path = os.path.join(content_dir(kind), filename)
+
+    info = {'size': os.path.getsize(path), 'sha256': upload.sha256,
+            'mimetype': mimetypes.guess_type(filename)[0]}
+    if kind == 'videos':
+        info.update(probe_video(path))
+        duration = info.get('duration') or 0
+        thumbnail_url = extract_thumbnail(path, upload.id, at=min(1.0, duration / 2))
+        if thumbnail_url:
+            info['thumbnail_url'] = thumbnail_url
+            warm(os.path.basename(thumbnail_url))
+
+    upload.media_info = json.dumps(info)
+    upload.status = 'ready'
+    db.session.commit()
+    activate_if_ready(upload.id)
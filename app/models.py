@@ -1,44 +1,113 @@
 from datetime import datetime
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 from .extensions import db
+from .passwords import hash_password, verify_password
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128))
+    email = db.Column(db.String(120), unique=True, nullable=False, index=True)
+    password_hash = db.Column(db.String(256))  # scrypt hashes are ~160 characters
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     orders = db.relationship('Order', backref='user', lazy=True)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """Verify off the request thread; a stale hash is upgraded in place (caller commits)"""
+        return verify_password(self, password)
 
 class Product(db.Model):
+    __table_args__ = (
+        # Admin listing: newest first, keyset-paginated on (created_at, id), optionally by category or status
+        db.Index('ix_product_created_id', 'created_at', 'id'),
+        db.Index('ix_product_category_created_id', 'category', 'created_at', 'id'),
+        db.Index('ix_product_active_created_id', 'is_active', 'created_at', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=False)
     price = db.Column(db.Float, nullable=False)
     category = db.Column(db.String(50), nullable=False)  # 'ebook' or 'course'
     image_url = db.Column(db.String(200))
-    file_url = db.Column(db.String(200))  # For downloadable content
+    file_url = db.Column(db.String(200), index=True)  # For downloadable content
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Order(db.Model):
+    __table_args__ = (
+        # Dashboard and order history: a user's orders by status, newest first
+        db.Index('ix_order_user_status_created', 'user_id', 'payment_status', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     amount = db.Column(db.Float, nullable=False)
     payment_method = db.Column(db.String(50))  # 'razorpay', 'stripe', 'upi'
-    payment_status = db.Column(db.String(20), default='pending')  # 'pending', 'completed', 'failed'
+    payment_status = db.Column(db.String(20), default='pending', index=True)  # 'pending', 'completed', 'failed'
     transaction_id = db.Column(db.String(100))
     # Razorpay specific fields
-    razorpay_order_id = db.Column(db.String(100))
+    razorpay_order_id = db.Column(db.String(100), index=True)
     razorpay_payment_id = db.Column(db.String(100))
     razorpay_signature = db.Column(db.String(200))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # analytics builds scan by time
     product = db.relationship('Product', backref='orders')
+
+class Entitlement(db.Model):
+    """Materialized access grant: one row per (user, purchased content path)"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    content_path = db.Column(db.String(200), primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'))
+    granted_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Upload(db.Model):
+    """Resumable content upload; the bytes live in CONTENT_DIR/<kind>/.uploads until complete"""
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'ebooks' or 'videos'
+    filename = db.Column(db.String(200), nullable=False)
+    length = db.Column(db.BigInteger, nullable=False)
+    status = db.Column(db.String(20), default='uploading')  # 'uploading', 'processing', 'ready', 'failed'
+    sha256 = db.Column(db.String(64))
+    file_url = db.Column(db.String(200))
+    media_info = db.Column(db.Text)  # JSON written by the post-processing job
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+
+class Blob(db.Model):
+    """A content file stored once under its SHA-256 (content/<kind>/<sha256>.<ext>)"""
+    content_path = db.Column(db.String(200), primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    refcount = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    released_at = db.Column(db.DateTime)  # when refcount last dropped to zero
+
+class BlobRef(db.Model):
+    """Which blob a product's file_url points at; Blob.refcount counts these rows"""
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    content_path = db.Column(db.String(200), db.ForeignKey('blob.content_path'), nullable=False, index=True)
+
+class VideoPackage(db.Model):
+    """HLS/DASH renditions of a video blob, written to content/videos/<sha256>/ by the 'videos.package' job"""
+    sha256 = db.Column(db.String(64), primary_key=True)
+    content_path = db.Column(db.String(200), nullable=False)  # the source blob
+    status = db.Column(db.String(20), default='packaging')  # 'packaging', 'ready', 'failed'
+    progress = db.Column(db.Float, default=0, nullable=False)  # 0..1 while packaging
+    duration = db.Column(db.Float)
+    renditions = db.Column(db.Text)  # JSON: [{"height": 720, "bitrate": 2800}, ...]
+    error = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class StatCounter(db.Model):
+    """Running total kept in step with the tables by stats.py ('users', 'orders:completed', 'revenue', ...)"""
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class StatDaily(db.Model):
+    """Per-day rollup of the same counters, by the day the row was created"""
+    day = db.Column(db.Date, primary_key=True)
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Float, nullable=False, default=0)
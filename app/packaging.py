@@ -0,0 +1,307 @@
+"""
+Adaptive-bitrate packaging for course videos.
+
+Each video blob is transcoded once, by the 'videos.package' job, into an
+H.264/AAC bitrate ladder (no rung above the source height) cut into
+SEGMENT_SECONDS fragmented-MP4 segments. ffmpeg's DASH muxer writes an HLS
+playlist over the same segments, so both formats share one copy:
+
+    content/videos/<sha256>/manifest.mpd      DASH
+    content/videos/<sha256>/master.m3u8       HLS (media_<n>.m3u8 per rendition)
+    content/videos/<sha256>/init-<n>.m4s, seg-<n>-<number>.m4s
+
+Progress is kept on the VideoPackage row. ffmpeg writes to a staging
+directory that is renamed into place once both manifests exist, so a package
+is either complete or absent.
+
+Players open /content/videos/<file>/stream, the only entitlement check. It
+redirects to
+
+    /content/stream/<sha256>/<token>/master.m3u8   (?format=dash: manifest.mpd)
+
+where the token signs (user, package, expiry). The manifests use relative
+URIs, so every playlist and segment request carries the token in its path
+and is verified without the session or the database. Expiry is rounded up
+to STREAM_URL_TTL windows, so a viewer's URLs stay the same for a while and
+segments (immutable, like the blob they come from) are cacheable by browsers
+and a CDN.
+
+Without ffmpeg and ffprobe on PATH nothing is packaged and /stream falls
+back to the original file.
+"""
+import json
+import mimetypes
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from flask import abort, current_app, url_for
+from sqlalchemy import delete
+from . import jobs
+from .blobs import blob_etag
+from .downloads import offload_response, split_content_path
+from .extensions import db
+from .models import VideoPackage
+from .utils import content_dir, generate_signature, signatures_match
+
+SEGMENT_SECONDS = 4
+LADDER = ((1080, 5000), (720, 2800), (480, 1400), (360, 800))  # (height, video kbps)
+AUDIO_KBPS = 128
+MANIFESTS = {'hls': 'master.m3u8', 'dash': 'manifest.mpd'}
+STAGING_DIR = '.packaging'
+PACKAGE_FILE_RE = re.compile(r'^[\w-]+\.(m3u8|mpd|m4s)$')
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+PROBE_TIMEOUT = 60
+PROGRESS_INTERVAL = 2  # seconds between progress writes
+STALE_AFTER = 120  # a 'packaging' row not updated for this long was left by a dead worker
+MIN_RUNTIME = 600  # ffmpeg is killed after max(MIN_RUNTIME, RUNTIME_FACTOR x duration) seconds
+RUNTIME_FACTOR = 10
+
+mimetypes.add_type('application/vnd.apple.mpegurl', '.m3u8')
+mimetypes.add_type('application/dash+xml', '.mpd')
+mimetypes.add_type('video/iso.segment', '.m4s')
+
+
+class PackagingError(RuntimeError):
+    pass
+
+
+def init_app(app):
+    app.config.setdefault('STREAM_URL_TTL', 4 * 3600)
+
+
+def ffmpeg_available():
+    return shutil.which('ffmpeg') is not None and shutil.which('ffprobe') is not None
+
+
+def package_dir(sha256):
+    return os.path.join(content_dir('videos'), sha256)
+
+
+def _video_sha256(content_path):
+    """SHA-256 of a video blob, or None for other content"""
+    parts = split_content_path(content_path)
+    if parts is None or parts[0] != 'videos':
+        return None
+    return blob_etag(parts[1])
+
+
+def queue_package(content_path):
+    """Queue packaging of a video blob; False if ffmpeg is not installed"""
+    if not ffmpeg_available() or _video_sha256(content_path) is None:
+        return False
+    jobs.enqueue('videos.package', content_path=content_path)
+    return True
+
+
+def package_status(content_path):
+    """Packaging state of a video for the admin UI: status, progress (0..1), renditions, error"""
+    sha256 = _video_sha256(content_path)
+    if sha256 is None:
+        return {'status': 'unsupported', 'progress': 0}
+    package = db.session.get(VideoPackage, sha256)
+    if package is None:
+        return {'status': 'queued' if ffmpeg_available() else 'unavailable', 'progress': 0}
+    return {'status': package.status, 'progress': package.progress, 'duration': package.duration,
+            'renditions': json.loads(package.renditions or '[]'), 'error': package.error}
+
+
+def ready_package(filename):
+    """SHA-256 of the video's package if it can be streamed, else None"""
+    sha256 = blob_etag(filename)
+    if sha256 is None:
+        return None
+    package = db.session.get(VideoPackage, sha256)
+    return sha256 if package is not None and package.status == 'ready' else None
+
+
+def ladder(source_height):
+    """Renditions for a source: every rung up to its height, or a single one at its own height"""
+    rungs = [(height, kbps) for height, kbps in LADDER if height <= source_height]
+    return rungs or [(source_height - source_height % 2, LADDER[-1][1])]
+
+
+def _probe(path):
+    """Duration, video height and whether there is an audio track; {} if ffprobe finds no video"""
+    try:
+        output = subprocess.run(
+            [shutil.which('ffprobe'), '-v', 'error', '-print_format', 'json',
+             '-show_entries', 'stream=codec_type,height:format=duration', path],
+            capture_output=True, timeout=PROBE_TIMEOUT, check=True).stdout
+        data = json.loads(output or b'{}')
+    except (subprocess.SubprocessError, ValueError):
+        return {}
+    streams = data.get('streams') or []
+    video = next((stream for stream in streams if stream.get('codec_type') == 'video' and stream.get('height')), None)
+    if video is None:
+        return {}
+    try:
+        duration = float(data.get('format', {}).get('duration'))
+    except (TypeError, ValueError):
+        duration = 0.0
+    return {'height': int(video['height']), 'duration': duration,
+            'audio': any(stream.get('codec_type') == 'audio' for stream in streams)}
+
+
+def ffmpeg_command(source, output_dir, renditions, audio):
+    command = [shutil.which('ffmpeg'), '-y', '-v', 'error', '-nostats', '-progress', 'pipe:1', '-i', source]
+    command += ['-map', '0:v:0'] * len(renditions)
+    if audio:
+        command += ['-map', '0:a:0', '-c:a', 'aac', '-b:a', f'{AUDIO_KBPS}k', '-ac', '2']
+    # Keyframes on segment boundaries, so every rendition switches at the same points
+    command += ['-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'main', '-pix_fmt', 'yuv420p',
+                '-sc_threshold', '0', '-force_key_frames', f'expr:gte(t,n_forced*{SEGMENT_SECONDS})']
+    for n, (height, kbps) in enumerate(renditions):
+        command += [f'-filter:v:{n}', f'scale=-2:{height}', f'-b:v:{n}', f'{kbps}k',
+                    f'-maxrate:v:{n}', f'{kbps * 107 // 100}k', f'-bufsize:v:{n}', f'{kbps * 3 // 2}k']
+    command += ['-f', 'dash', '-seg_duration', str(SEGMENT_SECONDS), '-use_template', '1', '-use_timeline', '0',
+                '-hls_playlist', '1',
+                '-adaptation_sets', 'id=0,streams=v id=1,streams=a' if audio else 'id=0,streams=v',
+                '-init_seg_name', 'init-$RepresentationID$.m4s',
+                '-media_seg_name', 'seg-$RepresentationID$-$Number%05d$.m4s',
+                os.path.join(output_dir, MANIFESTS['dash'])]
+    return command
+
+
+def _run(command, duration, on_progress):
+    """Run ffmpeg, passing progress (0..1) from its -progress output to on_progress; raises on failure"""
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+        watchdog = threading.Timer(max(MIN_RUNTIME, RUNTIME_FACTOR * duration), process.kill)
+        watchdog.start()
+        try:
+            for line in process.stdout:
+                key, _, value = line.decode('ascii', 'replace').strip().partition('=')
+                # out_time_ms is in microseconds too (newer builds also print out_time_us)
+                if key in ('out_time_us', 'out_time_ms') and value.isdigit() and duration:
+                    on_progress(min(int(value) / 1e6 / duration, 1.0))
+            returncode = process.wait()
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            watchdog.cancel()
+        if returncode != 0:
+            stderr.seek(0)
+            message = stderr.read()[-500:].decode('utf-8', 'replace').strip()
+            raise PackagingError(f'ffmpeg exited with status {returncode}: {message}')
+
+
+def _fail(sha256, message):
+    db.session.rollback()
+    package = db.session.get(VideoPackage, sha256)
+    if package is not None:
+        package.status, package.error, package.updated_at = 'failed', message[:500], datetime.utcnow()
+        db.session.commit()
+
+
+@jobs.handler('videos.package')
+def package_video(content_path):
+    """Transcode a video blob into segmented renditions with HLS and DASH manifests"""
+    sha256 = _video_sha256(content_path)
+    source = os.path.join(content_dir('videos'), split_content_path(content_path)[1]) if sha256 else None
+    if sha256 is None or not os.path.isfile(source) or not ffmpeg_available():
+        return
+    package = db.session.get(VideoPackage, sha256)
+    if package is None:
+        package = VideoPackage(sha256=sha256, content_path=content_path)
+        db.session.add(package)
+    elif package.status == 'ready' and os.path.isdir(package_dir(sha256)):
+        return
+    elif package.status == 'packaging' and package.updated_at > datetime.utcnow() - timedelta(seconds=STALE_AFTER):
+        return  # still running elsewhere; the job lease ran out before ffmpeg finished
+    package.status, package.progress, package.error = 'packaging', 0.0, None
+    package.updated_at = datetime.utcnow()
+    db.session.commit()
+
+    info = _probe(source)
+    if not info:
+        _fail(sha256, 'ffprobe found no video stream')
+        return
+    renditions = ladder(info['height'])
+    staging = os.path.join(content_dir('videos'), STAGING_DIR, f'{sha256}.{uuid.uuid4().hex}')
+    os.makedirs(staging)
+    last_report = time.monotonic()
+
+    def report(progress):
+        nonlocal last_report
+        if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+            last_report = time.monotonic()
+            package.progress, package.updated_at = round(progress, 3), datetime.utcnow()
+            db.session.commit()
+
+    try:
+        _run(ffmpeg_command(source, staging, renditions, info['audio']), info['duration'], report)
+        if not all(os.path.isfile(os.path.join(staging, name)) for name in MANIFESTS.values()):
+            raise PackagingError('ffmpeg did not write both manifests')
+        try:
+            os.rename(staging, package_dir(sha256))
+        except OSError:
+            if not os.path.isfile(os.path.join(package_dir(sha256), MANIFESTS['hls'])):
+                raise
+            # Another worker finished the same package first; keep theirs
+        package.status, package.progress, package.duration = 'ready', 1.0, info['duration']
+        package.renditions = json.dumps([{'height': height, 'bitrate': kbps} for height, kbps in renditions])
+        package.updated_at = datetime.utcnow()
+        db.session.commit()
+    except Exception as e:
+        _fail(sha256, str(e))
+        raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _expiry():
+    """Now rounded up to the STREAM_URL_TTL window after next, so tokens last one to two windows"""
+    ttl = current_app.config['STREAM_URL_TTL']
+    return (int(time.time()) // ttl + 2) * ttl
+
+
+def _sign(sha256, user_id, expires):
+    return generate_signature(f'/content/videos/{sha256}/|{user_id}|{expires}')
+
+
+def make_stream_url(sha256, user_id, fmt='hls'):
+    """Signed manifest URL of a package for one user"""
+    expires = _expiry()
+    token = f'{user_id}-{expires}-{_sign(sha256, user_id, expires)}'
+    return url_for('main.serve_stream', sha256=sha256, token=token, name=MANIFESTS[fmt])
+
+
+def verify_stream_token(sha256, token):
+    """Seconds until the token expires, or None if it is not valid for this package"""
+    try:
+        user_id, expires, signature = token.split('-')
+        remaining = int(expires) - int(time.time())
+    except ValueError:
+        return None
+    if remaining <= 0 or not signatures_match(_sign(sha256, user_id, expires), signature):
+        return None
+    return remaining
+
+
+def serve_package_file(sha256, token, name):
+    """Response for /content/stream/<sha256>/<token>/<name>"""
+    if not SHA256_RE.match(sha256) or not PACKAGE_FILE_RE.match(name):
+        abort(404)
+    remaining = verify_stream_token(sha256, token)
+    if remaining is None:
+        abort(403)
+    response = offload_response('videos', f'{sha256}/{name}')
+    # Package files never change; the URL itself stops working when the token expires
+    response.headers['Cache-Control'] = f'public, max-age={remaining}, immutable'
+    return response
+
+
+def remove_package(filename):
+    """Delete the package of a video blob that is being removed (caller commits)"""
+    sha256 = blob_etag(filename)
+    if not sha256:
+        return
+    shutil.rmtree(package_dir(sha256), ignore_errors=True)
+    db.session.execute(delete(VideoPackage).where(VideoPackage.sha256 == sha256))
@@ -0,0 +1,280 @@
+"""
+Full-page response cache for anonymous storefront traffic.
+
+Cached views are rendered once with their per-user parts (navbar, flash
+messages, purchase buttons) left as fragment holes. On a hit, anonymous
+visitors get a pre-filled body with a precomputed ETag and Last-Modified; for
+logged-in users only the small fragment templates are rendered into the
+cached shell.
+
+Pages are keyed by path plus only the query parameters a view declares, so
+arbitrary query strings (tracking parameters, cache busters) share one entry.
+
+Entries carry surrogate keys ('product:3', 'category:ebook', 'featured', ...)
+and admin writes purge by key. The in-process LRU is the first level; with
+PAGE_CACHE_BACKEND='sqlite' entries are also shared between workers through a
+SQLite file in STATE_DIR, where purges are exact. Every purge also bumps a
+version stamp that makes all workers drop their in-process copies.
+"""
+import base64
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from functools import wraps
+from urllib.parse import urlencode
+from typing import NamedTuple
+from flask import current_app, request, session, g, render_template, make_response, Response
+from flask_login import current_user
+from markupsafe import Markup
+from .cache import LRUCache, VersionStamp
+
+EXTENSION_KEY = 'page_cache'
+FRAGMENT_RE = re.compile(rb'<!--fragment:(\w+):([A-Za-z0-9_=-]*)-->')
+
+
+class PageEntry(NamedTuple):
+    shell: bytes
+    anonymous_body: bytes
+    etag: str
+    last_modified: float
+    tags: tuple
+    expires_at: float
+
+
+class SQLiteBackend:
+    """Shared second-level store; one connection per thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS page (key TEXT PRIMARY KEY, shell BLOB, '
+                         'anonymous_body BLOB, etag TEXT, last_modified REAL, tags TEXT, '
+                         'expires_at REAL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS page_tag (tag TEXT, key TEXT, '
+                         'PRIMARY KEY (tag, key))')
+            conn.execute('CREATE INDEX IF NOT EXISTS page_expires_at ON page (expires_at)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT shell, anonymous_body, etag, last_modified, tags, expires_at '
+            'FROM page WHERE key = ?', (key,)).fetchone()
+        if row is None or row[5] < time.time():
+            return None
+        return PageEntry(row[0], row[1], row[2], row[3], tuple(json.loads(row[4])), row[5])
+
+    def set(self, key, entry):
+        conn = self._connect()
+        with conn:
+            # Expired rows are never read again; drop them here so the file stays bounded
+            if conn.execute('DELETE FROM page WHERE expires_at < ?', (time.time(),)).rowcount:
+                conn.execute('DELETE FROM page_tag WHERE key NOT IN (SELECT key FROM page)')
+            conn.execute('DELETE FROM page_tag WHERE key = ?', (key,))
+            conn.execute('INSERT OR REPLACE INTO page VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (key, entry.shell, entry.anonymous_body, entry.etag,
+                          entry.last_modified, json.dumps(entry.tags), entry.expires_at))
+            conn.executemany('INSERT OR IGNORE INTO page_tag VALUES (?, ?)',
+                             [(tag, key) for tag in entry.tags])
+
+    def purge(self, tags):
+        conn = self._connect()
+        with conn:
+            for tag in tags:
+                conn.execute('DELETE FROM page WHERE key IN (SELECT key FROM page_tag WHERE tag = ?)', (tag,))
+                conn.execute('DELETE FROM page_tag WHERE key NOT IN (SELECT key FROM page)')
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM page')
+            conn.execute('DELETE FROM page_tag')
+
+
+class PageCache:
+    def __init__(self, maxsize, ttl, stamp, backend=None):
+        self.ttl = ttl
+        self.stamp = stamp
+        self.backend = backend
+        self.local = LRUCache(maxsize=maxsize)
+
+    def get(self, key):
+        version = self.stamp.current()
+        cached = self.local.get(key)
+        if cached is not None:
+            entry, seen_version = cached
+            if seen_version == version and entry.expires_at >= time.time():
+                return entry
+            self.local.pop(key)
+        if self.backend is not None:
+            entry = self.backend.get(key)
+            if entry is not None:
+                self.local.set(key, (entry, version))
+                return entry
+        return None
+
+    def set(self, key, entry, version):
+        self.local.set(key, (entry, version))
+        if self.backend is not None:
+            self.backend.set(key, entry)
+
+    def purge(self, *tags):
+        if self.backend is not None:
+            self.backend.purge(tags)
+        self.local.clear()
+        self.stamp.bump()
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+        self.local.clear()
+        self.stamp.bump()
+
+
+def init_app(app):
+    app.config.setdefault('PAGE_CACHE_ENABLED', True)
+    app.config.setdefault('PAGE_CACHE_BACKEND', 'memory')
+    app.config.setdefault('PAGE_CACHE_SIZE', 512)
+    app.config.setdefault('PAGE_CACHE_TTL', 300)
+    state_dir = app.config['STATE_DIR']
+    backend = None
+    if app.config['PAGE_CACHE_BACKEND'] == 'sqlite':
+        backend = SQLiteBackend(os.path.join(state_dir, 'page_cache.sqlite'))
+    app.extensions[EXTENSION_KEY] = PageCache(
+        maxsize=app.config['PAGE_CACHE_SIZE'],
+        ttl=app.config['PAGE_CACHE_TTL'],
+        stamp=VersionStamp(os.path.join(state_dir, 'page_cache.version')),
+        backend=backend)
+    app.jinja_env.globals['fragment'] = fragment
+
+
+def _cache():
+    return current_app.extensions[EXTENSION_KEY]
+
+
+def fragment(name, **params):
+    """Render a per-user fragment, or leave a hole for it when building a cached page"""
+    if g.get('page_cache_render'):
+        encoded = base64.urlsafe_b64encode(json.dumps(params).encode()).decode()
+        return Markup(f'<!--fragment:{name}:{encoded}-->')
+    return Markup(render_template(f'fragments/{name}.html', **params))
+
+
+def _fill(shell, **context):
+    def render(match):
+        params = json.loads(base64.urlsafe_b64decode(match.group(2)))
+        params.update(context)
+        return render_template(f'fragments/{match.group(1).decode()}.html', **params).encode()
+    return FRAGMENT_RE.sub(render, shell)
+
+
+def add_surrogate_keys(*keys):
+    """Tag the page being rendered; admin writes purge pages by these keys"""
+    g.setdefault('surrogate_keys', set()).update(keys)
+
+
+def skip_cache():
+    """Serve the page being rendered without storing it (e.g. a fallback shown while the database is down)"""
+    g.page_cache_skip = True
+
+
+def purge(*keys):
+    """Drop every cached page tagged with any of the given surrogate keys"""
+    _cache().purge(*keys)
+
+
+def clear():
+    """Drop every cached page (e.g. after bulk changes made outside the admin)"""
+    _cache().clear()
+
+
+def purge_products(*products):
+    """Purge the pages that show the given products"""
+    keys = {'featured'}
+    for product in products:
+        keys.update((f'product:{product.id}', f'category:{product.category}'))
+    purge(*keys)
+
+
+def _respond(entry, status):
+    personalised = current_user.is_authenticated or '_flashes' in session
+    if personalised:
+        body = _fill(entry.shell)
+        etag = f'{entry.etag}-{hashlib.md5(body).hexdigest()[:12]}'
+    else:
+        body, etag = entry.anonymous_body, entry.etag
+    response = Response(body, mimetype='text/html')
+    response.set_etag(etag)
+    response.last_modified = entry.last_modified
+    response.headers['Cache-Control'] = 'private, no-cache' if personalised else 'public, no-cache'
+    response.headers['X-Page-Cache'] = status
+    return response.make_conditional(request)
+
+
+def _page_key(params):
+    """Request path plus the whitelisted query parameters, in a canonical order"""
+    query = urlencode(sorted((name, value) for name in params for value in request.args.getlist(name)))
+    return f'{request.path}?{query}' if query else request.path
+
+
+def cached_page(*keys, params=()):
+    """Cache a GET view's HTML with the given surrogate keys (plus any it adds).
+
+    params names the query parameters the view reads; any others are ignored
+    when looking up the page.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if (not current_app.config['PAGE_CACHE_ENABLED'] or current_app.debug
+                    or request.method != 'GET'):
+                return view(*args, **kwargs)
+
+            cache = _cache()
+            key = _page_key(params)
+            entry = cache.get(key)
+            if entry is not None:
+                return _respond(entry, 'HIT')
+
+            version = cache.stamp.current()
+            g.page_cache_render = True
+            g.surrogate_keys = set(keys)
+            g.page_cache_skip = False
+            try:
+                response = make_response(view(*args, **kwargs))
+            finally:
+                g.page_cache_render = False
+
+            shell = response.get_data()
+            if response.status_code != 200 or response.mimetype != 'text/html':
+                response.set_data(_fill(shell))
+                return response
+
+            anonymous_body = _fill(shell, current_user=current_app.login_manager.anonymous_user(),
+                                   get_flashed_messages=lambda **kw: [])
+            entry = PageEntry(
+                shell=shell,
+                anonymous_body=anonymous_body,
+                etag=hashlib.md5(anonymous_body).hexdigest(),
+                last_modified=time.time(),
+                tags=tuple(sorted(g.surrogate_keys)),
+                expires_at=time.time() + cache.ttl,
+            )
+            # Skip storing if a purge landed while the page was rendering
+            if cache.stamp.current() == version and not g.page_cache_skip:
+                cache.set(key, entry, version)
+            return _respond(entry, 'MISS')
+        return wrapper
+    return decorator
@@ -0,0 +1,119 @@
+"""
+Password hashing off the request threads.
+
+Hashing and verification run in a small process pool, so a burst of logins
+uses at most PASSWORD_HASH_WORKERS cores and leaves the request threads free
+for other routes. At most PASSWORD_HASH_QUEUE hashes may be queued or running
+per worker process; further callers wait up to PASSWORD_HASH_TIMEOUT seconds
+and then get HasherBusy, which the auth routes answer with a 503 instead of
+piling up work.
+
+Hashes made with other parameters than PASSWORD_HASH_METHOD (e.g. after the
+cost is raised) are replaced transparently the next time their owner logs in.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+
+EXTENSION_KEY = 'password_hasher'
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing queue stays full for PASSWORD_HASH_TIMEOUT seconds"""
+
+
+def hash_method(pwhash):
+    """'scrypt:32768:8:1$salt$hash' -> 'scrypt:32768:8:1'"""
+    return (pwhash or '').split('$', 1)[0]
+
+
+def _verify(pwhash, password, method, target):
+    """Check password; if it matches a hash with stale parameters, return a fresh hash too"""
+    if not pwhash or not check_password_hash(pwhash, password):
+        return False, None
+    if hash_method(pwhash) != target:
+        return True, generate_password_hash(password, method)
+    return True, None
+
+
+class PasswordHasher:
+    def __init__(self, method, workers=2, queue_size=32, timeout=2.0):
+        self.method = method
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._target = None
+        self._pool = None
+        self._slots = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure(self):
+        # Pools and semaphores must not be shared with forked worker processes
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._slots = threading.BoundedSemaphore(self.queue_size)
+                    self._pool = None
+                    if self.workers > 0:
+                        methods = multiprocessing.get_all_start_methods()
+                        context = multiprocessing.get_context(
+                            'forkserver' if 'forkserver' in methods else 'spawn')
+                        self._pool = ProcessPoolExecutor(self.workers, mp_context=context)
+                    self._pid = os.getpid()
+
+    def _run(self, fn, *args):
+        self._ensure()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HasherBusy('Password hashing queue is full')
+        try:
+            if self._pool is None:
+                return fn(*args)
+            return self._pool.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    @property
+    def target(self):
+        """The parameter string stored hashes carry, e.g. 'scrypt' -> 'scrypt:32768:8:1'"""
+        if self._target is None:
+            self._target = hash_method(generate_password_hash('', self.method))
+        return self._target
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """(matches, new_hash_or_None)"""
+        return self._run(_verify, pwhash, password, self.method, self.target)
+
+
+def init_app(app):
+    app.config.setdefault('PASSWORD_HASH_METHOD', 'scrypt')
+    app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+    app.config.setdefault('PASSWORD_HASH_QUEUE', 32)
+    app.config.setdefault('PASSWORD_HASH_TIMEOUT', 2.0)
+    app.extensions[EXTENSION_KEY] = PasswordHasher(
+        app.config['PASSWORD_HASH_METHOD'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        queue_size=app.config['PASSWORD_HASH_QUEUE'],
+        timeout=app.config['PASSWORD_HASH_TIMEOUT'])
+
+
+def hash_password(password):
+    if not has_app_context():
+        return generate_password_hash(password)
+    return current_app.extensions[EXTENSION_KEY].hash(password)
+
+
+def verify_password(user, password):
+    """True if password is user's; upgrades a stale hash in place (caller commits)"""
+    if not has_app_context():
+        return bool(user.password_hash) and check_password_hash(user.password_hash, password)
+    matches, new_hash = current_app.extensions[EXTENSION_KEY].verify(user.password_hash, password)
+    if new_hash:
+        user.password_hash = new_hash
+    return matches
@@ -0,0 +1,295 @@
+"""
+Process-wide Razorpay client.
+
+One razorpay.Client per worker process, backed by a keep-alive
+requests.Session with a sized connection pool and default timeouts. Calls go
+through a retry budget (retries may not exceed a fraction of recent calls)
+and a circuit breaker, and their latency is recorded for the admin metrics
+endpoint. Order creation is not idempotent, so it is only retried when the
+request never reached the gateway (connect failures). An optional pool of
+pre-created gateway orders per price point lets /store/buy skip the gateway
+round-trip entirely.
+"""
+import collections
+import os
+import threading
+import time
+import razorpay
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from flask import current_app
+from razorpay.errors import GatewayError, ServerError
+
+EXTENSION_KEY = 'razorpay'
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, GatewayError, ServerError)
+
+
+def _not_sent(error):
+    """True if a request failed before it was sent, so even a non-idempotent call can be retried"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError) or not error.args:
+        return False
+    # With adapter retries off, a refused or unresolvable connection is ConnectionError(MaxRetryError)
+    return isinstance(getattr(error.args[0], 'reason', None), NewConnectionError)
+
+
+class GatewayUnavailable(Exception):
+    """Raised without calling the gateway while the circuit breaker is open"""
+
+
+class TimeoutSession(requests.Session):
+    """requests.Session that applies a default (connect, read) timeout"""
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+class PooledRazorpayClient(razorpay.Client):
+    def _get_version(self):
+        # The stock client resolves its version through pkg_resources on every call
+        if not hasattr(self, '_version'):
+            self._version = super()._get_version()
+        return self._version
+
+
+class RetryBudget:
+    """Allow retries up to `ratio` of calls in the last `window` seconds (plus a small floor)"""
+
+    def __init__(self, ratio=0.1, minimum=3, window=10.0):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.window = window
+        self._calls = collections.deque()
+        self._retries = collections.deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, events, now):
+        while events and events[0] < now - self.window:
+            events.popleft()
+
+    def record_call(self):
+        with self._lock:
+            now = time.monotonic()
+            self._calls.append(now)
+            self._trim(self._calls, now)
+
+    def try_acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(self._calls, now)
+            self._trim(self._retries, now)
+            if len(self._retries) >= self.minimum + self.ratio * len(self._calls):
+                return False
+            self._retries.append(now)
+            return True
+
+
+class CircuitBreaker:
+    """Open after `threshold` consecutive failures; allow one probe after `reset_timeout`"""
+
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'half-open':
+                # Let a single probe through; further callers wait for its result
+                self.opened_at = time.monotonic()
+                return True
+            return state == 'closed'
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class GatewayMetrics:
+    def __init__(self, samples=1000):
+        self.latencies = collections.deque(maxlen=samples)
+        self.counters = collections.Counter()
+        self._lock = threading.Lock()
+
+    def observe(self, operation, seconds, outcome):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.counters[f'{operation}.{outcome}'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            counters = dict(self.counters)
+
+        def percentile(q):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000, 2)
+
+        return {'calls': counters, 'latency_ms': {'p50': percentile(0.5), 'p99': percentile(0.99)}}
+
+
+class GatewayClient:
+    def __init__(self, key_id, key_secret, base_url=None, timeout=(3.05, 10),
+                 pool_size=10, max_retries=2, retry_budget=None, breaker=None):
+        session = TimeoutSession(timeout)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        options = {'base_url': base_url} if base_url else {}
+        self.client = PooledRazorpayClient(session=session, auth=(key_id, key_secret), **options)
+        self.max_retries = max_retries
+        self.retry_budget = retry_budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self.metrics = GatewayMetrics()
+
+    def call(self, operation, fn, *args, retry_if=None, **kwargs):
+        """Run fn against the gateway with breaker, retry budget and metrics.
+
+        Transient errors are retried, or only those retry_if(error) accepts.
+        """
+        self.retry_budget.record_call()
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self.metrics.observe(operation, 0.0, 'rejected')
+                raise GatewayUnavailable(f'Razorpay circuit open ({operation})')
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except TRANSIENT_ERRORS as error:
+                self.metrics.observe(operation, time.perf_counter() - started, 'error')
+                self.breaker.record_failure()
+                attempt += 1
+                if (attempt > self.max_retries or (retry_if is not None and not retry_if(error))
+                        or not self.retry_budget.try_acquire()):
+                    raise
+                time.sleep(min(0.05 * 2 ** attempt, 1.0))
+                continue
+            self.metrics.observe(operation, time.perf_counter() - started, 'ok')
+            self.breaker.record_success()
+            return result
+
+    def create_order(self, amount_paise, currency='INR'):
+        data = {'amount': amount_paise, 'currency': currency, 'payment_capture': 1}
+        # A read timeout may come after Razorpay created the order; retrying would create a second one
+        return self.call('order.create', self.client.order.create, data=data, retry_if=_not_sent)
+
+    def fetch_payment(self, payment_id):
+        return self.call('payment.fetch', self.client.payment.fetch, payment_id)
+
+    def order_payments(self, order_id):
+        return self.call('order.payments', self.client.order.payments, order_id)
+
+
+class OrderPool:
+    """Gateway orders created ahead of time per (amount, currency), refilled in the background"""
+
+    def __init__(self, client, size, max_age=1800):
+        self.client = client
+        self.size = size
+        self.max_age = max_age
+        self._orders = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        self._wanted = threading.Event()
+        self._thread = None
+
+    def take(self, amount_paise, currency='INR'):
+        key = (amount_paise, currency)
+        with self._lock:
+            queue = self._orders[key]
+            while queue:
+                created, order = queue.popleft()
+                if time.monotonic() - created < self.max_age:
+                    self._request_refill()
+                    return order
+        self._request_refill()
+        return None
+
+    def _request_refill(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._refill_loop, name='razorpay-order-pool', daemon=True)
+            self._thread.start()
+        self._wanted.set()
+
+    def _refill_loop(self):
+        while True:
+            self._wanted.wait()
+            self._wanted.clear()
+            with self._lock:
+                missing = [(key, self.size - len(queue)) for key, queue in self._orders.items()
+                           if len(queue) < self.size]
+            for (amount, currency), count in missing:
+                for _ in range(count):
+                    try:
+                        order = self.client.create_order(amount, currency)
+                    except Exception:
+                        break
+                    with self._lock:
+                        self._orders[(amount, currency)].append((time.monotonic(), order))
+
+
+class _GatewayState:
+    def __init__(self):
+        self.pid = None
+        self.client = None
+        self.pool = None
+        self.lock = threading.Lock()
+
+
+def init_app(app):
+    app.extensions[EXTENSION_KEY] = _GatewayState()
+
+
+def _state():
+    state = current_app.extensions[EXTENSION_KEY]
+    # Sessions and pools must not be shared across forked workers
+    if state.pid != os.getpid():
+        with state.lock:
+            if state.pid != os.getpid():
+                config = current_app.config
+                state.client = GatewayClient(
+                    config['RAZORPAY_KEY_ID'], config['RAZORPAY_KEY_SECRET'],
+                    base_url=config.get('RAZORPAY_BASE_URL'),
+                    timeout=(config['RAZORPAY_CONNECT_TIMEOUT'], config['RAZORPAY_READ_TIMEOUT']),
+                    pool_size=config['RAZORPAY_POOL_SIZE'],
+                    max_retries=config['RAZORPAY_MAX_RETRIES'],
+                    breaker=CircuitBreaker(config['RAZORPAY_BREAKER_THRESHOLD'],
+                                           config['RAZORPAY_BREAKER_RESET']))
+                size = config['RAZORPAY_ORDER_POOL_SIZE']
+                state.pool = OrderPool(state.client, size) if size else None
+                state.pid = os.getpid()
+    return state
+
+
+def get_gateway():
+    return _state().client
+
+
+def get_order_pool():
+    return _state().pool
@@ -0,0 +1,454 @@
+"""
+Minimal PDF reader for page indexing and page excerpts.
+
+Reads the cross-reference data (classic tables, xref streams and hybrid
+files, following /Prev through incremental updates), objects and object
+streams with os.pread, so only the objects that are asked for are ever in
+memory, never the whole file. It understands enough of the syntax to walk
+the page tree and find which objects a page uses; stream data is copied,
+not decoded, except for FlateDecode object and xref streams.
+
+Encrypted files are not supported.
+"""
+import os
+import re
+import zlib
+from typing import NamedTuple
+
+WHITESPACE = b' \t\r\n\x0c\x00'
+INHERITABLE = ('Resources', 'MediaBox', 'CropBox', 'Rotate')
+READ_WINDOW = 4096
+MAX_OBJECT_SIZE = 64 * 1024 * 1024  # dictionaries/arrays larger than this are treated as corrupt
+NUMBER_RE = re.compile(rb'[+-]?(?:\d+\.?\d*|\.\d+)')
+REF_RE = re.compile(rb'(\d+)\s+(\d+)\s+R(?=[\s()<>\[\]{}/%]|$)')
+OBJ_RE = re.compile(rb'\s*(\d+)\s+(\d+)\s+obj')
+SUBSECTION_RE = re.compile(rb'(\d+)[ \t]+(\d+)[ \t]*(?:\r\n|\r|\n)')
+KEYWORD_RE = re.compile(rb'[^\s()<>\[\]{}/%]+')
+
+
+class PDFError(ValueError):
+    """The file is not a PDF this reader can index"""
+
+
+class Ref(NamedTuple):
+    num: int
+    gen: int
+
+
+class Name(str):
+    """/Name, kept as written (without the slash)"""
+
+
+class Raw(bytes):
+    """String token kept verbatim, e.g. (text) or <48656c6c6f>"""
+
+
+class Keyword(str):
+    """Bare keyword such as stream or endobj"""
+
+
+class _Truncated(Exception):
+    """Ran off the end of the buffer; read a larger window and retry"""
+
+
+def _skip(data, pos):
+    while pos < len(data):
+        char = data[pos]
+        if char in WHITESPACE:
+            pos += 1
+        elif char == 0x25:  # % comment
+            end = data.find(b'\n', pos)
+            if end < 0:
+                raise _Truncated
+            pos = end + 1
+        else:
+            return pos
+    raise _Truncated
+
+
+def _literal_string(data, pos):
+    depth = 0
+    start = pos
+    while pos < len(data):
+        char = data[pos]
+        if char == 0x5c:  # backslash escapes the next byte
+            pos += 2
+            continue
+        if char == 0x28:
+            depth += 1
+        elif char == 0x29:
+            depth -= 1
+            if depth == 0:
+                return Raw(data[start:pos + 1]), pos + 1
+        pos += 1
+    raise _Truncated
+
+
+def parse(data, pos=0):
+    """Parse one value at data[pos:]; returns (value, end position)"""
+    pos = _skip(data, pos)
+    char = data[pos:pos + 1]
+    if char == b'<':
+        if data[pos + 1:pos + 2] == b'<':
+            result = {}
+            pos += 2
+            while True:
+                pos = _skip(data, pos)
+                if data[pos:pos + 2] == b'>>':
+                    return result, pos + 2
+                key, pos = parse(data, pos)
+                if not isinstance(key, Name):
+                    raise PDFError(f'Dictionary key expected at {pos}')
+                result[key], pos = parse(data, pos)
+        end = data.find(b'>', pos)
+        if end < 0:
+            raise _Truncated
+        return Raw(data[pos:end + 1]), end + 1
+    if char == b'[':
+        result = []
+        pos += 1
+        while True:
+            pos = _skip(data, pos)
+            if data[pos:pos + 1] == b']':
+                return result, pos + 1
+            value, pos = parse(data, pos)
+            result.append(value)
+    if char == b'(':
+        return _literal_string(data, pos)
+    if char == b'/':
+        match = KEYWORD_RE.match(data, pos + 1)
+        end = match.end() if match else pos + 1
+        if end == len(data):
+            raise _Truncated
+        return Name(data[pos + 1:end].decode('latin-1')), end
+    match = REF_RE.match(data, pos)
+    if match:
+        return Ref(int(match.group(1)), int(match.group(2))), match.end()
+    match = NUMBER_RE.match(data, pos)
+    if match:
+        if match.end() == len(data):
+            raise _Truncated  # might continue, or be the start of a reference
+        text = match.group()
+        return (float(text) if b'.' in text else int(text)), match.end()
+    match = KEYWORD_RE.match(data, pos)
+    if not match:
+        raise PDFError(f'Unexpected {char!r} at {pos}')
+    word = match.group()
+    if match.end() == len(data):
+        raise _Truncated
+    value = {b'true': True, b'false': False, b'null': None}.get(word, Keyword(word.decode('latin-1')))
+    return value, match.end()
+
+
+def serialize(value):
+    """PDF syntax for a parsed value"""
+    if isinstance(value, dict):
+        return b'<<' + b''.join(b'/' + key.encode('latin-1') + b' ' + serialize(item) + b'\n'
+                                for key, item in value.items()) + b'>>'
+    if isinstance(value, list):
+        return b'[' + b' '.join(serialize(item) for item in value) + b']'
+    if isinstance(value, Ref):
+        return b'%d %d R' % value
+    if isinstance(value, Name):
+        return b'/' + value.encode('latin-1')
+    if isinstance(value, Raw):
+        return bytes(value)
+    if value is True:
+        return b'true'
+    if value is False:
+        return b'false'
+    if value is None:
+        return b'null'
+    if isinstance(value, float):
+        return (f'{value:.6f}'.rstrip('0').rstrip('.') or '0').encode()
+    return str(value).encode('latin-1')
+
+
+def refs_in(value, skip=('Parent',)):
+    """Indirect references in a value, ignoring dictionary keys in `skip`"""
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, Ref):
+            yield value
+        elif isinstance(value, dict):
+            stack.extend(item for key, item in value.items() if key not in skip)
+        elif isinstance(value, list):
+            stack.extend(value)
+
+
+def _unpredict(data, columns, predictor):
+    """Undo PNG row predictors (xref streams are usually /Predictor 12)"""
+    if predictor < 10:
+        raise PDFError(f'Unsupported predictor {predictor}')
+    row_length = columns + 1
+    previous = bytearray(columns)
+    out = bytearray()
+    for start in range(0, len(data), row_length):
+        kind, row = data[start], bytearray(data[start + 1:start + row_length])
+        for i in range(len(row)):
+            left = row[i - 1] if i else 0
+            up = previous[i]
+            if kind == 1:
+                row[i] = (row[i] + left) & 0xff
+            elif kind == 2:
+                row[i] = (row[i] + up) & 0xff
+            elif kind == 3:
+                row[i] = (row[i] + (left + up) // 2) & 0xff
+            elif kind == 4:
+                upper_left = previous[i - 1] if i else 0
+                estimate = left + up - upper_left
+                distances = (abs(estimate - left), abs(estimate - up), abs(estimate - upper_left))
+                row[i] = (row[i] + (left, up, upper_left)[distances.index(min(distances))]) & 0xff
+        out += row
+        previous = row
+    return bytes(out)
+
+
+class PDFReader:
+    """Random access to the objects of one PDF file"""
+
+    def __init__(self, path, entries=None):
+        """entries: cross-reference entries saved from an earlier read, to skip parsing the xref again"""
+        self.fd = os.open(path, os.O_RDONLY)
+        try:
+            self.size = os.fstat(self.fd).st_size
+            self.entries = {}  # num -> ('n', offset, gen) | ('c', stream num, index) | ('f',)
+            self.trailer = {}
+            self._objstms = {}
+            if entries is not None:
+                self.entries = entries
+                return
+            self._load_xref()
+            if 'Encrypt' in self.trailer:
+                raise PDFError('Encrypted PDFs are not supported')
+        except Exception:
+            os.close(self.fd)
+            raise
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read(self, offset, length):
+        return os.pread(self.fd, max(0, min(length, self.size - offset)), offset)
+
+    def _parse_at(self, offset, parser):
+        """Run parser(data) on a window at offset, growing it until the value fits"""
+        window = READ_WINDOW
+        while True:
+            data = self.read(offset, window)
+            try:
+                return parser(data)
+            except (_Truncated, IndexError):
+                if offset + len(data) >= self.size or window >= MAX_OBJECT_SIZE:
+                    raise PDFError(f'Truncated object at offset {offset}')
+                window *= 4
+
+    # Cross-reference data
+
+    def _load_xref(self):
+        tail = self.read(max(0, self.size - 1024), 1024)
+        position = tail.rfind(b'startxref')
+        if b'%PDF-' not in self.read(0, 1024) or position < 0:
+            raise PDFError('Not a PDF file')
+        try:
+            offset = int(tail[position + 9:].split()[0])
+        except (IndexError, ValueError):
+            raise PDFError('Malformed startxref')
+        seen = set()
+        # Newest section first; an object keeps the first entry found for it
+        while offset is not None and offset not in seen:
+            seen.add(offset)
+            if self.read(offset, 32).lstrip().startswith(b'xref'):
+                entries, trailer = self._parse_at(offset, self._xref_table)
+                if isinstance(trailer.get('XRefStm'), int):  # hybrid file: the stream has the newer entries
+                    self._xref_stream(trailer['XRefStm'])
+                for num, entry in entries.items():
+                    self.entries.setdefault(num, entry)
+            else:
+                trailer = self._xref_stream(offset)
+            for key, value in trailer.items():
+                self.trailer.setdefault(key, value)
+            offset = trailer.get('Prev')
+        if 'Root' not in self.trailer:
+            raise PDFError('No document catalog')
+
+    def _xref_table(self, data):
+        """({num: entry}, trailer) for a classic xref table at the start of data"""
+        entries = {}
+        pos = data.index(b'xref') + 4
+        while True:
+            pos = _skip(data, pos)
+            if data.startswith(b'trailer', pos):
+                trailer, _ = parse(data, pos + 7)
+                return entries, trailer
+            match = SUBSECTION_RE.match(data, pos)
+            if not match:
+                raise _Truncated if len(data) - pos < 32 else PDFError(f'Malformed xref table at {pos}')
+            first, count = int(match.group(1)), int(match.group(2))
+            pos = match.end()
+            if pos + count * 20 > len(data):
+                raise _Truncated
+            for n in range(count):
+                fields = data[pos:pos + 20].split()
+                if len(fields) < 3:
+                    raise PDFError(f'Malformed xref entry at {pos}')
+                entries[first + n] = ('n', int(fields[0]), int(fields[1])) if fields[2] == b'n' else ('f',)
+                pos += 20
+
+    def _xref_stream(self, offset):
+        header, data = self._stream_object(offset)
+        if header.get('Type') != 'XRef':
+            raise PDFError(f'No xref at offset {offset}')
+        widths = header['W']
+        index = header.get('Index', [0, header['Size']])
+        row = sum(widths)
+        pos = 0
+        for first, count in zip(index[::2], index[1::2]):
+            for num in range(first, first + count):
+                fields = []
+                for width in widths:
+                    fields.append(int.from_bytes(data[pos:pos + width], 'big') if width else None)
+                    pos += width
+                kind = 1 if fields[0] is None else fields[0]
+                if kind == 1:
+                    entry = ('n', fields[1], fields[2] or 0)
+                elif kind == 2:
+                    entry = ('c', fields[1], fields[2] or 0)
+                else:
+                    entry = ('f',)
+                self.entries.setdefault(num, entry)
+        if pos > len(data) or row == 0:
+            raise PDFError('Malformed xref stream')
+        return header
+
+    # Objects
+
+    def _object_at(self, offset):
+        """(value, stream data offset or None, end of the object) for the object at offset"""
+        def parser(data):
+            match = OBJ_RE.match(data)
+            if not match:
+                raise PDFError(f'No object at offset {offset}')
+            value, pos = parse(data, match.end())
+            pos = _skip(data, pos)
+            if data.startswith(b'stream', pos):
+                pos += 6
+                pos += 2 if data[pos:pos + 2] == b'\r\n' else 1
+                return value, offset + pos
+            end = data.find(b'endobj', pos)
+            if end < 0:
+                raise _Truncated
+            return value, None, offset + end + 6
+        result = self._parse_at(offset, parser)
+        if len(result) == 3:
+            return result
+        value, data_start = result
+        length = self.resolve(value.get('Length'))
+        if not isinstance(length, int) or length < 0:
+            raise PDFError(f'Stream without a usable /Length at offset {offset}')
+        after = self.read(data_start + length, 64)
+        end = after.find(b'endobj')
+        if end < 0:
+            raise PDFError(f'Unterminated stream at offset {offset}')
+        return value, (data_start, length), data_start + length + end + 6
+
+    def _stream_object(self, offset):
+        value, stream, _ = self._object_at(offset)
+        if stream is None:
+            raise PDFError(f'Expected a stream at offset {offset}')
+        return value, self._decode(value, self.read(*stream))
+
+    def _decode(self, header, data):
+        filters = header.get('Filter')
+        filters = filters if isinstance(filters, list) else [filters] if filters else []
+        params = header.get('DecodeParms') or {}
+        params = params[0] if isinstance(params, list) and params else params
+        for name in filters:
+            if name not in ('FlateDecode', 'Fl'):
+                raise PDFError(f'Unsupported stream filter {name}')
+            try:
+                data = zlib.decompress(data)
+            except zlib.error as e:
+                raise PDFError(f'Corrupt stream: {e}')
+        if filters and isinstance(params, dict) and params.get('Predictor', 1) > 1:
+            data = _unpredict(data, params.get('Columns', 1), params['Predictor'])
+        return data
+
+    def _objstm(self, num):
+        """(decoded data, [(num, start, end)]) for an object stream"""
+        if num not in self._objstms:
+            entry = self.entries.get(num)
+            if not entry or entry[0] != 'n':
+                raise PDFError(f'Missing object stream {num}')
+            header, data = self._stream_object(entry[1])
+            first, count = header['First'], header['N']
+            numbers = data[:first].split()
+            pairs = [(int(numbers[2 * i]), first + int(numbers[2 * i + 1])) for i in range(count)]
+            ends = [start for _, start in pairs[1:]] + [len(data)]
+            if len(self._objstms) > 16:
+                self._objstms.clear()
+            self._objstms[num] = (data, [(n, start, end) for (n, start), end in zip(pairs, ends)])
+        return self._objstms[num]
+
+    def get(self, num):
+        """The value of object num (a stream's dictionary for streams), or None if it does not exist"""
+        entry = self.entries.get(num)
+        if entry is None or entry[0] == 'f':
+            return None
+        if entry[0] == 'n':
+            return self._object_at(entry[1])[0]
+        data, objects = self._objstm(entry[1])
+        _, start, end = objects[entry[2]]
+        return parse(data[start:end] + b' ')[0]
+
+    def resolve(self, value):
+        seen = set()
+        while isinstance(value, Ref) and value.num not in seen:
+            seen.add(value.num)
+            value = self.get(value.num)
+        return value
+
+    def span(self, num):
+        """Byte range [start, end) of a top-level object"""
+        _, offset, _ = self.entries[num]
+        return offset, self._object_at(offset)[2]
+
+    def compressed_body(self, num):
+        """Source text of an object stored in an object stream"""
+        _, stream, index = self.entries[num]
+        data, objects = self._objstm(stream)
+        _, start, end = objects[index]
+        return data[start:end].strip()
+
+    # Page tree
+
+    def pages(self):
+        """[(page object number, inherited {key: value})] in reading order"""
+        root = self.resolve(self.trailer['Root'])
+        if not isinstance(root, dict) or not isinstance(root.get('Pages'), Ref):
+            raise PDFError('No page tree')
+        pages = []
+        self.tree_nodes = set()
+        stack = [(root['Pages'], {})]
+        while stack:
+            ref, inherited = stack.pop()
+            if ref.num in self.tree_nodes:
+                continue
+            self.tree_nodes.add(ref.num)
+            node = self.get(ref.num)
+            if not isinstance(node, dict):
+                continue
+            kids = self.resolve(node.get('Kids'))
+            if node.get('Type') == 'Pages' or isinstance(kids, list):
+                inherited = {**inherited, **{key: node[key] for key in INHERITABLE if key in node}}
+                stack.extend((kid, inherited) for kid in reversed(kids or []) if isinstance(kid, Ref))
+            else:
+                pages.append((ref.num, {key: value for key, value in inherited.items() if key not in node}))
+        return pages
@@ -0,0 +1,145 @@
+"""
+Durable work queues in SQLite, shared by the job queue (jobs.py) and webhook
+ingestion (webhooks.py).
+
+A LeasedQueue is one table in a SQLite file in STATE_DIR, so its rows survive
+restarts and are shared by every worker process. claim() leases rows inside
+BEGIN IMMEDIATE (claimed_until, attempts + 1), so several processes can drain
+one file, and a claim whose worker died is taken again once the lease lapses.
+Rows that failed max_attempts times stay in the file and count as 'dead'.
+
+Each process drains a queue with one QueueWorker thread, started on the first
+wake() in that process (threads do not survive a fork) and polling otherwise.
+"""
+import os
+import sqlite3
+import threading
+import time
+from flask import current_app
+
+
+class LeasedQueue:
+    """Table of work items with claim leases; one connection per thread"""
+
+    table = None
+    schema = ()  # CREATE statements for the table and its indexes
+    fields = ()  # columns claim() returns after id
+    done_column = 'done_at'
+    order = 'id'
+    scheduled = False  # rows have a run_after time (delays and retry backoff)
+
+    def __init__(self, path, lease, max_attempts=5):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        with self._connect() as conn:
+            for statement in self.schema:
+                conn.execute(statement)
+
+    def _connect(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # WAL + NORMAL survives process crashes without an fsync per row
+            conn.execute('PRAGMA synchronous=NORMAL')
+            local.conn, local.pid = conn, os.getpid()
+        return local.conn
+
+    def claim(self, limit=1):
+        """Lease up to `limit` due rows, oldest first; returns (id, *fields) tuples"""
+        conn = self._connect()
+        now = time.time()
+        due = ' AND run_after <= ?' if self.scheduled else ''
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                f'SELECT id, {", ".join(self.fields)} FROM {self.table} '
+                f'WHERE {self.done_column} IS NULL AND attempts < ? '
+                f'AND (claimed_until IS NULL OR claimed_until < ?){due} '
+                f'ORDER BY {self.order} LIMIT ?',
+                (self.max_attempts, now, *((now,) if self.scheduled else ()), limit)).fetchall()
+            if rows:
+                conn.execute(f'UPDATE {self.table} SET claimed_until = ?, attempts = attempts + 1 '
+                             f'WHERE id IN ({",".join("?" * len(rows))})',
+                             [now + self.lease] + [row[0] for row in rows])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return rows
+
+    def complete(self, ids):
+        if ids:
+            self._connect().execute(
+                f'UPDATE {self.table} SET {self.done_column} = ?, claimed_until = NULL, last_error = NULL '
+                f'WHERE id IN ({",".join("?" * len(ids))})', [time.time()] + list(ids))
+
+    def fail(self, id_, error, retry_in=None):
+        """Release a claimed row for another attempt (after retry_in seconds on scheduled queues)"""
+        if self.scheduled and retry_in is not None:
+            self._connect().execute(f'UPDATE {self.table} SET claimed_until = NULL, run_after = ?, '
+                                    'last_error = ? WHERE id = ?', (time.time() + retry_in, error[:500], id_))
+        else:
+            self._connect().execute(f'UPDATE {self.table} SET claimed_until = NULL, last_error = ? '
+                                    'WHERE id = ?', (error[:500], id_))
+
+    def counts(self):
+        row = self._connect().execute(
+            f'SELECT COUNT(*), SUM({self.done_column} IS NULL AND attempts < ?), '
+            f'SUM({self.done_column} IS NULL AND attempts >= ?) FROM {self.table}',
+            (self.max_attempts, self.max_attempts)).fetchone()
+        return {'total': row[0], 'pending': row[1] or 0, 'dead': row[2] or 0}
+
+
+class QueueWorker:
+    """Background thread that calls drain() in an app context; woken by wake(), polls otherwise"""
+
+    def __init__(self, app, name, drain, poll_interval):
+        self.app = app
+        self.name = name
+        self.drain = drain
+        self.poll_interval = poll_interval
+        self.wanted = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            self.wanted.wait(self.poll_interval)
+            self.wanted.clear()
+            try:
+                with self.app.app_context():
+                    self.drain()
+            except Exception as e:
+                self.app.logger.error(f"{self.name} error: {e}")
+
+
+class QueueState:
+    """A queue and this process's worker for it (app.extensions value)"""
+
+    def __init__(self, queue, name, drain, enabled_key, interval_key):
+        self.queue = queue
+        self.name = name
+        self.drain = drain
+        self.enabled_key = enabled_key
+        self.interval_key = interval_key
+        self.worker = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def wake(self):
+        """Nudge this process's worker, starting it first if needed"""
+        config = current_app.config
+        if not config[self.enabled_key]:
+            return
+        # Threads do not survive a fork, so each worker process starts its own
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.worker = QueueWorker(current_app._get_current_object(), self.name, self.drain,
+                                              config[self.interval_key])
+                    self.pid = os.getpid()
+        self.worker.wanted.set()
@@ -0,0 +1,177 @@
+"""
+Reconcile pending orders against the payment gateway.
+
+Orders whose webhook never arrived stay 'pending'. reconcile() walks pending
+Razorpay orders in id order, RECONCILE_BATCH_SIZE at a time (keyset
+pagination, so memory stays flat however many there are), asks the gateway
+for each order's payments on a pool of RECONCILE_CONCURRENCY threads, and
+applies the results with one UPDATE per outcome per batch:
+
+- a captured payment completes the order and grants its content;
+- no successful payment after RECONCILE_FAIL_AFTER seconds fails it;
+- anything else is left for the next run.
+
+Orders younger than RECONCILE_MIN_AGE are skipped (the customer may still be
+paying). The last reconciled id is checkpointed in STATE_DIR after every
+batch, so an interrupted run resumes where it stopped; a finished pass resets
+the checkpoint. If the gateway is down the run stops before the first order
+it could not check. Run it with python reconcile_orders.py.
+"""
+import fcntl
+import json
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from razorpay.errors import BadRequestError
+from sqlalchemy import case, select, update
+from . import stats
+from .entitlements import grant_for_orders
+from .extensions import db
+from .models import Order
+from .payments import TRANSIENT_ERRORS, GatewayUnavailable, get_gateway
+
+
+class ReconcileBusy(Exception):
+    """Another reconciliation run holds the lock"""
+
+
+def _path(name):
+    return os.path.join(current_app.config['STATE_DIR'], name)
+
+
+def load_checkpoint():
+    try:
+        with open(_path('reconcile.json')) as f:
+            return json.load(f).get('last_id', 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def save_checkpoint(last_id):
+    path = _path('reconcile.json')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'last_id': last_id, 'saved_at': datetime.utcnow().isoformat()}, f)
+    os.replace(tmp_path, path)
+
+
+def resolve(created_at, payments, now, fail_after):
+    """('completed', payment_id), ('failed', None) or None to leave the order pending"""
+    for payment in payments:
+        if payment.get('status') == 'captured':
+            return 'completed', payment['id']
+    if created_at is not None and now - created_at > timedelta(seconds=fail_after):
+        return 'failed', None
+    return None
+
+
+def _fetch(gateway, razorpay_order_id):
+    try:
+        return gateway.order_payments(razorpay_order_id).get('items', [])
+    except BadRequestError:
+        # Unknown to the gateway: nothing will ever be captured for it
+        return []
+    except (GatewayUnavailable,) + TRANSIENT_ERRORS as e:
+        return e
+
+
+def _apply(completed, failed):
+    """Settle a batch; returns the ids of the orders actually completed and failed.
+
+    The UPDATEs only match orders that are still pending, so an order a
+    webhook settled meanwhile is left out of RETURNING and is neither
+    granted nor counted twice.
+    """
+    completed_ids, failed_ids = set(), set()
+    if completed:
+        payment_id = case({row.id: payment_id for row, payment_id in completed}, value=Order.id)
+        completed_ids = set(db.session.execute(
+            update(Order.__table__)
+            .where(Order.id.in_([row.id for row, _ in completed]), Order.payment_status == 'pending')
+            .values(payment_status='completed', razorpay_payment_id=payment_id, transaction_id=payment_id)
+            .returning(Order.id)).scalars())
+        if completed_ids:
+            grant_for_orders(sorted(completed_ids))
+    if failed:
+        failed_ids = set(db.session.execute(
+            update(Order.__table__)
+            .where(Order.id.in_([row.id for row in failed]), Order.payment_status == 'pending')
+            .values(payment_status='failed')
+            .returning(Order.id)).scalars())
+    # Core UPDATEs skip the stats flush hooks, so count the rows they changed here
+    deltas = Counter({('orders:pending', None): -(len(completed_ids) + len(failed_ids)),
+                      ('orders:failed', None): len(failed_ids),
+                      ('orders:completed', None): len(completed_ids)})
+    for row, _ in completed:
+        if row.id in completed_ids:
+            day = row.created_at.date()
+            deltas.update({('orders:completed', day): 1, ('revenue', None): row.amount,
+                           ('revenue', day): row.amount})
+    stats.adjust(deltas)
+    db.session.commit()
+    return completed_ids, failed_ids
+
+
+def reconcile(batch_size=None, max_batches=None, restart=False):
+    """Run (or resume) a reconciliation pass; returns counts for the run"""
+    config = current_app.config
+    batch_size = batch_size or config['RECONCILE_BATCH_SIZE']
+    os.makedirs(config['STATE_DIR'], exist_ok=True)
+    with open(_path('reconcile.lock'), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise ReconcileBusy('A reconciliation run is already in progress')
+        return _run(batch_size, max_batches, 0 if restart else load_checkpoint())
+
+
+def _run(batch_size, max_batches, last_id):
+    config = current_app.config
+    gateway = get_gateway()
+    now = datetime.utcnow()
+    cutoff = now - timedelta(seconds=config['RECONCILE_MIN_AGE'])
+    counts = {'checked': 0, 'completed': 0, 'failed': 0, 'errors': 0, 'finished': False}
+    batches = 0
+
+    with ThreadPoolExecutor(config['RECONCILE_CONCURRENCY'], thread_name_prefix='reconcile') as pool:
+        while max_batches is None or batches < max_batches:
+            # ix_order_payment_status is ordered by (status, id), so each page is an index range scan
+            rows = db.session.execute(
+                select(Order.id, Order.razorpay_order_id, Order.created_at, Order.amount)
+                .where(Order.payment_status == 'pending', Order.razorpay_order_id.isnot(None),
+                       Order.created_at <= cutoff, Order.id > last_id)
+                .order_by(Order.id)
+                .limit(batch_size)).all()
+            db.session.rollback()
+            if not rows:
+                counts['finished'] = True
+                save_checkpoint(0)
+                break
+
+            results = pool.map(lambda row: _fetch(gateway, row.razorpay_order_id), rows)
+            completed, failed, error = [], [], None
+            for row, payments in zip(rows, results):
+                if isinstance(payments, Exception):
+                    error = payments
+                    break
+                outcome = resolve(row.created_at, payments, now, config['RECONCILE_FAIL_AFTER'])
+                if outcome and outcome[0] == 'completed':
+                    completed.append((row, outcome[1]))
+                elif outcome:
+                    failed.append(row)
+                last_id = row.id
+                counts['checked'] += 1
+
+            completed_ids, failed_ids = _apply(completed, failed)
+            save_checkpoint(last_id)
+            counts['completed'] += len(completed_ids)
+            counts['failed'] += len(failed_ids)
+            batches += 1
+            if error is not None:
+                counts['errors'] += 1
+                current_app.logger.warning(f'Reconciliation stopped at order {last_id}: {error}')
+                break
+    return counts
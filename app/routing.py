@@ -0,0 +1,101 @@
+"""
+Read/write splitting between the primary database and read replicas.
+
+Replicas are listed in SQLALCHEMY_REPLICA_URIS and registered as extra
+Flask-SQLAlchemy binds ('replica0', 'replica1', ...). Views decorated with
+@use_replica send their SELECTs to one replica, picked per request; flushes,
+UPDATE/DELETE statements and everything in undecorated views go to the
+primary as before.
+
+A request that writes sets a short-lived cookie, and while it is valid that
+browser's replica views read from the primary too, so a buyer sees their own
+purchase on the next page even if the replicas lag (read-your-writes).
+REPLICA_STICKY_SECONDS should exceed the usual replication lag.
+
+Process-wide caches that outlive the request (the catalog, user identities)
+load inside primary() so a lagging replica is never cached as current.
+"""
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+
+STICKY_COOKIE = 'db_primary_until'
+_watching = []
+
+
+def replica_binds(config):
+    return [f'replica{i}' for i in range(len(config.get('SQLALCHEMY_REPLICA_URIS') or ()))]
+
+
+class RoutingSession(Session):
+    """Session that sends SELECTs from replica views to a read replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and isinstance(clause, Select):
+            key = _replica_for_request()
+            if key is not None:
+                return self._db.engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _replica_for_request():
+    if not has_request_context() or not g.get('db_use_replica') or g.get('db_primary'):
+        return None
+    try:
+        if float(request.cookies.get(STICKY_COOKIE, 0)) > time.time():
+            return None
+    except ValueError:
+        pass
+    if 'db_replica' not in g:
+        binds = replica_binds(current_app.config)
+        # One replica per request so its reads see a single consistent snapshot
+        g.db_replica = random.choice(binds) if binds else None
+    return g.db_replica
+
+
+def use_replica(view):
+    """Route a read-only view's SELECTs to a replica (when replicas are configured)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_use_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def primary():
+    """Read from the primary inside a replica view"""
+    if not has_request_context():
+        yield
+        return
+    previous = g.get('db_primary', False)
+    g.db_primary = True
+    try:
+        yield
+    finally:
+        g.db_primary = previous
+
+
+def _stick_to_primary(response):
+    if g.get('db_wrote') and replica_binds(current_app.config):
+        seconds = current_app.config['REPLICA_STICKY_SECONDS']
+        response.set_cookie(STICKY_COOKIE, str(int(time.time() + seconds) + 1), max_age=seconds,
+                            httponly=True, samesite='Lax')
+    return response
+
+
+def init_app(app, db):
+    app.config.setdefault('REPLICA_STICKY_SECONDS', 10)
+    app.after_request(_stick_to_primary)
+    if not _watching:
+        _watching.append(db.session)
+
+        @event.listens_for(db.session, 'after_flush')
+        def _after_flush(db_session, flush_context):
+            if has_request_context():
+                g.db_wrote = True
@@ -0,0 +1,485 @@
+"""
+Full-text product search.
+
+Indexes active products plus the static catalogs (STATIC_PRODUCTS in
+main/routes.py and store/routes.py, EBOOKS in ebooks_catalog.py), ranked with
+BM25 with the product name weighted above the description. Two backends:
+
+- 'fts5': an SQLite FTS5 table next to the product table, updated in the
+  same transaction as the product rows (one shared index for all workers);
+- 'memory': an in-process inverted index, for PostgreSQL and SQLite builds
+  without FTS5. A commit that changes products updates the committing
+  worker's index and bumps a version stamp; other workers rebuild theirs on
+  their next search.
+
+SEARCH_BACKEND = 'auto' picks fts5 when the database supports it. Either way
+the index follows product inserts, edits, deactivation and deletes through
+session flush hooks, so admin writes need no extra calls; bulk UPDATEs that
+bypass the ORM call reindex().
+
+Text is folded before indexing so Hindi and Hinglish spellings meet:
+Devanagari is transliterated to Latin (व्यापार -> vyapar), and common
+romanization variants are merged (seekhna/sikhna, paisa/paissa, wala/vala).
+The last query word matches as a prefix, which is what suggest() uses for
+autocomplete.
+"""
+import heapq
+import math
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from bisect import bisect_left
+from typing import NamedTuple
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect, select, text
+from .cache import VersionStamp
+from .extensions import db
+from .routing import primary
+
+EXTENSION_KEY = 'search'
+TABLE = 'product_search'
+NAME_WEIGHT = 4.0
+SUMMARY_LENGTH = 200
+WATCHED_FIELDS = ('name', 'description', 'category', 'price', 'is_active')
+STOPWORDS = frozenset(
+    'a an and are for in is of on or the to with '  # English
+    'aur hai hain ka ke ki ko me mein se'.split())   # Hinglish
+_watching = []
+
+# -- tokenization -------------------------------------------------------------
+
+_WORD = re.compile(r'(?:[^\W_]|[ऀ-ॿ])+')
+_DEVANAGARI = re.compile(r'[ऀ-ॿ]')
+_VOWELS = dict(zip('अआइईउऊऋएऐओऔ', ('a', 'aa', 'i', 'ii', 'u', 'uu', 'ri', 'e', 'ai', 'o', 'au')))
+_MATRAS = dict(zip('ािीुूृेैोौ', ('aa', 'i', 'ii', 'u', 'uu', 'ri', 'e', 'ai', 'o', 'au')))
+_CONSONANTS = dict(zip(
+    'कखगघङचछजझञटठडढणतथदधनपफबभमयरलवशषसह',
+    ('k', 'kh', 'g', 'gh', 'n', 'ch', 'chh', 'j', 'jh', 'n', 't', 'th', 'd', 'dh', 'n',
+     't', 'th', 'd', 'dh', 'n', 'p', 'ph', 'b', 'bh', 'm', 'y', 'r', 'l', 'v', 'sh', 'sh', 's', 'h')))
+_MARKS = {'ं': 'n', 'ँ': 'n', 'ः': 'h'}
+_VIRAMA, _NUKTA = '्', '़'
+_FOLDS = (('aa', 'a'), ('ee', 'i'), ('ii', 'i'), ('oo', 'u'), ('uu', 'u'), ('ph', 'f'), ('w', 'v'))
+_REPEATS = re.compile(r'([a-z])\1+')
+
+
+def transliterate(word):
+    """Devanagari word -> Latin, dropping the inherent 'a' where Hindi does (word end, VC_CV)"""
+    units = []  # (kind, text): C consonant, A inherent a, V vowel, M other mark
+    for ch in word.replace(_NUKTA, ''):
+        if ch in _CONSONANTS:
+            units += [('C', _CONSONANTS[ch]), ('A', 'a')]
+        elif ch in _MATRAS and units and units[-1][0] == 'A':
+            units[-1] = ('V', _MATRAS[ch])
+        elif ch == _VIRAMA and units and units[-1][0] == 'A':
+            units.pop()
+        elif ch in _VOWELS:
+            units.append(('V', _VOWELS[ch]))
+        elif ch in _MARKS:
+            units.append(('M', _MARKS[ch]))
+        elif '०' <= ch <= '९':
+            units.append(('M', str(ord(ch) - ord('०'))))
+    kinds = [kind for kind, _ in units]
+    out = []
+    for i, (kind, value) in enumerate(units):
+        if kind == 'A' and (i == len(units) - 1 or (
+                i >= 2 and kinds[i - 2] == 'V' and kinds[i + 1:i + 2] == ['C']
+                and kinds[i + 2:i + 3] in (['V'], ['A']))):
+            continue
+        out.append(value)
+    return ''.join(out)
+
+
+def fold(word):
+    """Merge common Hinglish spelling variants of a lower-case Latin word"""
+    for old, new in _FOLDS:
+        word = word.replace(old, new)
+    return _REPEATS.sub(r'\1', word)
+
+
+def tokenize(value, keep_stopwords=False):
+    """Index terms for a piece of text (all folded to lower-case Latin where possible)"""
+    terms = []
+    for word in _WORD.findall(unicodedata.normalize('NFKC', value or '').lower()):
+        if _DEVANAGARI.search(word):
+            word = transliterate(word)
+        if word.isascii():
+            word = fold(word)
+        if word and (keep_stopwords or word not in STOPWORDS):
+            terms.append(word)
+    return terms
+
+
+# -- documents ----------------------------------------------------------------
+
+class SearchHit(NamedTuple):
+    """One result; kind is 'product' (DB or static, shown by store.product_detail) or 'ebook'"""
+    id: int
+    kind: str
+    name: str
+    summary: str
+    category: str
+    price: float
+    score: float = 0.0
+
+
+class Document(NamedTuple):
+    key: int  # FTS rowid: product id, negative for static catalog entries
+    hit: SearchHit
+    name_terms: tuple
+    body_terms: tuple
+
+
+def _document(key, kind, ref, name, category, price, *body):
+    text_body = ' '.join(part for part in body if part)
+    summary = text_body if len(text_body) <= SUMMARY_LENGTH else text_body[:SUMMARY_LENGTH].rsplit(' ', 1)[0] + '…'
+    hit = SearchHit(ref, kind, name, summary, category, float(price or 0))
+    return Document(key, hit, tuple(tokenize(name)), tuple(tokenize(f'{text_body} {category}')))
+
+
+def product_document(product):
+    return _document(product.id, 'product', product.id, product.name, product.category, product.price,
+                     product.description)
+
+
+def static_documents():
+    """Documents for the catalogs that live in code, keyed -1, -2, ..."""
+    from ebooks_catalog import EBOOKS
+    from .main.routes import STATIC_PRODUCTS as MAIN_PRODUCTS
+    from .store.routes import STATIC_PRODUCTS as STORE_PRODUCTS
+    entries = [('product', data) for data in {**MAIN_PRODUCTS, **STORE_PRODUCTS}.values()]
+    entries += [('ebook', data) for data in EBOOKS]
+    documents = []
+    for n, (kind, data) in enumerate(entries, start=1):
+        documents.append(_document(
+            -n, kind, data['id'], data.get('name') or data['title'], data['category'], data.get('price'),
+            data.get('description'), data.get('detailed_description'), ' '.join(data.get('features', ())),
+            data.get('language'), data.get('author')))
+    return documents
+
+
+def _active_documents():
+    from .models import Product
+    with primary():
+        for product in db.session.scalars(select(Product).where(Product.is_active.is_(True))
+                                          .order_by(Product.id).execution_options(yield_per=1000)):
+            yield product_document(product)
+
+
+# -- in-process index ---------------------------------------------------------
+
+class InvertedIndex:
+    """Term -> {doc key: weighted term frequency}, scored with BM25"""
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, documents=()):
+        self.postings = {}
+        self.docs = {}
+        self.lengths = {}
+        self.doc_terms = {}
+        self.total_length = 0.0
+        self._vocabulary = None
+        self._norm = None
+        self._lock = threading.Lock()
+        for document in documents:
+            self._add(document)
+
+    def _add(self, document):
+        frequencies = {}
+        for term in document.name_terms:
+            frequencies[term] = frequencies.get(term, 0) + NAME_WEIGHT
+        for term in document.body_terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term, frequency in frequencies.items():
+            if term not in self.postings:
+                self._vocabulary = None
+                self.postings[term] = {}
+            self.postings[term][document.key] = frequency
+        self.doc_terms[document.key] = tuple(frequencies)
+        self.docs[document.key] = document.hit
+        self.lengths[document.key] = length = NAME_WEIGHT * len(document.name_terms) + len(document.body_terms)
+        self.total_length += length
+
+    def _remove(self, key):
+        if self.docs.pop(key, None) is None:
+            return
+        self.total_length -= self.lengths.pop(key)
+        for term in self.doc_terms.pop(key):
+            del self.postings[term][key]
+            if not self.postings[term]:
+                del self.postings[term]
+                self._vocabulary = None
+
+    def update(self, upserts=(), deletes=()):
+        with self._lock:
+            self._norm = None
+            for key in deletes:
+                self._remove(key)
+            for document in upserts:
+                self._remove(document.key)
+                self._add(document)
+
+    def _expand(self, prefix):
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+        vocabulary = self._vocabulary
+        i = bisect_left(vocabulary, prefix)
+        while i < len(vocabulary) and vocabulary[i].startswith(prefix):
+            yield vocabulary[i]
+            i += 1
+
+    def _norms(self):
+        """BM25 length normalisation per document, recomputed after writes"""
+        if self._norm is None:
+            average = self.total_length / len(self.docs)
+            self._norm = {key: self.k1 * (1 - self.b + self.b * length / average)
+                          for key, length in self.lengths.items()}
+        return self._norm
+
+    def search(self, terms, prefix=True, limit=20, offset=0):
+        with self._lock:
+            if not terms or not self.docs:
+                return []
+            groups = []
+            for n, term in enumerate(terms):
+                matched = self._expand(term) if prefix and n == len(terms) - 1 else [term]
+                postings = [self.postings[candidate] for candidate in matched if candidate in self.postings]
+                if not postings:
+                    return []
+                groups.append(postings)
+            # Every query word must match: start from the rarest and only score what is still in the running
+            groups.sort(key=lambda postings: sum(map(len, postings)))
+            norms = self._norms()
+            count = len(self.docs)
+            scores = None
+            for postings_list in groups:
+                term_scores = {}
+                for postings in postings_list:
+                    weight = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5)) * (self.k1 + 1)
+                    if scores is None:
+                        items = postings.items()
+                    elif len(scores) < len(postings):
+                        items = ((key, postings[key]) for key in scores if key in postings)
+                    else:
+                        items = ((key, frequency) for key, frequency in postings.items() if key in scores)
+                    for key, frequency in items:
+                        term_scores[key] = term_scores.get(key, 0.0) + weight * frequency / (frequency + norms[key])
+                scores = term_scores if scores is None else {
+                    key: scores[key] + score for key, score in term_scores.items()}
+                if not scores:
+                    return []
+            ranked = heapq.nsmallest(offset + limit, scores.items(), key=lambda item: (-item[1], item[0]))[offset:]
+            return [self.docs[key]._replace(score=round(score, 4)) for key, score in ranked]
+
+
+# -- backends -----------------------------------------------------------------
+
+class _SearchState:
+    def __init__(self, backend, stamp):
+        self.backend = backend
+        self.stamp = stamp
+        self.index = None
+        self.version = None
+        self.lock = threading.Lock()
+
+
+def _fts5_available(engine):
+    if engine.dialect.name != 'sqlite':
+        return False
+    try:
+        connection = sqlite3.connect(':memory:')
+        connection.execute('CREATE VIRTUAL TABLE probe USING fts5(body)')
+        connection.close()
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def init_app(app):
+    app.config.setdefault('SEARCH_BACKEND', 'auto')
+    backend = app.config['SEARCH_BACKEND']
+    if backend == 'auto':
+        with app.app_context():
+            backend = 'fts5' if _fts5_available(db.engine) else 'memory'
+    stamp = VersionStamp(os.path.join(app.config['STATE_DIR'], 'search.version'))
+    app.extensions[EXTENSION_KEY] = _SearchState(backend, stamp)
+    if not _watching:
+        watch(db.session)
+
+
+def _state():
+    return current_app.extensions[EXTENSION_KEY]
+
+
+def prepare():
+    """Create the FTS table (indexing everything) if missing and refresh the static entries; at startup"""
+    if _state().backend != 'fts5':
+        return
+    exists = db.session.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {'name': TABLE}).first()
+    if not exists:
+        # prefix='2 3' indexes short prefixes, so autocomplete on 'tr' or 'opt' needn't merge every matching term
+        db.session.execute(text(
+            f"CREATE VIRTUAL TABLE {TABLE} USING fts5(name_terms, body_terms, kind UNINDEXED, ref UNINDEXED, "
+            f"name UNINDEXED, summary UNINDEXED, category UNINDEXED, price UNINDEXED, tokenize='unicode61', "
+            f"prefix='2 3')"))
+        rebuild()
+    else:
+        _fts_write(db.session.connection(), static_documents(),
+                   delete=text(f'DELETE FROM {TABLE} WHERE rowid < 0'))
+        db.session.commit()
+
+
+def rebuild():
+    """Reindex every active product and static entry"""
+    state = _state()
+    if state.backend == 'fts5':
+        connection = db.session.connection()
+        _fts_write(connection, static_documents(), delete=text(f'DELETE FROM {TABLE}'))
+        batch = []
+        for document in _active_documents():
+            batch.append(document)
+            if len(batch) >= 1000:
+                _fts_write(connection, batch)
+                batch = []
+        _fts_write(connection, batch)
+        db.session.commit()
+    else:
+        with state.lock:
+            state.index = None
+        state.stamp.bump()
+
+
+def reindex(product_ids):
+    """Re-read products changed outside the ORM (bulk UPDATEs) into the index, in the current transaction"""
+    from .models import Product
+    product_ids = list(product_ids)
+    upserts = []
+    for offset in range(0, len(product_ids), 500):
+        upserts += [product_document(row) for row in db.session.execute(
+            select(Product.id, Product.name, Product.description, Product.category, Product.price)
+            .where(Product.id.in_(product_ids[offset:offset + 500]), Product.is_active.is_(True)))]
+    deletes = set(product_ids) - {document.key for document in upserts}
+    _queue(db.session(), upserts, deletes)
+
+
+def _fts_write(connection, documents, deletes=(), delete=None):
+    if delete is not None:
+        connection.execute(delete)
+    keys = [{'key': key} for key in deletes] + [{'key': document.key} for document in documents]
+    if keys:
+        connection.execute(text(f'DELETE FROM {TABLE} WHERE rowid = :key'), keys)
+    if documents:
+        connection.execute(text(
+            f'INSERT INTO {TABLE} (rowid, name_terms, body_terms, kind, ref, name, summary, category, price) '
+            'VALUES (:key, :name_terms, :body_terms, :kind, :ref, :name, :summary, :category, :price)'),
+            [{'key': d.key, 'name_terms': ' '.join(d.name_terms), 'body_terms': ' '.join(d.body_terms),
+              'kind': d.hit.kind, 'ref': d.hit.id, 'name': d.hit.name, 'summary': d.hit.summary,
+              'category': d.hit.category, 'price': d.hit.price} for d in documents])
+
+
+def _queue(db_session, upserts, deletes):
+    """fts5: write now, in the flushing transaction; memory: apply after commit"""
+    if _state().backend == 'fts5':
+        _fts_write(db_session.connection(), upserts, deletes)
+    else:
+        changes = db_session.info.setdefault('search_changes', ({}, set()))
+        for document in upserts:
+            changes[0][document.key] = document
+            changes[1].discard(document.key)
+        for key in deletes:
+            changes[0].pop(key, None)
+            changes[1].add(key)
+
+
+def _apply_committed(upserts, deletes):
+    state = _state()
+    with state.lock:
+        current = state.index is not None and state.stamp.current() == state.version
+        version = state.stamp.bump()
+        if current:
+            state.index.update(upserts, deletes)
+            state.version = version
+        else:
+            state.index = None
+
+
+def watch(session_factory):
+    """Follow product inserts, edits and deletes"""
+    from .models import Product
+    _watching.append(session_factory)
+
+    @event.listens_for(session_factory, 'after_flush')
+    def _after_flush(db_session, flush_context):
+        if not (has_app_context() and EXTENSION_KEY in current_app.extensions):
+            return
+        upserts, deletes = [], set()
+        for obj in db_session.new:
+            if isinstance(obj, Product) and obj.is_active is not False:
+                upserts.append(product_document(obj))
+        for obj in db_session.dirty:
+            if isinstance(obj, Product) and any(inspect(obj).attrs[name].history.has_changes()
+                                                for name in WATCHED_FIELDS):
+                if obj.is_active is False:
+                    deletes.add(obj.id)
+                else:
+                    upserts.append(product_document(obj))
+        deletes.update(obj.id for obj in db_session.deleted if isinstance(obj, Product))
+        if upserts or deletes:
+            _queue(db_session, upserts, deletes)
+
+    @event.listens_for(session_factory, 'after_commit')
+    def _after_commit(db_session):
+        changes = db_session.info.pop('search_changes', None)
+        if changes and has_app_context() and EXTENSION_KEY in current_app.extensions:
+            _apply_committed(list(changes[0].values()), changes[1])
+
+    @event.listens_for(session_factory, 'after_rollback')
+    def _after_rollback(db_session):
+        db_session.info.pop('search_changes', None)
+
+
+def _memory_index():
+    state = _state()
+    version = state.stamp.current()
+    if state.index is not None and state.version == version:
+        return state.index
+    with state.lock:
+        if state.index is None or state.version != version:
+            state.index = InvertedIndex(static_documents() + list(_active_documents()))
+            state.version = version
+        return state.index
+
+
+# -- queries ------------------------------------------------------------------
+
+def _fts_query(terms, prefix):
+    quoted = ['"{}"'.format(term.replace('"', '""')) for term in terms]
+    if prefix:
+        quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def search(query, limit=20, offset=0, prefix=True):
+    """Best matches for `query` (every word must match; the last one as a prefix)"""
+    terms = tokenize(query)
+    if not terms:
+        return []
+    if _state().backend != 'fts5':
+        return _memory_index().search(terms, prefix, limit, offset)
+    rows = db.session.execute(text(
+        f'SELECT kind, ref, name, summary, category, price, bm25({TABLE}, {NAME_WEIGHT}, 1.0) AS score '
+        f'FROM {TABLE} WHERE {TABLE} MATCH :query ORDER BY score, rowid LIMIT :limit OFFSET :offset'),
+        {'query': _fts_query(terms, prefix), 'limit': limit, 'offset': offset})
+    return [SearchHit(int(ref), kind, name, summary, category, float(price), round(-score, 4))
+            for kind, ref, name, summary, category, price, score in rows]
+
+
+def suggest(prefix, limit=8):
+    """Autocomplete: names of the best products matching what has been typed so far"""
+    names = []
+    for hit in search(prefix, limit=limit * 2):
+        if hit.name not in names:
+            names.append(hit.name)
+    return names[:limit]
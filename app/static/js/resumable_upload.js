@@ -0,0 +1,123 @@
+/*
+ * Resumable chunked uploads for the admin forms (tus 1.0 subset, see app/admin/uploads.py).
+ *
+ * Files are sent in chunks with PATCH; if the connection drops, the upload
+ * asks the server for its offset and continues from there. The upload URL is
+ * remembered in localStorage, so even a page reload resumes the same upload.
+ */
+(function () {
+    const CHUNK_SIZE = 8 * 1024 * 1024;
+    const MAX_RETRIES = 8;
+
+    function encodeMetadata(metadata) {
+        return Object.entries(metadata)
+            .filter(([, value]) => value !== undefined && value !== null && value !== '')
+            .map(([key, value]) => `${key} ${btoa(unescape(encodeURIComponent(String(value))))}`)
+            .join(',');
+    }
+
+    function sleep(ms) {
+        return new Promise(resolve => setTimeout(resolve, ms));
+    }
+
+    function request(method, url, headers, body) {
+        return fetch(url, {
+            method: method,
+            headers: Object.assign({'Tus-Resumable': '1.0.0'}, headers),
+            body: body,
+            credentials: 'same-origin'
+        });
+    }
+
+    async function createUpload(endpoint, file, metadata) {
+        const response = await request('POST', endpoint, {
+            'Upload-Length': file.size,
+            'Upload-Metadata': encodeMetadata(Object.assign({filename: file.name}, metadata))
+        });
+        if (response.status !== 201) {
+            const data = await response.json().catch(() => ({}));
+            throw new Error(data.error || `Upload could not be started (${response.status})`);
+        }
+        return response.headers.get('Location');
+    }
+
+    async function serverOffset(location) {
+        const response = await request('HEAD', location);
+        if (!response.ok) {
+            return null;
+        }
+        return parseInt(response.headers.get('Upload-Offset'), 10);
+    }
+
+    async function upload(file, options) {
+        const storageKey = `upload:${options.kind}:${file.name}:${file.size}:${file.lastModified}`;
+        let location = localStorage.getItem(storageKey);
+        let offset = location ? await serverOffset(location) : null;
+        if (offset === null) {
+            location = await createUpload(options.endpoint, file, {kind: options.kind});
+            localStorage.setItem(storageKey, location);
+            offset = 0;
+        }
+
+        let retries = 0;
+        while (offset < file.size) {
+            const chunk = file.slice(offset, offset + CHUNK_SIZE);
+            try {
+                const response = await request('PATCH', location, {
+                    'Upload-Offset': offset,
+                    'Content-Type': 'application/offset+octet-stream'
+                }, chunk);
+                if (response.status === 204 || response.status === 409) {
+                    offset = parseInt(response.headers.get('Upload-Offset'), 10);
+                    retries = 0;
+                } else {
+                    throw new Error(`Chunk upload failed (${response.status})`);
+                }
+            } catch (error) {
+                if (++retries > MAX_RETRIES) {
+                    throw error;
+                }
+                await sleep(Math.min(1000 * 2 ** retries, 30000));
+                const resumed = await serverOffset(location).catch(() => null);
+                offset = resumed === null ? offset : resumed;
+            }
+            if (options.onProgress) {
+                options.onProgress(offset, file.size);
+            }
+        }
+        localStorage.removeItem(storageKey);
+        return location.split('/').pop();
+    }
+
+    /*
+     * Send the form's content file through the resumable API on submit, then
+     * submit the rest of the form with the upload id instead of the file.
+     */
+    window.useResumableUpload = function (form, fileInput, kindFor, onProgress) {
+        form.addEventListener('submit', async function (event) {
+            const file = fileInput.files[0];
+            if (!file || form.dataset.uploaded || event.defaultPrevented) {
+                return;
+            }
+            event.preventDefault();
+            try {
+                const uploadId = await upload(file, {
+                    endpoint: form.dataset.uploadEndpoint,
+                    kind: kindFor(),
+                    onProgress: onProgress
+                });
+                const hidden = document.createElement('input');
+                hidden.type = 'hidden';
+                hidden.name = 'upload_id';
+                hidden.value = uploadId;
+                form.appendChild(hidden);
+                fileInput.disabled = true;
+                form.dataset.uploaded = '1';
+                form.submit();
+            } catch (error) {
+                alert(`Upload failed: ${error.message}. Submit again to resume.`);
+                form.dispatchEvent(new CustomEvent('upload-failed'));
+            }
+        });
+    };
+})();
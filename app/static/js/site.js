@@ -0,0 +1,59 @@
+// Theme management
+const themeToggle = document.getElementById('themeToggle');
+const themeIcon = document.getElementById('themeIcon');
+const body = document.body;
+
+// Get saved theme or default to dark
+const savedTheme = localStorage.getItem('theme') || 'dark';
+
+// Apply saved theme
+function applyTheme(theme) {
+    body.setAttribute('data-theme', theme);
+    if (theme === 'light') {
+        themeIcon.className = 'fas fa-moon';
+        themeToggle.title = 'Switch to dark mode';
+    } else {
+        themeIcon.className = 'fas fa-sun';
+        themeToggle.title = 'Switch to light mode';
+    }
+}
+
+// Initialize theme
+applyTheme(savedTheme);
+
+// Theme toggle functionality
+themeToggle.addEventListener('click', () => {
+    const currentTheme = body.getAttribute('data-theme');
+    const newTheme = currentTheme === 'dark' ? 'light' : 'dark';
+
+    // Add transition class for smooth theme change
+    body.style.transition = 'all 0.3s ease';
+
+    applyTheme(newTheme);
+    localStorage.setItem('theme', newTheme);
+
+    // Remove transition after animation
+    setTimeout(() => {
+        body.style.transition = '';
+    }, 300);
+});
+
+// Add fade-in animation to cards on scroll
+const observerOptions = {
+    threshold: 0.1,
+    rootMargin: '0px 0px -50px 0px'
+};
+
+const observer = new IntersectionObserver((entries) => {
+    entries.forEach(entry => {
+        if (entry.isIntersecting) {
+            entry.target.classList.add('fade-in-up');
+        }
+    });
+}, observerOptions);
+
+// Observe cards when DOM is loaded
+document.addEventListener('DOMContentLoaded', () => {
+    const cards = document.querySelectorAll('.card');
+    cards.forEach(card => observer.observe(card));
+});
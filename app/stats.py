@@ -0,0 +1,266 @@
+"""
+Precomputed counters for the admin dashboard.
+
+The dashboard used to run four COUNT queries (full scans at scale) per view.
+Instead, StatCounter keeps running totals and StatDaily per-day rollups:
+
+    products, products:<category>, users, orders:<status>, revenue   (totals)
+    users, orders, orders:completed, revenue                         (per day)
+
+They are updated in the same transaction as the rows they count, from
+session flush hooks that look at inserted, deleted and changed products,
+users and orders. Bulk UPDATEs that bypass the ORM call adjust() themselves.
+Daily rollups are keyed by the row's created_at day, so they can always be
+recomputed from the tables.
+
+Anything that slips past the hooks (raw SQL, manual fixes) is corrected by
+verify(), which recounts and rewrites drifted counters. The dashboard queues
+a 'stats.verify' job when the last check is older than STATS_VERIFY_INTERVAL.
+"""
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, event, func, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from . import jobs
+from .extensions import db
+from .models import Order, Product, StatCounter, StatDaily, User
+
+VERIFIED_AT = '_verified_at'
+WATCHED = {
+    Product: ('category',),
+    User: ('created_at',),
+    Order: ('payment_status', 'amount', 'created_at'),
+}
+_watching = []
+
+
+def _facts(obj, values):
+    """{(name, day or None): amount} that one row contributes to the counters"""
+    facts = Counter()
+    if isinstance(obj, Product):
+        facts[('products', None)] += 1
+        facts[(f"products:{values['category']}", None)] += 1
+    elif isinstance(obj, User):
+        facts[('users', None)] += 1
+        facts[('users', _day(values['created_at']))] += 1
+    elif isinstance(obj, Order):
+        day = _day(values['created_at'])
+        status = values['payment_status'] or 'pending'
+        facts[(f'orders:{status}', None)] += 1
+        facts[('orders', day)] += 1
+        if status == 'completed':
+            facts[('orders:completed', day)] += 1
+            facts[('revenue', None)] += values['amount'] or 0
+            facts[('revenue', day)] += values['amount'] or 0
+    return facts
+
+
+def _day(created_at):
+    return (created_at or datetime.utcnow()).date()
+
+
+def _values(obj, old=False):
+    state = inspect(obj)
+    values = {}
+    for name in WATCHED[type(obj)]:
+        history = state.attrs[name].history
+        if old and history.deleted:
+            values[name] = history.deleted[0]
+        elif old and history.unchanged:
+            values[name] = history.unchanged[0]
+        else:
+            values[name] = getattr(obj, name)
+    return values
+
+
+def _changed(obj):
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in WATCHED[type(obj)])
+
+
+def _upsert(connection, model, key, amount):
+    table = model.__table__
+    extra = {'updated_at': datetime.utcnow()} if model is StatCounter else {}
+    dialect = {'sqlite': sqlite, 'postgresql': postgresql}.get(connection.dialect.name)
+    if dialect is not None:
+        stmt = dialect.insert(table).values(**key, value=amount, **extra)
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=list(key), set_=dict(value=table.c.value + stmt.excluded.value, **extra)))
+        return
+    criteria = [table.c[column] == value for column, value in key.items()]
+    result = connection.execute(update(table).where(*criteria).values(value=table.c.value + amount, **extra))
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(**key, value=amount, **extra))
+
+
+def _apply(connection, deltas):
+    for (name, day), amount in sorted(deltas.items(), key=lambda item: (item[0][0], item[0][1] or date.min)):
+        if not amount:
+            continue
+        if day is None:
+            _upsert(connection, StatCounter, {'name': name}, amount)
+        else:
+            _upsert(connection, StatDaily, {'day': day, 'name': name}, amount)
+
+
+def adjust(deltas):
+    """Apply {(name, day or None): amount} in the current transaction (for bulk UPDATEs)"""
+    _apply(db.session.connection(), Counter(deltas))
+
+
+def watch(session_factory):
+    """Keep the counters in step with ORM flushes"""
+    # Load the old value when a watched attribute is set, so changes to expired rows can be diffed
+    for model, names in WATCHED.items():
+        for name in names:
+            event.listen(getattr(model, name), 'set', lambda target, value, old, initiator: value,
+                         active_history=True, retval=True)
+
+    @event.listens_for(session_factory, 'before_flush')
+    def _before_flush(db_session, flush_context, instances):
+        # Deleted rows may be expired; read their values while they can still be loaded
+        removed = Counter()
+        for obj in db_session.deleted:
+            if type(obj) in WATCHED:
+                removed.update({key: -amount for key, amount in _facts(obj, _values(obj, old=True)).items()})
+        if removed:
+            db_session.info.setdefault('stats_removed', Counter()).update(removed)
+
+    @event.listens_for(session_factory, 'after_flush')
+    def _after_flush(db_session, flush_context):
+        deltas = db_session.info.pop('stats_removed', Counter())
+        for obj in db_session.new:
+            if type(obj) in WATCHED:
+                deltas.update(_facts(obj, _values(obj)))
+        for obj in db_session.dirty:
+            if type(obj) in WATCHED and _changed(obj):
+                deltas.update(_facts(obj, _values(obj)))
+                deltas.subtract(_facts(obj, _values(obj, old=True)))
+        if deltas:
+            _apply(db_session.connection(), deltas)
+
+    @event.listens_for(session_factory, 'after_rollback')
+    def _after_rollback(db_session):
+        db_session.info.pop('stats_removed', None)
+
+
+def init_app(app):
+    app.config.setdefault('STATS_VERIFY_INTERVAL', 3600)
+    app.config.setdefault('STATS_VERIFY_DAYS', 7)
+    if not _watching:
+        _watching.append(db.session)
+        watch(db.session)
+
+
+def snapshot():
+    """All running totals in one primary-key scan of a table with a few dozen rows"""
+    return {name: value for name, value in db.session.execute(select(StatCounter.name, StatCounter.value))}
+
+
+def daily(days=30):
+    """{'days': [...], 'series': {name: [value per day]}} for the last `days` days"""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    days_list = [since + timedelta(days=n) for n in range(days)]
+    series = {}
+    for day, name, value in db.session.execute(
+            select(StatDaily.day, StatDaily.name, StatDaily.value).where(StatDaily.day >= since)):
+        series.setdefault(name, [0] * days)[(day - since).days] = value
+    return {'days': [day.isoformat() for day in days_list], 'series': series}
+
+
+def _actual_totals():
+    totals = Counter()
+    totals['products'] = db.session.scalar(select(func.count(Product.id)))
+    for category, count in db.session.execute(select(Product.category, func.count()).group_by(Product.category)):
+        totals[f'products:{category}'] = count
+    totals['users'] = db.session.scalar(select(func.count(User.id)))
+    for status, count in db.session.execute(select(Order.payment_status, func.count()).group_by(Order.payment_status)):
+        totals[f"orders:{status or 'pending'}"] += count
+    totals['revenue'] = db.session.scalar(
+        select(func.coalesce(func.sum(Order.amount), 0)).where(Order.payment_status == 'completed'))
+    return totals
+
+
+def _actual_daily(since):
+    rows = Counter()
+    user_day = func.date(User.created_at)
+    for day, count in db.session.execute(
+            select(user_day, func.count()).where(User.created_at >= since).group_by(user_day)):
+        rows[(_as_date(day), 'users')] = count
+    order_day = func.date(Order.created_at)
+    completed = Order.payment_status == 'completed'
+    for day, count, done, revenue in db.session.execute(
+            select(order_day, func.count(), func.count().filter(completed),
+                   func.coalesce(func.sum(Order.amount).filter(completed), 0))
+            .where(Order.created_at >= since).group_by(order_day)):
+        day = _as_date(day)
+        rows[(day, 'orders')] = count
+        rows[(day, 'orders:completed')] = done
+        rows[(day, 'revenue')] = revenue
+    return rows
+
+
+def _as_date(value):
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def verify(days=None):
+    """Recount everything and fix drifted counters; returns {name: (counter, actual)}.
+
+    Daily rollups are rebuilt for the last `days` days (STATS_VERIFY_DAYS;
+    0 = all of them).
+    """
+    days = current_app.config['STATS_VERIFY_DAYS'] if days is None else days
+    # Take the counter rows first so concurrent writers wait for the recount
+    _upsert(db.session.connection(), StatCounter, {'name': VERIFIED_AT}, 0)
+    db.session.execute(update(StatCounter).where(StatCounter.name == VERIFIED_AT).values(value=time.time()))
+    current = dict(db.session.execute(
+        select(StatCounter.name, StatCounter.value).where(~StatCounter.name.startswith('_', autoescape=True)).with_for_update()).all())
+    actual = _actual_totals()
+
+    drift = {}
+    for name in set(current) | set(actual):
+        if abs(current.get(name, 0) - actual.get(name, 0)) > 1e-6:
+            drift[name] = (current.get(name, 0), actual.get(name, 0))
+            _upsert(db.session.connection(), StatCounter, {'name': name}, actual.get(name, 0) - current.get(name, 0))
+
+    since = datetime.utcnow().date() - timedelta(days=days - 1) if days else date.min
+    db.session.execute(delete(StatDaily).where(StatDaily.day >= since))
+    rows = _actual_daily(datetime.combine(since, datetime.min.time()))
+    if rows:
+        db.session.execute(StatDaily.__table__.insert(),
+                           [{'day': day, 'name': name, 'value': value} for (day, name), value in rows.items()])
+    db.session.commit()
+    if drift:
+        current_app.logger.warning(f'Stats counters drifted and were corrected: {drift}')
+    return drift
+
+
+def rebuild():
+    """Recompute every counter and all daily rollups (e.g. when the tables are first created)"""
+    return verify(days=0)
+
+
+def verify_if_due(counters):
+    """Queue a background recount if the last one is older than STATS_VERIFY_INTERVAL"""
+    last = counters.get(VERIFIED_AT)
+    if last is not None and time.time() - last < current_app.config['STATS_VERIFY_INTERVAL']:
+        return False
+    if last is None:
+        _upsert(db.session.connection(), StatCounter, {'name': VERIFIED_AT}, 0)
+    # Only the request that moves the timestamp queues the job
+    claimed = db.session.execute(
+        update(StatCounter)
+        .where(StatCounter.name == VERIFIED_AT, StatCounter.value == (last or 0))
+        .values(value=time.time())).rowcount
+    db.session.commit()
+    if claimed:
+        jobs.enqueue('stats.verify')
+    return bool(claimed)
+
+
+@jobs.handler('stats.verify')
+def _verify_job():
+    verify()
@@ -1,8 +1,14 @@
-from flask import render_template, request, redirect, url_for, flash, current_app, jsonify
+from flask import abort, render_template, request, redirect, url_for, flash, current_app, jsonify
 from flask_login import login_required, current_user
 from . import store_bp
-from ..models import Product, Order
+from ..models import Order
 from ..extensions import db
+from ..catalog import get_product
+from ..entitlements import grant_for_order
+from .. import ebook_pages, webhooks
+from ..page_cache import cached_page, add_surrogate_keys
+from ..routing import use_replica
+from ..streaming import send_content
 from ..utils import create_razorpay_order, verify_razorpay_signature, get_razorpay_payment_details
 import razorpay
 import hmac
@@ -69,39 +75,34 @@ STATIC_PRODUCTS = {
     }
 }
 
-def get_product_by_id(product_id):
-    """Get product from database or static products"""
-    # First try to get from database
-    db_product = Product.query.filter_by(id=product_id).first()
-    if db_product:
-        return db_product
-    
-    # If not in database, check static products
-    if product_id in STATIC_PRODUCTS:
-        # Create a product-like object from static data
-        static_data = STATIC_PRODUCTS[product_id]
-        
-        class StaticProduct:
-            def __init__(self, data):
-                for key, value in data.items():
-                    setattr(self, key, value)
-        
-        return StaticProduct(static_data)
-    
-    return None
-
 @store_bp.route('/product/<int:product_id>')
+@use_replica
+@cached_page()
 def product_detail(product_id):
-    product = get_product_by_id(product_id)
+    product = get_product(product_id)
     if not product:
         flash('Product not found', 'error')
         return redirect(url_for('main.store'))
-    return render_template('product_detail.html', product=product)
+    add_surrogate_keys(f'product:{product.id}')
+    filename = ebook_pages.product_ebook(product)
+    has_preview = filename is not None and ebook_pages.preview_file(filename) is not None
+    return render_template('product_detail.html', product=product, has_preview=has_preview)
+
+@store_bp.route('/product/<int:product_id>/preview.pdf')
+@use_replica
+def product_preview(product_id):
+    """Free excerpt of the first EBOOK_PREVIEW_PAGES pages of an ebook, once the index job has written it"""
+    product = get_product(product_id)
+    filename = ebook_pages.product_ebook(product) if product else None
+    name = ebook_pages.preview_file(filename) if filename else None
+    if name is None:
+        abort(404)
+    return send_content(ebook_pages.derived_dir(), name, max_age=3600)
 
 @store_bp.route('/buy/<int:product_id>', methods=['GET', 'POST'])
 @login_required
 def buy(product_id):
-    product = get_product_by_id(product_id)
+    product = get_product(product_id)
     if not product:
         flash('Product not found', 'error')
         return redirect(url_for('main.store'))
@@ -164,6 +165,7 @@ def payment_success(order_id):
         return redirect(url_for('main.index'))
     
     order.payment_status = 'completed'
+    grant_for_order(order)
     db.session.commit()
     
     flash('Payment successful! You can now download your content.', 'success')
@@ -203,6 +205,7 @@ def verify_payment():
             order.razorpay_payment_id = razorpay_payment_id
             order.razorpay_signature = razorpay_signature
             order.transaction_id = razorpay_payment_id
+            grant_for_order(order)
             
             db.session.commit()
             
@@ -242,15 +245,14 @@ def payment_failed():
 
 @store_bp.route('/webhook/razorpay', methods=['POST'])
 def razorpay_webhook():
-    """Handle Razorpay webhooks"""
+    """Verify and queue Razorpay webhooks; app.webhooks applies them to orders"""
     try:
-        # Get webhook signature from headers
-        webhook_signature = request.headers.get('X-Razorpay-Signature')
+        webhook_body = request.get_data()
         webhook_secret = current_app.config.get('RAZORPAY_WEBHOOK_SECRET')
         
         if webhook_secret:
             # Verify webhook signature if secret is configured
-            webhook_body = request.get_data()
+            webhook_signature = request.headers.get('X-Razorpay-Signature') or ''
             expected_signature = hmac.new(
                 webhook_secret.encode('utf-8'),
                 webhook_body,
@@ -261,38 +263,9 @@ def razorpay_webhook():
                 current_app.logger.warning("Razorpay webhook signature verification failed")
                 return jsonify({'error': 'Invalid signature'}), 400
         
-        # Process webhook data
-        data = request.get_json()
-        event = data.get('event')
-        
-        if event == 'payment.captured':
-            payment_data = data.get('payload', {}).get('payment', {}).get('entity', {})
-            razorpay_order_id = payment_data.get('order_id')
-            razorpay_payment_id = payment_data.get('id')
-            
-            # Find order by razorpay_order_id
-            order = Order.query.filter_by(razorpay_order_id=razorpay_order_id).first()
-            if order:
-                order.payment_status = 'completed'
-                order.razorpay_payment_id = razorpay_payment_id
-                order.transaction_id = razorpay_payment_id
-                db.session.commit()
-                
-                current_app.logger.info(f"Payment captured for order {order.id}")
-        
-        elif event == 'payment.failed':
-            payment_data = data.get('payload', {}).get('payment', {}).get('entity', {})
-            razorpay_order_id = payment_data.get('order_id')
-            
-            # Find order by razorpay_order_id
-            order = Order.query.filter_by(razorpay_order_id=razorpay_order_id).first()
-            if order:
-                order.payment_status = 'failed'
-                db.session.commit()
-                
-                current_app.logger.info(f"Payment failed for order {order.id}")
-        
-        return jsonify({'status': 'ok'})
+        # Duplicates (Razorpay retries) are acknowledged without being stored again
+        stored = webhooks.enqueue(webhooks.event_id_for(request.headers, webhook_body), webhook_body)
+        return jsonify({'status': 'queued' if stored else 'duplicate'})
         
     except Exception as e:
         current_app.logger.error(f"Razorpay webhook error: {str(e)}")
@@ -0,0 +1,164 @@
+"""
+Range-aware streaming for files under content/.
+
+Handles single and multi-range requests (multipart/byteranges), ETag /
+If-None-Match / If-Range conditionals and streams ranges in fixed-size
+chunks with os.pread, so large course videos never sit in worker memory.
+Whole-file responses go through wsgi.file_wrapper, which lets servers such
+as gunicorn use sendfile().
+"""
+import mimetypes
+import os
+import time
+import uuid
+from flask import request, current_app, Response, abort
+from werkzeug.http import http_date, parse_range_header
+from werkzeug.wsgi import wrap_file
+from .utils import generate_signature, signatures_match
+
+CHUNK_SIZE = 256 * 1024
+MAX_RANGES = 16
+PLAYBACK_COOKIE = 'playback_token'
+
+
+def file_etag(stat):
+    """Strong validator derived from size and mtime"""
+    return f'{stat.st_size:x}-{stat.st_mtime_ns:x}'
+
+
+def _resolve_ranges(range_header, size):
+    """Turn a parsed Range header into sorted, merged (start, end) pairs"""
+    spans = []
+    for start, stop in range_header.ranges[:MAX_RANGES]:
+        if start < 0:
+            start, end = max(size + start, 0), size
+        else:
+            end = size if stop is None else min(stop, size)
+        if start < end:
+            spans.append((start, end))
+    spans.sort()
+    merged = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _read_span(fd, start, end):
+    offset = start
+    while offset < end:
+        chunk = os.pread(fd, min(CHUNK_SIZE, end - offset), offset)
+        if not chunk:
+            break
+        offset += len(chunk)
+        yield chunk
+
+
+def _stream_spans(path, spans, size, mimetype, boundary):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if boundary is None:
+            start, end = spans[0]
+            yield from _read_span(fd, start, end)
+            return
+        for start, end in spans:
+            yield (f'\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n'
+                   f'Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n').encode()
+            yield from _read_span(fd, start, end)
+        yield f'\r\n--{boundary}--\r\n'.encode()
+    finally:
+        os.close(fd)
+
+
+def _multipart_length(spans, size, mimetype, boundary):
+    length = len(f'\r\n--{boundary}--\r\n')
+    for start, end in spans:
+        length += len(f'\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n'
+                      f'Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n')
+        length += end - start
+    return length
+
+
+def send_content(directory, filename, etag=None, max_age=0):
+    """Serve directory/filename honouring Range and conditional headers"""
+    path = os.path.realpath(os.path.join(directory, filename))
+    if not path.startswith(os.path.realpath(directory) + os.sep) or not os.path.isfile(path):
+        abort(404)
+    stat = os.stat(path)
+    size = stat.st_size
+    from .blobs import blob_etag
+    content_hash = blob_etag(os.path.basename(path))
+    etag = etag or content_hash or file_etag(stat)
+    if content_hash:
+        # Content-addressed files never change under the same name
+        max_age = max(max_age, 365 * 24 * 3600)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': f'private, max-age={max_age}' + (', immutable' if content_hash else ''),
+    }
+
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    range_header = parse_range_header(request.headers.get('Range'))
+    if_range = request.if_range
+    if range_header is not None and (if_range.etag or if_range.date):
+        # If-Range only honours strong ETags or an unchanged modification date
+        if if_range.etag:
+            fresh = if_range.etag == etag
+        else:
+            fresh = int(stat.st_mtime) <= int(if_range.date.timestamp())
+        if not fresh:
+            range_header = None
+
+    if range_header is None or range_header.units != 'bytes':
+        handle = open(path, 'rb')
+        headers['Content-Length'] = str(size)
+        return Response(wrap_file(request.environ, handle, CHUNK_SIZE),
+                        status=200, mimetype=mimetype, headers=headers,
+                        direct_passthrough=True)
+
+    spans = _resolve_ranges(range_header, size)
+    if not spans:
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(status=416, headers=headers)
+
+    if len(spans) == 1:
+        start, end = spans[0]
+        boundary = None
+        headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+        headers['Content-Length'] = str(end - start)
+        content_type = mimetype
+    else:
+        boundary = uuid.uuid4().hex
+        headers['Content-Length'] = str(_multipart_length(spans, size, mimetype, boundary))
+        content_type = f'multipart/byteranges; boundary={boundary}'
+
+    return Response(_stream_spans(path, spans, size, mimetype, boundary),
+                    status=206, content_type=content_type, headers=headers,
+                    direct_passthrough=True)
+
+
+def make_playback_token(user_id, content_path, ttl=None):
+    """Signed, expiring token binding a user to one content path"""
+    ttl = ttl or current_app.config['PLAYBACK_TOKEN_TTL']
+    expires = int(time.time()) + ttl
+    signature = generate_signature(f'{user_id}|{content_path}|{expires}')
+    return f'{expires}.{signature}'
+
+
+def verify_playback_token(token, user_id, content_path):
+    try:
+        expires, signature = token.split('.', 1)
+        if int(expires) < time.time():
+            return False
+    except (AttributeError, ValueError):
+        return False
+    expected = generate_signature(f'{user_id}|{content_path}|{expires}')
+    return signatures_match(expected, signature)
@@ -0,0 +1,215 @@
+"""
+Resumable, chunked content uploads (a subset of the tus 1.0 protocol).
+
+An upload is created with its total length; its bytes are then appended by
+any number of PATCH requests, each starting at the offset the server already
+holds, so a dropped connection resumes where it stopped instead of at byte
+zero. Bytes stream straight from the request into
+CONTENT_DIR/<kind>/.uploads/<id>.part (same filesystem as the final file)
+while SHA-256 is computed on the fly. The last chunk moves the file into the
+content-addressed store (blobs.py) and queues a 'media.process' job (see
+media.py) that probes it, makes a thumbnail and activates the product it
+belongs to.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime
+from flask import current_app
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.utils import secure_filename
+from . import jobs
+from .blobs import store_file, assign
+from .cache import LRUCache
+from .catalog import bump_version
+from .extensions import db
+from .models import Product, Upload
+from .page_cache import purge_products
+from .utils import content_dir
+
+CHUNK_SIZE = 1024 * 1024
+KIND_EXTENSIONS = {
+    'ebooks': {'pdf'},
+    'videos': {'mp4', 'avi', 'mov', 'wmv', 'flv', 'webm'},
+}
+# Running SHA-256 of in-progress uploads, keyed by id, so resuming does not re-read the prefix
+_hashers = LRUCache(maxsize=256)
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class OffsetMismatch(UploadError):
+    def __init__(self, offset):
+        super().__init__(f'Upload-Offset must be {offset}', 409)
+        self.offset = offset
+
+
+def partial_path(upload):
+    return os.path.join(content_dir(upload.kind), '.uploads', f'{upload.id}.part')
+
+
+def create_upload(kind, filename, length, product_id=None):
+    """Register a new upload and create its empty partial file"""
+    filename = secure_filename(filename or '')
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension not in KIND_EXTENSIONS.get(kind, ()):
+        raise UploadError(f'Invalid file type for {kind}')
+    if length < 0 or length > current_app.config['UPLOAD_MAX_SIZE']:
+        raise UploadError('Upload-Length exceeds the maximum size', 413)
+    if product_id is not None and db.session.get(Product, product_id) is None:
+        raise UploadError('Unknown product', 404)
+
+    upload = Upload(id=uuid.uuid4().hex, kind=kind, filename=filename, length=length,
+                    product_id=product_id, status='uploading')
+    path = partial_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'xb').close()
+    db.session.add(upload)
+    db.session.commit()
+    if length == 0:
+        _finish(upload, hashlib.sha256())
+    return upload
+
+
+def current_offset(upload):
+    if upload.status != 'uploading':
+        return upload.length
+    try:
+        return os.path.getsize(partial_path(upload))
+    except FileNotFoundError:
+        return 0
+
+
+def _hasher_for(upload, offset, fd):
+    cached = _hashers.pop(upload.id)
+    if cached is not None and cached[0] == offset:
+        return cached[1]
+    # Another worker took the previous chunks (or we restarted): hash what is on disk
+    hasher = hashlib.sha256()
+    position = 0
+    while position < offset:
+        chunk = os.pread(fd, min(CHUNK_SIZE, offset - position), position)
+        if not chunk:
+            break
+        hasher.update(chunk)
+        position += len(chunk)
+    return hasher
+
+
+def append_chunk(upload, offset, stream):
+    """Append the request body at `offset`; returns the new offset"""
+    if upload.status != 'uploading':
+        raise OffsetMismatch(upload.length)
+    try:
+        # Never create the file: once the upload is finished it has been moved into the store
+        fd = os.open(partial_path(upload), os.O_WRONLY | os.O_APPEND)
+    except FileNotFoundError:
+        db.session.refresh(upload)
+        if upload.status == 'uploading':
+            raise UploadError('Upload not found', 404)
+        raise OffsetMismatch(upload.length)
+    with os.fdopen(fd, 'ab') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError('Upload is locked by another request', 423)
+        # The request that held the lock before us may have finished the upload
+        db.session.refresh(upload)
+        if upload.status != 'uploading':
+            raise OffsetMismatch(upload.length)
+        current = f.seek(0, os.SEEK_END)
+        if offset != current:
+            raise OffsetMismatch(current)
+
+        hasher = _hasher_for(upload, current, f.fileno())
+        remaining = upload.length - current
+        while remaining > 0:
+            try:
+                chunk = stream.read(min(CHUNK_SIZE, remaining))
+            except ClientDisconnected:
+                # Keep what arrived; the client resumes from HEAD's Upload-Offset
+                break
+            if not chunk:
+                break
+            f.write(chunk)
+            hasher.update(chunk)
+            current += len(chunk)
+            remaining -= len(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+
+        # Still under the lock, so a duplicate final chunk cannot finish the upload twice
+        if current == upload.length:
+            _finish(upload, hasher)
+        else:
+            _hashers.set(upload.id, (current, hasher))
+    return current
+
+
+def _finish(upload, hasher):
+    upload.sha256 = hasher.hexdigest()
+    upload.file_url = store_file(upload.kind, partial_path(upload),
+                                 upload.filename.rsplit('.', 1)[-1], upload.sha256)
+    upload.status = 'processing'
+    upload.completed_at = datetime.utcnow()
+    db.session.commit()
+    jobs.enqueue('media.process', upload_id=upload.id)
+
+
+def delete_upload(upload):
+    """Abandon an unfinished upload and its partial file"""
+    if upload.status != 'uploading':
+        raise UploadError('Upload already complete', 409)
+    _hashers.pop(upload.id)
+    try:
+        os.remove(partial_path(upload))
+    except FileNotFoundError:
+        pass
+    db.session.delete(upload)
+    db.session.commit()
+
+
+def attach(product, upload_id):
+    """Make a finished upload the product's content file once it is processed"""
+    upload = db.session.get(Upload, upload_id)
+    if upload is None or upload.kind != ('ebooks' if product.category == 'ebook' else 'videos'):
+        raise UploadError('Unknown upload', 404)
+    upload.product_id = product.id
+    db.session.commit()
+    return activate_if_ready(upload_id)
+
+
+def activate_if_ready(upload_id):
+    """Point the product at a processed upload; safe to call from both the job and the form.
+
+    Each side commits its half (status 'ready' / product_id) before calling,
+    so whichever runs second sees both and does the activation.
+    """
+    upload = db.session.get(Upload, upload_id)
+    if upload is None:
+        return False
+    db.session.refresh(upload)
+    if upload.status != 'ready' or upload.product_id is None:
+        return False
+    product = db.session.get(Product, upload.product_id)
+    if product is None or product.file_url == upload.file_url:
+        return product is not None
+
+    # A product created without content goes live with its first processed file
+    first_content = product.file_url is None
+    assign(product, upload.file_url)
+    thumbnail_url = json.loads(upload.media_info or '{}').get('thumbnail_url')
+    if thumbnail_url and not product.image_url:
+        product.image_url = thumbnail_url
+    if first_content:
+        product.is_active = True
+    db.session.commit()
+    bump_version()
+    purge_products(product)
+    return True
@@ -1,38 +1,50 @@
 """
 Utility functions for payment processing and other helper functions
 """
-import razorpay
+import os
 import hmac
 import hashlib
 from flask import current_app
+from .payments import get_gateway, get_order_pool
 
 def create_razorpay_order(amount, currency='INR'):
-    """Create a Razorpay order"""
+    """Create a Razorpay order, preferring one pre-created by the order pool"""
     try:
-        client = razorpay.Client(auth=(current_app.config['RAZORPAY_KEY_ID'], current_app.config['RAZORPAY_KEY_SECRET']))
-        order_data = {
-            'amount': int(amount * 100),  # Amount in paise
-            'currency': currency,
-            'payment_capture': 1
-        }
-        order = client.order.create(data=order_data)
+        amount_paise = int(round(amount * 100))  # Amount in paise
+        pool = get_order_pool()
+        order = pool.take(amount_paise, currency) if pool else None
+        if order is None:
+            order = get_gateway().create_order(amount_paise, currency)
         return order
     except Exception as e:
         current_app.logger.error(f"Razorpay order creation failed: {str(e)}")
         return None
 
+def generate_signature(message, key=None):
+    """HMAC-SHA256 hex digest of message, keyed by the app SECRET_KEY by default"""
+    key = key or current_app.config['SECRET_KEY']
+    return hmac.new(
+        key.encode('utf-8'),
+        message.encode('utf-8'),
+        hashlib.sha256
+    ).hexdigest()
+
+def signatures_match(expected, signature):
+    """Constant-time comparison that tolerates missing signatures"""
+    return bool(signature) and hmac.compare_digest(expected, str(signature))
+
+def content_dir(kind):
+    """Absolute path of a content sub-directory ('ebooks' or 'videos')"""
+    return os.path.join(current_app.config['CONTENT_DIR'], kind)
+
 def verify_razorpay_signature(payment_id, order_id, signature):
     """Verify Razorpay payment signature"""
     try:
         key_secret = current_app.config['RAZORPAY_KEY_SECRET']
         body = order_id + "|" + payment_id
-        generated_signature = hmac.new(
-            key_secret.encode('utf-8'),
-            body.encode('utf-8'),
-            hashlib.sha256
-        ).hexdigest()
+        generated_signature = generate_signature(body, key_secret)
         
-        return hmac.compare_digest(generated_signature, signature)
+        return signatures_match(generated_signature, signature)
     except Exception as e:
         current_app.logger.error(f"Razorpay signature verification failed: {str(e)}")
         return False
@@ -40,8 +52,7 @@ def verify_razorpay_signature(payment_id, order_id, signature):
 def get_razorpay_payment_details(payment_id):
     """Get payment details from Razorpay"""
     try:
-        client = razorpay.Client(auth=(current_app.config['RAZORPAY_KEY_ID'], current_app.config['RAZORPAY_KEY_SECRET']))
-        payment = client.payment.fetch(payment_id)
+        payment = get_gateway().fetch_payment(payment_id)
         return payment
     except Exception as e:
         current_app.logger.error(f"Failed to fetch Razorpay payment details: {str(e)}")
@@ -0,0 +1,167 @@
+"""
+Queue-backed Razorpay webhook ingestion.
+
+The webhook endpoint only verifies the signature and appends the raw event to
+a durable SQLite queue in STATE_DIR (queues.py), deduplicated on Razorpay's
+event id (X-Razorpay-Event-Id), so it answers without touching the main
+database. A background worker per process claims pending events in batches and applies
+them to Order in a single transaction. Applying an event is idempotent (a
+completed order is never downgraded), so replay_webhooks.py can safely feed
+stored events through again.
+"""
+import hashlib
+import json
+import os
+import time
+from flask import current_app
+from .extensions import db
+from .entitlements import grant_for_order
+from .models import Order
+from .queues import LeasedQueue, QueueState
+
+EXTENSION_KEY = 'webhooks'
+
+
+class EventQueue(LeasedQueue):
+    """Append-only event log, deduplicated on the event id"""
+
+    table = 'event'
+    schema = (
+        'CREATE TABLE IF NOT EXISTS event (id INTEGER PRIMARY KEY, '
+        'event_id TEXT UNIQUE NOT NULL, body BLOB NOT NULL, received_at REAL, '
+        'claimed_until REAL, processed_at REAL, attempts INTEGER DEFAULT 0, '
+        'last_error TEXT)',
+        'CREATE INDEX IF NOT EXISTS ix_event_pending ON event (processed_at, id)',
+    )
+    fields = ('event_id', 'body')
+    done_column = 'processed_at'
+
+    def __init__(self, path, lease=60, max_attempts=5):
+        super().__init__(path, lease, max_attempts)
+
+    def enqueue(self, event_id, body):
+        """Store an event; returns False if it was already received"""
+        cursor = self._connect().execute(
+            'INSERT OR IGNORE INTO event (event_id, body, received_at) VALUES (?, ?, ?)',
+            (event_id, body, time.time()))
+        return cursor.rowcount == 1
+
+    def reset(self, event_ids=None, since=None, failed_only=False):
+        """Mark stored events as pending again; returns how many"""
+        clauses, params = [], []
+        if event_ids:
+            clauses.append(f'event_id IN ({",".join("?" * len(event_ids))})')
+            params.extend(event_ids)
+        if since is not None:
+            clauses.append('received_at >= ?')
+            params.append(since)
+        if failed_only:
+            clauses.append('last_error IS NOT NULL')
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+        cursor = self._connect().execute(
+            f'UPDATE event SET processed_at = NULL, claimed_until = NULL, attempts = 0 {where}', params)
+        return cursor.rowcount
+
+
+def _drain():
+    batch_size = current_app.config['WEBHOOK_BATCH_SIZE']
+    while process_pending(batch_size) == batch_size:
+        pass
+
+
+def init_app(app):
+    app.config.setdefault('WEBHOOK_WORKER', True)
+    app.config.setdefault('WEBHOOK_BATCH_SIZE', 100)
+    app.config.setdefault('WEBHOOK_POLL_INTERVAL', 1.0)
+    queue = EventQueue(os.path.join(app.config['STATE_DIR'], 'webhook_events.sqlite'))
+    app.extensions[EXTENSION_KEY] = QueueState(queue, 'webhook-worker', _drain,
+                                               'WEBHOOK_WORKER', 'WEBHOOK_POLL_INTERVAL')
+
+
+def _state():
+    return current_app.extensions[EXTENSION_KEY]
+
+
+def get_queue():
+    return _state().queue
+
+
+def event_id_for(headers, body):
+    """Razorpay's event id, or a digest of the body for senders that omit it"""
+    return headers.get('X-Razorpay-Event-Id') or 'sha256:' + hashlib.sha256(body).hexdigest()
+
+
+def enqueue(event_id, body):
+    """Persist a verified webhook and nudge the worker; False for duplicates"""
+    stored = get_queue().enqueue(event_id, body)
+    if stored:
+        _state().wake()
+    return stored
+
+
+def _payment_entity(data):
+    return data.get('payload', {}).get('payment', {}).get('entity', {})
+
+
+def apply_event(data, orders):
+    """Apply one decoded event to the preloaded {razorpay_order_id: Order} map"""
+    event = data.get('event')
+    payment = _payment_entity(data)
+    order = orders.get(payment.get('order_id'))
+    if order is None:
+        return
+    if event == 'payment.captured':
+        if order.payment_status != 'completed':
+            order.payment_status = 'completed'
+            order.razorpay_payment_id = payment.get('id')
+            order.transaction_id = payment.get('id')
+            current_app.logger.info(f"Payment captured for order {order.id}")
+        grant_for_order(order)
+    elif event == 'payment.failed':
+        # Late or replayed failures must not undo a captured payment
+        if order.payment_status != 'completed':
+            order.payment_status = 'failed'
+            current_app.logger.info(f"Payment failed for order {order.id}")
+
+
+def _apply_batch(events):
+    razorpay_ids = {_payment_entity(data).get('order_id') for _, data in events}
+    razorpay_ids.discard(None)
+    orders = {}
+    if razorpay_ids:
+        for order in Order.query.filter(Order.razorpay_order_id.in_(razorpay_ids)):
+            orders[order.razorpay_order_id] = order
+    for _, data in events:
+        apply_event(data, orders)
+    db.session.commit()
+
+
+def process_pending(batch_size=100):
+    """Claim and apply one batch of queued events; returns how many were claimed"""
+    queue = get_queue()
+    rows = queue.claim(batch_size)
+    if not rows:
+        return 0
+
+    events = []
+    for id_, _, body in rows:
+        try:
+            events.append((id_, json.loads(body)))
+        except ValueError as e:
+            queue.fail(id_, f'Invalid JSON: {e}')
+
+    try:
+        _apply_batch(events)
+        queue.complete([id_ for id_, _ in events])
+    except Exception:
+        db.session.rollback()
+        # Retry one by one so a single bad event does not hold back the batch
+        for id_, data in events:
+            try:
+                _apply_batch([(id_, data)])
+                queue.complete([id_])
+            except Exception as e:
+                db.session.rollback()
+                queue.fail(id_, str(e))
+                current_app.logger.error(f"Webhook event {id_} failed: {e}")
+    return len(rows)
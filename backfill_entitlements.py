@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+"""
+Rebuild missing entitlement rows from completed orders.
+The app does this automatically the first time the entitlement table is created;
+run this script again if orders were completed outside the app (e.g. manual SQL).
+"""
+
+from app import create_app
+from app.entitlements import backfill
+
+def main():
+    app = create_app()
+    
+    with app.app_context():
+        try:
+            created = backfill()
+            print(f"✅ Created {created} entitlement(s)")
+        except Exception as e:
+            print(f"❌ Backfill failed: {e}")
+
+if __name__ == '__main__':
+    main()
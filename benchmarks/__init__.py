@@ -0,0 +1,4 @@
+"""
+Benchmark scripts for Skill2Wealth. Run from the repository root, e.g.
+    python -m benchmarks.entitlement_lookup
+"""
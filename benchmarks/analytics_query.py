@@ -0,0 +1,86 @@
+"""
+Sales analytics queries: SQL GROUP BY over Order vs the columnar rollups.
+
+Seeds --orders orders spread over a year and --products products, builds the
+rollups once, then times a daily revenue series over the last 90 days and a
+top-products query for the year, first as the GROUP BY the admin would have
+run against Order and then from app/analytics.py. It also times an
+incremental build, which only re-reads the settle window.
+
+    python -m benchmarks.analytics_query --orders 500000 --products 200
+"""
+import argparse
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, select
+from benchmarks.common import make_app, measure, format_stats
+
+
+def seed(db, orders, products):
+    from app.models import User, Product, Order
+    db.session.execute(insert(User), [{'id': 1, 'username': 'buyer', 'email': 'buyer@example.com'}])
+    db.session.execute(insert(Product), [{'id': i, 'name': f'Product {i}', 'description': '', 'price': 49.0 * i,
+                                          'category': 'ebook'} for i in range(1, products + 1)])
+    rng = random.Random(1)
+    start = datetime.utcnow() - timedelta(days=365)
+    statuses = ('completed', 'completed', 'pending', 'failed')
+    for offset in range(0, orders, 50000):
+        rows = []
+        for _ in range(min(50000, orders - offset)):
+            product_id = rng.randint(1, products)
+            rows.append({'user_id': 1, 'product_id': product_id, 'amount': 49.0 * product_id,
+                         'payment_status': rng.choice(statuses),
+                         'created_at': start + timedelta(seconds=rng.randrange(365 * 86400))})
+        db.session.execute(insert(Order), rows)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--orders', type=int, default=200000)
+    parser.add_argument('--products', type=int, default=100)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    from app import analytics
+    from app.extensions import db
+    from app.models import Order
+    db_path = tempfile.mkdtemp(prefix='s2w-bench-') + '/analytics.sqlite'
+    app = make_app(db_path, WEBHOOK_WORKER=False, JOBS_WORKER=False)
+    with app.app_context():
+        seed(db, args.orders, args.products)
+        print(f"{args.orders} orders, {args.products} products, numpy {'on' if analytics.numpy else 'off'}")
+
+        since = datetime.utcnow() - timedelta(days=90)
+        completed = Order.payment_status == 'completed'
+        day = func.date(Order.created_at)
+
+        def sql_series():
+            db.session.execute(select(day, func.count(), func.count().filter(completed),
+                                      func.sum(Order.amount).filter(completed))
+                               .where(Order.created_at >= since).group_by(day)).all()
+
+        def sql_products():
+            db.session.execute(select(Order.product_id, func.count(), func.sum(Order.amount).filter(completed))
+                               .group_by(Order.product_id)
+                               .order_by(func.sum(Order.amount).filter(completed).desc()).limit(20)).all()
+
+        started = time.perf_counter()
+        meta = analytics.build(rebuild=True)
+        print(f"full build          {time.perf_counter() - started:>8.2f}s  {meta['rows']}")
+        started = time.perf_counter()
+        analytics.build()
+        print(f"incremental build   {time.perf_counter() - started:>8.2f}s")
+
+        print(format_stats('SQL daily series', measure(sql_series, args.iterations)))
+        print(format_stats('rollup daily series',
+                           measure(lambda: analytics.revenue_series('daily', since), args.iterations)))
+        print(format_stats('SQL top products', measure(sql_products, args.iterations)))
+        print(format_stats('rollup top products',
+                           measure(lambda: analytics.product_sales('monthly'), args.iterations)))
+
+
+if __name__ == '__main__':
+    main()
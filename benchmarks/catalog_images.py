@@ -0,0 +1,113 @@
+"""
+Catalog image weight and CPU cost: full-size uploads vs resized variants.
+
+Seeds --products active eBooks, each with a synthetic --width x 3/4 PNG cover
+(flat panels and text, like the screenshots admins upload), then reports:
+
+  - page weight: the images a catalog grid downloads as originals, and as the
+    variant a browser picks from the srcset for a --slot px wide card;
+  - render cost: cold variant renders per width and format (what the
+    'images.warm' job spends per upload);
+  - serving latency: a cached variant vs the original through the app.
+
+    python -m benchmarks.catalog_images --products 24
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+from benchmarks.common import make_app, measure, format_stats
+
+
+def cover(images, width, seed):
+    """Screenshot-like cover: flat panels, a gradient header and lines of text"""
+    from PIL import ImageDraw
+    height = width * 3 // 4
+    image = images.Image.new('RGB', (width, height), (248, 249, 250))
+    header = images.Image.linear_gradient('L').rotate(90).resize((width, height // 4))
+    image.paste(images.ImageOps.colorize(header, (20, 40, 90), (40 + seed * 37 % 200, 120, 200)), (0, 0))
+    draw = ImageDraw.Draw(image)
+    for row in range(height // 4 + 20, height - 20, 22):
+        indent = 40 + (row * 7 + seed) % 120
+        draw.rectangle((indent, row, width - 60 - (row * 13) % 300, row + 10), fill=(90, 90, 110))
+        draw.text((20, row - 2), f'{row:04d}', fill=(30, 30, 30))
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def seed(app, count, width):
+    from app import images
+    from app.extensions import db
+    from app.models import Product
+    images_dir = images.product_images_dir()
+    os.makedirs(images_dir, exist_ok=True)
+    filenames = []
+    for n in range(count):
+        filename = f'bench-{n}.png'
+        with open(os.path.join(images_dir, filename), 'wb') as f:
+            f.write(cover(images, width, n))
+        filenames.append(filename)
+        db.session.add(Product(name=f'Bench eBook {n}', description='Benchmark product', price=99.0,
+                               category='ebook', is_active=True, image_url=f'{images.PRODUCT_IMAGES_URL}{filename}'))
+    db.session.commit()
+    return filenames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=24)
+    parser.add_argument('--width', type=int, default=1600, help='width of the uploaded covers')
+    parser.add_argument('--slot', type=int, default=400, help='rendered card width in CSS px')
+    parser.add_argument('--dpr', type=float, default=1.0, help='device pixel ratio')
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    from app import images
+    if images.Image is None:
+        print('Pillow is not installed (pip install Pillow); variants fall back to the originals')
+        return
+
+    workdir = tempfile.mkdtemp(prefix='s2w-images-')
+    app = make_app(os.path.join(workdir, 'bench.sqlite'), JOBS_WORKER=False, PAGE_CACHE_ENABLED=False)
+    app.static_folder = os.path.join(workdir, 'static')
+    with app.app_context():
+        filenames = seed(app, args.products, args.width)
+        originals = sum(os.path.getsize(os.path.join(images.product_images_dir(), name)) for name in filenames)
+
+        # What the srcset resolves to: the smallest bucket covering slot x DPR
+        needed = args.slot * args.dpr
+        chosen = next((width for width in images.WIDTHS if width >= needed), images.WIDTHS[-1])
+        print(f"{args.products} covers at {args.width}px, {args.slot}px card slot at {args.dpr}x -> {chosen}w variant")
+        print(f"{'originals (PNG)':<28} {originals / 1024:>9.0f} KiB")
+
+        renders = {}
+        for fmt in images.FORMATS:
+            for width in images.WIDTHS:
+                start = time.perf_counter()
+                for name in filenames:
+                    images.variant(name, width, fmt)
+                renders[(width, fmt)] = (time.perf_counter() - start) / len(filenames) * 1e3
+            weight = sum(os.path.getsize(images.variant(name, chosen, fmt)) for name in filenames)
+            print(f"{f'{chosen}w {fmt}':<28} {weight / 1024:>9.0f} KiB  ({weight / originals:.1%} of originals)")
+
+        print()
+        print('Cold render per image (ms):')
+        for fmt in images.FORMATS:
+            print(f"  {fmt:<5}" + ''.join(f"{width:>6}w {renders[(width, fmt)]:>6.1f}" for width in images.WIDTHS))
+        warm = sum(renders.values())
+        print(f"  all variants of one upload (images.warm job): {warm:.0f} ms")
+
+    client = app.test_client()
+    name = filenames[0]
+    print()
+    print(format_stats(f'original {args.width}px', measure(lambda: client.get(f'/static/images/products/{name}').close(),
+                                                          args.iterations)))
+    print(format_stats(f'cached {chosen}w webp', measure(lambda: client.get(f'/images/products/{chosen}/{name}.webp').close(),
+                                                       args.iterations)))
+    print(format_stats('catalog page (/ebooks)', measure(lambda: client.get('/ebooks').close(), args.iterations // 10 or 1)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Shared helpers for the benchmark scripts
+"""
+import os
+import statistics
+import tempfile
+import time
+from config import Config
+
+
+def make_config(db_path=None, **overrides):
+    """Return a Config subclass pointing at a throwaway SQLite database"""
+    if db_path is None:
+        fd, db_path = tempfile.mkstemp(prefix='s2w-bench-', suffix='.sqlite')
+        os.close(fd)
+        os.remove(db_path)
+    attrs = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+             'STATE_DIR': os.path.join(os.path.dirname(db_path), 'state'), 'TESTING': True}
+    attrs.update(overrides)
+    return type('BenchConfig', (Config,), attrs)
+
+
+def make_app(db_path=None, **overrides):
+    from app import create_app
+    return create_app(make_config(db_path, **overrides))
+
+
+def measure(fn, iterations):
+    """Call fn() repeatedly and return latency stats in microseconds"""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return {
+        'mean': statistics.fmean(samples),
+        'p50': samples[len(samples) // 2],
+        'p99': samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+    }
+
+
+def format_stats(label, stats):
+    return (f"{label:<28} mean {stats['mean']:>9.1f}us  "
+            f"p50 {stats['p50']:>9.1f}us  p99 {stats['p99']:>9.1f}us")
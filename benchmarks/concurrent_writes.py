@@ -0,0 +1,124 @@
+"""
+Concurrent writes from several worker processes against one SQLite database.
+
+Each process plays a gunicorn worker and loops over the three write paths
+that used to fail with "database is locked": a purchase (read product,
+insert order), a webhook update (read order, mark it completed) and a
+registration (check email, insert user). It runs once with the old engine
+settings (rollback journal, synchronous=FULL, default cache) and once with
+the tuned profile from app/database.py, and reports throughput, latency and
+lock errors for each.
+
+    python -m benchmarks.concurrent_writes --workers 4 --ops 300
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+from benchmarks.common import make_app
+
+PROFILES = {
+    'before (journal, FULL)': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL',
+                               'SQLITE_CACHE_SIZE': -2000, 'SQLITE_MMAP_SIZE': 0},
+    'after (WAL, NORMAL)': {},
+}
+SEED_ORDERS = 2000
+
+
+def seed(db_path, overrides):
+    from app.extensions import db
+    from app.models import User, Product, Order
+    app = make_app(db_path, WEBHOOK_WORKER=False, JOBS_WORKER=False, **overrides)
+    with app.app_context():
+        db.session.execute(insert(User), [{'id': 1, 'username': 'buyer', 'email': 'buyer@example.com'}])
+        db.session.execute(insert(Product), [{'id': 1, 'name': 'Guide', 'description': '', 'price': 49.0,
+                                              'category': 'ebook'}])
+        now = datetime.utcnow()
+        db.session.execute(insert(Order), [
+            {'id': i, 'user_id': 1, 'product_id': 1, 'amount': 49.0, 'created_at': now,
+             'razorpay_order_id': f'order_{i}'} for i in range(1, SEED_ORDERS + 1)])
+        db.session.commit()
+        db.engine.dispose()
+
+
+def worker(db_path, overrides, ops, worker_id, results):
+    from app.extensions import db
+    from app.models import User, Product, Order
+    app = make_app(db_path, WEBHOOK_WORKER=False, JOBS_WORKER=False, **overrides)
+    rng = random.Random(worker_id)
+    samples, errors = [], 0
+
+    def buy():
+        product = db.session.get(Product, 1)
+        db.session.add(Order(user_id=1, product_id=product.id, amount=product.price))
+
+    def webhook():
+        order = Order.query.filter_by(razorpay_order_id=f'order_{rng.randint(1, SEED_ORDERS)}').first()
+        order.payment_status = 'completed'
+        order.razorpay_payment_id = f'pay_{worker_id}_{rng.random()}'
+
+    def register():
+        email = f'user{worker_id}_{rng.random()}@example.com'
+        if User.query.filter_by(email=email).first() is None:
+            db.session.add(User(username=email.split('@')[0], email=email, password_hash='x'))
+
+    with app.app_context():
+        for n in range(ops):
+            operation = (buy, webhook, register)[n % 3]
+            start = time.perf_counter()
+            try:
+                operation()
+                db.session.commit()
+                samples.append((time.perf_counter() - start) * 1e6)
+            except OperationalError:
+                db.session.rollback()
+                errors += 1
+    results.put((samples, errors))
+
+
+def run(workers, ops, overrides):
+    directory = tempfile.mkdtemp(prefix='s2w-bench-')
+    db_path = os.path.join(directory, 'bench.sqlite')
+    seed(db_path, overrides)
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    started = time.perf_counter()
+    processes = [context.Process(target=worker, args=(db_path, overrides, ops, i, results))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+    samples = sorted(s for batch, _ in collected for s in batch)
+    errors = sum(e for _, e in collected)
+    return {
+        'throughput': len(samples) / elapsed,
+        'mean': statistics.fmean(samples) if samples else 0.0,
+        'p99': samples[min(len(samples) - 1, int(len(samples) * 0.99))] if samples else 0.0,
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--ops', type=int, default=300, help='write transactions per worker')
+    args = parser.parse_args()
+
+    print(f'{args.workers} workers x {args.ops} writes (orders, webhook updates, registrations)')
+    for label, overrides in PROFILES.items():
+        stats = run(args.workers, args.ops, overrides)
+        print(f"{label:<24} {stats['throughput']:>8.0f} commits/s  mean {stats['mean']:>9.1f}us  "
+              f"p99 {stats['p99']:>9.1f}us  locked {stats['errors']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Access-check latency as the order table grows.
+
+Compares the legacy Order/Product join used by serve_ebook/serve_video with the
+entitlement index (cold primary-key lookup and warm per-process cache).
+
+    python -m benchmarks.entitlement_lookup --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import os
+import random
+import tempfile
+from datetime import datetime
+from sqlalchemy import insert
+from app.extensions import db
+from app.models import User, Product, Order, Entitlement
+from app import entitlements
+from benchmarks.common import make_app, measure, format_stats
+
+PRODUCTS = 200
+CHUNK = 20000
+
+
+def seed(order_count):
+    users = max(10, order_count // 5)
+    now = datetime.utcnow()
+    db.session.execute(insert(User), [
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com'}
+        for i in range(1, users + 1)])
+    db.session.execute(insert(Product), [
+        {'id': i, 'name': f'Product {i}', 'description': '', 'price': 49.0,
+         'category': 'ebook', 'file_url': f'/content/ebooks/product-{i}.pdf'}
+        for i in range(1, PRODUCTS + 1)])
+    rng = random.Random(42)
+    for start in range(0, order_count, CHUNK):
+        rows = []
+        for order_id in range(start + 1, min(order_count, start + CHUNK) + 1):
+            rows.append({
+                'id': order_id,
+                'user_id': rng.randint(1, users),
+                'product_id': rng.randint(1, PRODUCTS),
+                'amount': 49.0,
+                'payment_status': 'completed' if rng.random() < 0.8 else 'pending',
+                'created_at': now,
+            })
+        db.session.execute(insert(Order), rows)
+    db.session.commit()
+    entitlements.backfill()
+
+
+def legacy_check(user_id, path):
+    return Order.query.join(Order.product).filter(
+        Order.user_id == user_id,
+        Order.payment_status == 'completed',
+        Order.product.has(file_url=path)
+    ).first() is not None
+
+
+def run(order_count, iterations):
+    db_path = os.path.join(tempfile.gettempdir(), f's2w-bench-entitlements-{order_count}.sqlite')
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    app = make_app(db_path)
+    with app.app_context():
+        seed(order_count)
+        # Probe with real grants: repeated range requests come from owners
+        owned = db.session.query(Entitlement.user_id, Entitlement.content_path).all()
+        rng = random.Random(7)
+        probes = [tuple(rng.choice(owned)) for _ in range(iterations)]
+        cache = app.extensions[entitlements.CACHE_KEY]
+        it = iter(probes * 3)
+
+        def cold():
+            cache.clear()
+            entitlements.has_access(*next(it))
+            db.session.expire_all()
+
+        print(f"\n{order_count:,} orders, {Entitlement.query.count():,} entitlements")
+        print(format_stats('legacy join', measure(lambda: legacy_check(*next(it)), iterations)))
+        print(format_stats('entitlement (cold cache)', measure(cold, iterations)))
+        for probe in probes:
+            entitlements.has_access(*probe)
+        warm = iter(probes)
+        print(format_stats('entitlement (warm cache)',
+                           measure(lambda: entitlements.has_access(*next(warm)), iterations)))
+        db.session.remove()
+        db.engine.dispose()
+    os.remove(db_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.iterations)
+
+
+if __name__ == '__main__':
+    main()
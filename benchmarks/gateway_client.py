@@ -0,0 +1,49 @@
+"""
+Checkout gateway throughput: a new razorpay.Client per call vs the pooled client.
+
+Runs against stub_gateway.py with artificial latency, so no network access or
+Razorpay credentials are needed.
+
+    python -m benchmarks.gateway_client --threads 8 --calls 400 --latency 0.02
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+import razorpay
+from app.payments import GatewayClient
+from stub_gateway import StubGateway
+
+
+def run(label, create, threads, calls):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(lambda _: create(), range(calls)))
+    elapsed = time.perf_counter() - started
+    print(f"{label:<26} {calls / elapsed:>8.1f} orders/s  ({elapsed * 1000 / calls:.2f} ms/order)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--calls', type=int, default=400)
+    parser.add_argument('--latency', type=float, default=0.02)
+    args = parser.parse_args()
+
+    stub = StubGateway(latency=args.latency)
+    base_url = stub.start()
+    data = {'amount': 4900, 'currency': 'INR', 'payment_capture': 1}
+    try:
+        def per_call_client():
+            client = razorpay.Client(auth=('key', 'secret'), base_url=base_url)
+            return client.order.create(data=data)
+
+        pooled = GatewayClient('key', 'secret', base_url=base_url, pool_size=args.threads)
+        run('client per call (legacy)', per_call_client, args.threads, args.calls)
+        run('pooled client', lambda: pooled.create_order(4900), args.threads, args.calls)
+        print(pooled.metrics.snapshot())
+    finally:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Login and catalog latency under a burst of concurrent logins.
+
+Runs login threads and catalog (/ebooks) threads against the same app for a
+fixed time, once hashing on the request threads (PASSWORD_HASH_WORKERS=0) and
+once through the process pool, and reports p50/p99 for both routes.
+
+    python -m benchmarks.login_throughput --logins 8 --browsers 4 --seconds 5
+"""
+import argparse
+import threading
+import time
+from app.extensions import db
+from app.models import User
+from benchmarks.common import make_app, format_stats
+
+
+def stats(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {'mean': 0, 'p50': 0, 'p99': 0}
+    return {'mean': sum(samples) / len(samples), 'p50': samples[len(samples) // 2],
+            'p99': samples[min(len(samples) - 1, int(len(samples) * 0.99))]}
+
+
+def run(workers, logins, browsers, seconds):
+    app = make_app(PASSWORD_HASH_WORKERS=workers, PASSWORD_HASH_QUEUE=64, PASSWORD_HASH_TIMEOUT=30)
+    with app.app_context():
+        users = [User(username=f'user{i}', email=f'user{i}@example.com') for i in range(logins)]
+        for user in users:
+            user.set_password('secret')  # also starts the pool before timing
+        db.session.add_all(users)
+        db.session.commit()
+
+    samples = {'login': [], 'catalog': []}
+    deadline = time.perf_counter() + seconds
+
+    def worker(kind, index):
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            if kind == 'login':
+                with client.session_transaction() as sess:
+                    sess.clear()
+                client.post('/auth/login', data={'email': f'user{index}@example.com', 'password': 'secret'})
+            else:
+                client.get('/ebooks')
+            samples[kind].append((time.perf_counter() - start) * 1e6)
+
+    threads = [threading.Thread(target=worker, args=('login', i)) for i in range(logins)]
+    threads += [threading.Thread(target=worker, args=('catalog', i)) for i in range(browsers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    label = 'request thread' if workers == 0 else f'pool of {workers}'
+    print(format_stats(f'login    ({label})', stats(samples['login'])) + f"  n={len(samples['login'])}")
+    print(format_stats(f'catalog  ({label})', stats(samples['catalog'])) + f"  n={len(samples['catalog'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--logins', type=int, default=8)
+    parser.add_argument('--browsers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+    for workers in (0, args.workers):
+        run(workers, args.logins, args.browsers, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Product lookup cost on store.product_detail and store.buy.
+
+Compares the legacy get_product_by_id (a primary-key query, then a new
+StaticProduct class per static hit) with the catalog repository, both as bare
+lookups and through the two routes (page cache off, so every request renders).
+
+    python -m benchmarks.product_lookup --products 5000
+"""
+import argparse
+import os
+import random
+import tempfile
+from sqlalchemy import insert
+from app.extensions import db
+from app.models import Product, User
+from app.catalog import get_catalog, get_product
+from benchmarks.common import make_app, measure, format_stats
+
+
+def legacy_get_product_by_id(product_id):
+    from app.store.routes import STATIC_PRODUCTS
+    db_product = Product.query.filter_by(id=product_id).first()
+    if db_product:
+        return db_product
+    if product_id in STATIC_PRODUCTS:
+        class StaticProduct:
+            def __init__(self, data):
+                for key, value in data.items():
+                    setattr(self, key, value)
+        return StaticProduct(STATIC_PRODUCTS[product_id])
+    return None
+
+
+def seed(count):
+    db.session.execute(insert(User), [{'id': 1, 'username': 'buyer', 'email': 'buyer@example.com'}])
+    # Ids start above the static products (201, 202) so those still resolve from code
+    db.session.execute(insert(Product), [
+        {'id': 1000 + i, 'name': f'Product {i}', 'description': 'Benchmark product', 'price': 49.0,
+         'category': 'ebook' if i % 3 else 'course', 'is_active': True}
+        for i in range(count)])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--iterations', type=int, default=5000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='s2w-lookup-')
+    app = make_app(os.path.join(workdir, 'bench.sqlite'), PAGE_CACHE_ENABLED=False, JOBS_WORKER=False)
+    rng = random.Random(42)
+    with app.app_context():
+        seed(args.products)
+        ids = [rng.randrange(1000, 1000 + args.products) for _ in range(args.iterations)]
+        get_catalog()
+        print(f"{args.products:,} database products + static catalogs")
+
+        for label, product_id in (('database id', None), ('static id (201)', 201)):
+            it = iter(ids * 2)
+            pick = (lambda: next(it)) if product_id is None else (lambda: product_id)
+
+            def legacy():
+                legacy_get_product_by_id(pick())
+                db.session.remove()
+
+            print(format_stats(f'legacy, {label}', measure(legacy, args.iterations)))
+            print(format_stats(f'repository, {label}', measure(lambda: get_product(pick()), args.iterations)))
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = '1'
+        session['_fresh'] = True
+    it = iter(ids * 2)
+    requests = max(args.iterations // 10, 1)
+    print()
+    print(format_stats('GET /store/product/<id>', measure(lambda: client.get(f'/store/product/{next(it)}').close(),
+                                                          requests)))
+    print(format_stats('GET /store/buy/<id>', measure(lambda: client.get(f'/store/buy/{next(it)}').close(),
+                                                      requests)))
+
+
+if __name__ == '__main__':
+    main()
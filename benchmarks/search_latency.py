@@ -0,0 +1,82 @@
+"""
+Product search latency: LIKE '%term%' vs the FTS5 and in-process BM25 indexes.
+
+Seeds --products products whose names and descriptions are drawn, Zipf-style,
+from a trading/finance vocabulary with Hinglish words mixed in and a long
+tail of rarer words (so, as in a real catalog, the first words in the list
+match a large share of products and most words match few), builds each search
+backend (timing the full index build) and then times a set of one-, two-word
+and prefix queries against it, next to the LIKE scan they replace.
+
+    python -m benchmarks.search_latency --products 100000
+"""
+import argparse
+import random
+import tempfile
+import time
+from sqlalchemy import insert, or_, select
+from benchmarks.common import make_app, measure, format_stats
+
+WORDS = ('trading options futures stocks nifty banknifty candlestick chart pattern risk management portfolio '
+         'intraday swing investing mutual funds sip budget saving paisa bachat seekhna kamai share bazaar '
+         'psychology mindset discipline strategy technical analysis fundamental beginner advanced course '
+         'ebook guide masterclass hindi hinglish market volume breakout support resistance crypto tax').split()
+QUERIES = ('trading', 'candlestick', 'risk management', 'paisa seekhna', 'nifty opt', 'breakout volume strategy', 'शेयर बाज़ार')
+
+
+def vocabulary(rng, size=20000):
+    """Domain words followed by a long tail of made-up ones, with Zipf-like weights"""
+    syllables = ('ka', 'ra', 'ma', 'ti', 'no', 'vi', 'sha', 'lu', 'de', 'po', 'gan', 'ris', 'tel', 'bor')
+    words = list(WORDS)
+    while len(words) < size:
+        words.append(''.join(rng.choices(syllables, k=rng.randint(2, 4))))
+    # Zipf-Mandelbrot: the head is flattened the way it is once stopwords are removed
+    weights = [1 / (rank + 100) for rank in range(1, len(words) + 1)]
+    return words, weights
+
+
+def seed(db, count):
+    from app.models import Product
+    rng = random.Random(7)
+    words, weights = vocabulary(rng)
+    for offset in range(0, count, 20000):
+        db.session.execute(insert(Product), [
+            {'name': ' '.join(rng.choices(words, weights, k=4)).title(),
+             'description': ' '.join(rng.choices(words, weights, k=30)),
+             'price': rng.choice((49.0, 99.0, 199.0, 299.0)), 'category': rng.choice(('ebook', 'course'))}
+            for _ in range(min(20000, count - offset))])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    from app import search
+    from app.extensions import db
+    from app.models import Product
+    directory = tempfile.mkdtemp(prefix='s2w-bench-')
+    print(f"{args.products} products")
+    for backend in ('fts5', 'memory'):
+        app = make_app(f'{directory}/{backend}.sqlite', SEARCH_BACKEND=backend, WEBHOOK_WORKER=False, JOBS_WORKER=False)
+        with app.app_context():
+            seed(db, args.products)
+            started = time.perf_counter()
+            search.rebuild()
+            search.search('warmup')
+            print(f"{backend:<8} index build {time.perf_counter() - started:>8.2f}s")
+            if backend == 'fts5':
+                for query in QUERIES[:4]:
+                    like = [or_(Product.name.ilike(f'%{word}%'), Product.description.ilike(f'%{word}%'))
+                            for word in query.split()]
+                    print(format_stats(f'LIKE {query!r}', measure(
+                        lambda: db.session.execute(select(Product.id).where(*like).limit(20)).all(),
+                        max(args.iterations // 10, 3))))
+            for query in QUERIES:
+                print(format_stats(f'{backend} {query!r}', measure(lambda: search.search(query), args.iterations)))
+
+
+if __name__ == '__main__':
+    main()
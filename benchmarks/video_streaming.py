@@ -0,0 +1,103 @@
+"""
+Concurrent range-request throughput for course videos.
+
+Replays player-style 1 MiB range requests from several threads against the
+legacy handler (purchase join + send_from_directory on every request) and the
+streaming engine in app/streaming.py (playback token after the first request).
+
+    python -m benchmarks.video_streaming --size-mb 256 --threads 8 --requests 400
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import send_from_directory, abort, current_app
+from flask_login import login_required, current_user
+from app.extensions import db
+from app.models import User, Product, Order
+from app import entitlements
+from benchmarks.common import make_app
+
+RANGE_SIZE = 1024 * 1024
+
+
+def legacy_serve_video(filename):
+    """The pre-streaming serve_video, kept here for comparison"""
+    order = Order.query.join(Order.product).filter(
+        Order.user_id == current_user.id,
+        Order.payment_status == 'completed',
+        Order.product.has(file_url=f"/content/videos/{filename}")
+    ).first()
+    if not order:
+        abort(403)
+    return send_from_directory(os.path.join(current_app.config['CONTENT_DIR'], 'videos'), filename)
+
+
+def setup(workdir, size_mb):
+    videos = os.path.join(workdir, 'content', 'videos')
+    os.makedirs(videos)
+    with open(os.path.join(videos, 'lesson.mp4'), 'wb') as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(1024 * 1024))
+    app = make_app(os.path.join(workdir, 'bench.sqlite'), CONTENT_DIR=os.path.join(workdir, 'content'))
+    app.add_url_rule('/legacy/videos/<filename>', 'legacy_serve_video',
+                     login_required(legacy_serve_video))
+    with app.app_context():
+        user = User(username='viewer', email='viewer@example.com')
+        product = Product(name='Course', description='', price=199.0, category='course',
+                          file_url='/content/videos/lesson.mp4')
+        db.session.add_all([user, product])
+        db.session.flush()
+        db.session.add(Order(user_id=user.id, product_id=product.id, amount=199.0,
+                             payment_status='completed'))
+        db.session.commit()
+        entitlements.backfill()
+        user_id = user.id
+    return app, user_id
+
+
+def run(app, user_id, url, size, threads, requests):
+    def worker(count):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(user_id)
+        rng = random.Random()
+        sent = 0
+        for _ in range(count):
+            start = rng.randrange(0, size - RANGE_SIZE)
+            response = client.get(url, headers={'Range': f'bytes={start}-{start + RANGE_SIZE - 1}'})
+            assert response.status_code == 206, response.status_code
+            sent += len(response.get_data())
+        return sent
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        total = sum(pool.map(worker, [requests // threads] * threads))
+    elapsed = time.perf_counter() - started
+    return requests / elapsed, total / elapsed / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=400)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='s2w-bench-video-')
+    try:
+        app, user_id = setup(workdir, args.size_mb)
+        size = args.size_mb * 1024 * 1024
+        for label, url in (('legacy send_from_directory', '/legacy/videos/lesson.mp4'),
+                           ('streaming engine', '/content/videos/lesson.mp4')):
+            rps, mbps = run(app, user_id, url, size, args.threads, args.requests)
+            print(f"{label:<28} {rps:>8.1f} req/s  {mbps:>8.1f} MiB/s")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
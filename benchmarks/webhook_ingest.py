@@ -0,0 +1,80 @@
+"""
+Webhook ingestion: endpoint latency and the cost of applying events.
+
+Measures the queued /store/webhook/razorpay endpoint (signature check plus
+queue append), then applies the same events one per transaction (what the
+endpoint used to do inline) and in worker-sized batches.
+
+    python -m benchmarks.webhook_ingest --orders 20000 --events 2000
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import time
+from datetime import datetime
+from sqlalchemy import insert
+from app.extensions import db
+from app.models import User, Product, Order
+from app import webhooks
+from benchmarks.common import make_app, measure, format_stats
+
+SECRET = 'whsec'
+
+
+def seed(order_count):
+    db.session.execute(insert(User), [{'id': 1, 'username': 'buyer', 'email': 'buyer@example.com'}])
+    db.session.execute(insert(Product), [{'id': 1, 'name': 'Guide', 'description': '', 'price': 49.0,
+                                          'category': 'ebook', 'file_url': '/content/ebooks/guide.pdf'}])
+    now = datetime.utcnow()
+    db.session.execute(insert(Order), [
+        {'id': i, 'user_id': 1, 'product_id': 1, 'amount': 49.0, 'created_at': now,
+         'razorpay_order_id': f'order_{i}'} for i in range(1, order_count + 1)])
+    db.session.commit()
+
+
+def signed_event(n, order_count):
+    body = json.dumps({'event': 'payment.captured', 'payload': {'payment': {'entity': {
+        'id': f'pay_{n}', 'order_id': f'order_{n % order_count + 1}'}}}}).encode()
+    return body, hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+
+def drain(batch_size):
+    started = time.perf_counter()
+    total = 0
+    while True:
+        claimed = webhooks.process_pending(batch_size)
+        if not claimed:
+            break
+        total += claimed
+    return total / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--events', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = make_app(RAZORPAY_WEBHOOK_SECRET=SECRET, WEBHOOK_WORKER=False)
+    with app.app_context():
+        seed(args.orders)
+    client = app.test_client()
+    counter = iter(range(10 ** 9))
+
+    def post():
+        n = next(counter)
+        body, signature = signed_event(n, args.orders)
+        client.post('/store/webhook/razorpay', data=body, content_type='application/json',
+                    headers={'X-Razorpay-Signature': signature, 'X-Razorpay-Event-Id': f'evt_{n}'})
+
+    print(format_stats('endpoint (queue append)', measure(post, args.events)))
+    with app.app_context():
+        queue = webhooks.get_queue()
+        print(f"{'apply, 1 event/txn':<28} {drain(1):>9.0f} events/s")
+        queue.reset()
+        print(f"{'apply, batches of 100':<28} {drain(100):>9.0f} events/s")
+
+
+if __name__ == '__main__':
+    main()
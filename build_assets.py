@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Build fingerprinted, precompressed copies of app/static into app/static/dist.
+Run on every deploy before (re)starting the app: templates then link to
+<name>.<hash>.<ext>, served with gzip/brotli variants and immutable caching.
+Install the brotli package to also write .br files.
+
+    python build_assets.py
+"""
+
+from app import create_app
+from app import assets
+
+def main():
+    app = create_app()
+    
+    try:
+        manifest = assets.build(app.static_folder)
+        for original, hashed in sorted(manifest['files'].items()):
+            encodings = ', '.join(manifest['encodings'].get(hashed, [])) or 'uncompressed'
+            print(f"  {original} -> {assets.DIST}/{hashed} ({encodings})")
+        print(f"✅ {len(manifest['files'])} static file(s) fingerprinted"
+              + ('' if assets.brotli else ' (pip install brotli for .br variants)'))
+    except Exception as e:
+        print(f"❌ Asset build failed: {e}")
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,92 @@ class Config:
     BASE_DIR = os.path.abspath(os.path.dirname(__file__))
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', f'sqlite:///{os.path.join(BASE_DIR, "instance", "skill2wealth.sqlite")}')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # SQLite: WAL, relaxed fsync, wait up to SQLITE_BUSY_TIMEOUT ms for the write lock (app/database.py)
+    SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))
+    SQLITE_CACHE_SIZE = int(os.getenv('SQLITE_CACHE_SIZE', -64000))  # negative = KiB
+    SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    # Postgres connection pool (per worker process) and per-statement time limit in ms
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_STATEMENT_TIMEOUT = int(os.getenv('DB_STATEMENT_TIMEOUT', 5000))
+    # Read replicas for catalog/dashboard/admin listing reads (comma-separated URLs)
+    SQLALCHEMY_REPLICA_URIS = [uri for uri in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if uri]
+    # After a write, that browser reads from the primary for this long (read-your-writes)
+    REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 10))
     RAZORPAY_KEY_ID = os.getenv('RAZORPAY_KEY_ID', 'rzp_test_R9O0qNXALduHdh')
     RAZORPAY_KEY_SECRET = os.getenv('RAZORPAY_KEY_SECRET', 'Cxi948W6ufBwUyUgicg3mCuV')
+    # Gateway client: pooled keep-alive session, timeouts, retries and circuit breaker
+    RAZORPAY_BASE_URL = os.getenv('RAZORPAY_BASE_URL')  # e.g. a local stub_gateway.py
+    RAZORPAY_CONNECT_TIMEOUT = float(os.getenv('RAZORPAY_CONNECT_TIMEOUT', 3.05))
+    RAZORPAY_READ_TIMEOUT = float(os.getenv('RAZORPAY_READ_TIMEOUT', 10))
+    RAZORPAY_POOL_SIZE = int(os.getenv('RAZORPAY_POOL_SIZE', 10))
+    RAZORPAY_MAX_RETRIES = int(os.getenv('RAZORPAY_MAX_RETRIES', 2))
+    RAZORPAY_BREAKER_THRESHOLD = int(os.getenv('RAZORPAY_BREAKER_THRESHOLD', 5))
+    RAZORPAY_BREAKER_RESET = float(os.getenv('RAZORPAY_BREAKER_RESET', 30))
+    # Gateway orders kept ready per price point so /store/buy skips the round-trip (0 = off)
+    RAZORPAY_ORDER_POOL_SIZE = int(os.getenv('RAZORPAY_ORDER_POOL_SIZE', 0))
+    # Webhooks are queued in STATE_DIR and applied to orders by a background worker in batches
+    WEBHOOK_WORKER = os.getenv('WEBHOOK_WORKER', '1') == '1'
+    WEBHOOK_BATCH_SIZE = int(os.getenv('WEBHOOK_BATCH_SIZE', 100))
+    WEBHOOK_POLL_INTERVAL = float(os.getenv('WEBHOOK_POLL_INTERVAL', 1.0))
+    # Resumable admin uploads and the background jobs that post-process them
+    UPLOAD_MAX_SIZE = int(os.getenv('UPLOAD_MAX_SIZE', 10 * 1024 ** 3))
+    JOBS_WORKER = os.getenv('JOBS_WORKER', '1') == '1'
+    JOBS_POLL_INTERVAL = float(os.getenv('JOBS_POLL_INTERVAL', 2.0))
+    # Admin bulk upload: files are sniffed and stored on this many threads, products inserted in batches
+    BULK_IMPORT_WORKERS = int(os.getenv('BULK_IMPORT_WORKERS', 4))
+    BULK_IMPORT_BATCH = int(os.getenv('BULK_IMPORT_BATCH', 200))
+    # Unreferenced content blobs are kept this long before gc_content.py deletes them
+    BLOB_GC_GRACE = int(os.getenv('BLOB_GC_GRACE', 24 * 3600))
+    # Pending orders are checked against the gateway by reconcile_orders.py
+    RECONCILE_BATCH_SIZE = int(os.getenv('RECONCILE_BATCH_SIZE', 500))
+    RECONCILE_CONCURRENCY = int(os.getenv('RECONCILE_CONCURRENCY', 8))
+    RECONCILE_MIN_AGE = int(os.getenv('RECONCILE_MIN_AGE', 15 * 60))  # leave orders still being paid alone
+    RECONCILE_FAIL_AFTER = int(os.getenv('RECONCILE_FAIL_AFTER', 24 * 3600))  # unpaid after this -> failed
+    # Admin dashboard counters are recounted in the background this often (seconds), rebuilding recent days
+    STATS_VERIFY_INTERVAL = int(os.getenv('STATS_VERIFY_INTERVAL', 3600))
+    STATS_VERIFY_DAYS = int(os.getenv('STATS_VERIFY_DAYS', 7))
+    # Sales rollups (STATE_DIR/analytics) re-aggregate orders younger than this on each build
+    ANALYTICS_SETTLE_HOURS = int(os.getenv('ANALYTICS_SETTLE_HOURS', 48))
+    # Product search: 'fts5' (SQLite), 'memory' (per-process index) or 'auto'
+    SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'auto')
+    # Password hashing runs in a process pool with a bounded queue; stale hashes are upgraded on login
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))  # 0 = hash on the request thread
+    PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', 32))
+    PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 2.0))
+    # Logged-in users are served from a per-process cache; revoked sessions end within the TTL
+    IDENTITY_CACHE_SIZE = int(os.getenv('IDENTITY_CACHE_SIZE', 10000))
+    IDENTITY_CACHE_TTL = float(os.getenv('IDENTITY_CACHE_TTL', 60))
+    IDENTITY_IN_SESSION = os.getenv('IDENTITY_IN_SESSION', '0') == '1'  # carry it in the signed cookie
+    # Runtime state shared by all workers (version stamps, checkpoints, caches)
+    STATE_DIR = os.getenv('STATE_DIR', os.path.join(BASE_DIR, "instance"))
+    # Root of the protected content tree (content/ebooks, content/videos)
+    CONTENT_DIR = os.getenv('CONTENT_DIR', os.path.join(BASE_DIR, "content"))
     # Directory to store eBooks (for MVP eBook store)
     EBOOKS_DIR = os.getenv('EBOOKS_DIR', os.path.join(BASE_DIR, "ebooks"))
+    # Per-process cache in front of the entitlement index
+    ENTITLEMENT_CACHE_SIZE = int(os.getenv('ENTITLEMENT_CACHE_SIZE', 10000))
+    ENTITLEMENT_CACHE_TTL = int(os.getenv('ENTITLEMENT_CACHE_TTL', 300))
+    # Lifetime of signed playback tokens that let video range requests skip the entitlement check
+    PLAYBACK_TOKEN_TTL = int(os.getenv('PLAYBACK_TOKEN_TTL', 4 * 3600))
+    # Signed download URLs: '' streams from Python, 'x-accel-redirect' (nginx) or
+    # 'x-sendfile' (Apache/lighttpd) hand the file off to the front proxy
+    CONTENT_OFFLOAD = os.getenv('CONTENT_OFFLOAD', '')
+    CONTENT_OFFLOAD_PREFIX = os.getenv('CONTENT_OFFLOAD_PREFIX', '/protected')
+    DOWNLOAD_URL_TTL = int(os.getenv('DOWNLOAD_URL_TTL', 600))
+    # Full-page cache for anonymous storefront pages ('memory' or 'sqlite' to share between workers)
+    PAGE_CACHE_ENABLED = os.getenv('PAGE_CACHE_ENABLED', '1') == '1'
+    PAGE_CACHE_BACKEND = os.getenv('PAGE_CACHE_BACKEND', 'memory')
+    PAGE_CACHE_SIZE = int(os.getenv('PAGE_CACHE_SIZE', 512))
+    PAGE_CACHE_TTL = int(os.getenv('PAGE_CACHE_TTL', 300))
+    # Resized product image variants (STATE_DIR/image_cache); least recently used are evicted past this size
+    IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_BYTES', 512 * 1024 ** 2))
+    # Signed HLS/DASH stream URLs expire after one to two windows of this many seconds
+    STREAM_URL_TTL = int(os.getenv('STREAM_URL_TTL', 4 * 3600))
+    # Pages in the free ebook preview linked from the product page
+    EBOOK_PREVIEW_PAGES = int(os.getenv('EBOOK_PREVIEW_PAGES', 5))
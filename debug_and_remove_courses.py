@@ -10,6 +10,8 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from app import create_app
 from app.models import Product, Order, db
+from app.catalog import bump_version
+from app import page_cache
 
 def debug_and_remove_courses():
     """Debug and remove all courses from the database"""
@@ -53,6 +55,8 @@ def debug_and_remove_courses():
             
             # Commit changes
             db.session.commit()
+            bump_version()
+            page_cache.clear()
             print("\n✓ Successfully removed all courses!")
             
             # Verify removal
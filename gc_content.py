@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Garbage-collect content files that no product references any more.
+Content is stored once per distinct file (content/<kind>/<sha256>.<ext>);
+deleting or replacing a product only drops its reference. Run this
+periodically (e.g. daily from cron) to remove blobs unreferenced for longer
+than BLOB_GC_GRACE.
+
+    python gc_content.py --dry-run
+    python gc_content.py --adopt-legacy   # first run: move <uuid>_<name> files into the store
+"""
+
+import argparse
+from app import create_app
+from app import blobs
+
+def main():
+    parser = argparse.ArgumentParser(description='Remove unreferenced content blobs')
+    parser.add_argument('--dry-run', action='store_true', help='list what would be removed')
+    parser.add_argument('--grace', type=int, help='seconds a blob must be unreferenced (default: BLOB_GC_GRACE)')
+    parser.add_argument('--adopt-legacy', action='store_true', help='hash and deduplicate files saved before the blob store')
+    args = parser.parse_args()
+    
+    app = create_app()
+    
+    with app.app_context():
+        try:
+            if args.adopt_legacy:
+                adopted = blobs.adopt_legacy()
+                print(f"📦 Moved {adopted} product file(s) into the content store")
+            
+            removed = blobs.gc(grace=args.grace, dry_run=args.dry_run)
+            for content_path in removed:
+                print(f"  {'would remove' if args.dry_run else 'removed'} {content_path}")
+            print(f"✅ {len(removed)} unreferenced blob(s) {'found' if args.dry_run else 'removed'}")
+        except Exception as e:
+            print(f"❌ Content GC failed: {e}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Queue HLS/DASH packaging for course videos.
+New uploads are packaged automatically when ffmpeg is installed; run this
+once for videos uploaded before that, or to retry failed packages. The jobs
+run in the web workers or in run_jobs.py.
+
+    python package_videos.py           # queue every video without a ready package
+    python package_videos.py --status  # only report progress
+"""
+
+import argparse
+from sqlalchemy import select
+from app import create_app
+from app import packaging
+from app.extensions import db
+from app.models import Blob
+
+def main():
+    parser = argparse.ArgumentParser(description='Queue HLS/DASH packaging for course videos')
+    parser.add_argument('--status', action='store_true', help='report packaging progress without queueing')
+    args = parser.parse_args()
+    
+    app = create_app()
+    
+    with app.app_context():
+        try:
+            if not args.status and not packaging.ffmpeg_available():
+                print("❌ ffmpeg and ffprobe must be on PATH to package videos")
+                return
+            
+            queued = 0
+            paths = db.session.scalars(select(Blob.content_path)
+                                       .where(Blob.content_path.like('/content/videos/%'))
+                                       .order_by(Blob.created_at))
+            for content_path in paths:
+                status = packaging.package_status(content_path)
+                if status['status'] in ('packaging', 'ready'):
+                    print(f"  {content_path}: {status['status']} ({status['progress']:.0%})")
+                elif args.status:
+                    print(f"  {content_path}: {status['status']}" + (f" - {status['error']}" if status.get('error') else ''))
+                elif packaging.queue_package(content_path):
+                    queued += 1
+            if not args.status:
+                print(f"✅ Queued {queued} video(s) for packaging")
+        except Exception as e:
+            print(f"❌ Packaging failed: {e}")
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,8 @@ This script creates sample products and users for testing the platform.
 from app import create_app
 from app.models import User, Product, Order
 from app.extensions import db
+from app.catalog import bump_version
+from app import page_cache
 from werkzeug.security import generate_password_hash
 
 def populate_database():
@@ -117,6 +119,8 @@ def populate_database():
         # Commit all changes
         print("Committing changes to database...")
         db.session.commit()
+        bump_version()
+        page_cache.clear()
         
         print("Database populated successfully!")
         print(f"Created {User.query.count()} users")
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Check pending Razorpay orders against the gateway and settle them.
+Completes orders whose payment was captured (granting their content) and
+fails orders left unpaid for RECONCILE_FAIL_AFTER. Progress is checkpointed
+in STATE_DIR, so an interrupted run picks up where it stopped. Run it from
+cron, or keep it running with --interval.
+
+    python reconcile_orders.py
+    python reconcile_orders.py --interval 600   # a new pass every 10 minutes
+    python reconcile_orders.py --restart        # ignore the checkpoint
+"""
+
+import argparse
+import time
+from app import create_app
+from app import reconcile
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile pending orders with the payment gateway')
+    parser.add_argument('--batch-size', type=int, help='orders per batch (default: RECONCILE_BATCH_SIZE)')
+    parser.add_argument('--max-batches', type=int, help='stop after this many batches (resume later)')
+    parser.add_argument('--restart', action='store_true', help='start from the first pending order')
+    parser.add_argument('--interval', type=float, help='repeat every INTERVAL seconds')
+    args = parser.parse_args()
+
+    app = create_app()
+
+    with app.app_context():
+        restart = args.restart
+        while True:
+            try:
+                stats = reconcile.reconcile(args.batch_size, args.max_batches, restart=restart)
+                state = 'pass complete' if stats['finished'] else 'checkpoint saved'
+                print(f"✅ Checked {stats['checked']} order(s): {stats['completed']} completed, "
+                      f"{stats['failed']} failed ({state})")
+                if stats['errors']:
+                    print("⚠️ Gateway unavailable; the next run resumes from the checkpoint")
+            except Exception as e:
+                print(f"❌ Reconciliation failed: {e}")
+            if not args.interval:
+                break
+            restart = False
+            time.sleep(args.interval)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Re-process stored Razorpay webhook events.
+Events are kept in STATE_DIR/webhook_events.sqlite after they are applied;
+applying them again is safe, so use this after fixing a bug in event handling
+or to retry events that exhausted their attempts.
+
+    python replay_webhooks.py                     # drain anything still pending
+    python replay_webhooks.py --failed            # retry events that errored
+    python replay_webhooks.py --since 2024-01-31  # replay everything received since
+    python replay_webhooks.py --event-id evt_123 --event-id evt_456
+"""
+
+import argparse
+from datetime import datetime
+from app import create_app
+from app import webhooks
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-process stored Razorpay webhook events')
+    parser.add_argument('--event-id', action='append', default=[], help='replay a specific event (repeatable)')
+    parser.add_argument('--since', type=datetime.fromisoformat, help='replay events received at or after this time')
+    parser.add_argument('--failed', action='store_true', help='only events whose last attempt errored')
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+    
+    app = create_app()
+    
+    with app.app_context():
+        try:
+            queue = webhooks.get_queue()
+            if args.event_id or args.since or args.failed:
+                since = args.since.timestamp() if args.since else None
+                reset = queue.reset(args.event_id, since, args.failed)
+                print(f"🔁 Marked {reset} event(s) for replay")
+            
+            processed = 0
+            while True:
+                claimed = webhooks.process_pending(args.batch_size)
+                if not claimed:
+                    break
+                processed += claimed
+            
+            counts = queue.counts()
+            print(f"✅ Processed {processed} event(s); {counts['pending']} pending, {counts['dead']} dead of {counts['total']}")
+        except Exception as e:
+            print(f"❌ Replay failed: {e}")
+
+if __name__ == '__main__':
+    main()
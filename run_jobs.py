@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Run queued background jobs (upload post-processing, ...).
+The web workers run jobs themselves; use this to drain the queue from a
+separate process, e.g. when the app runs with JOBS_WORKER=0.
+
+    python run_jobs.py           # run everything that is due, then exit
+    python run_jobs.py --forever # keep polling
+"""
+
+import argparse
+import time
+from app import create_app
+from app import jobs
+
+def main():
+    parser = argparse.ArgumentParser(description='Run queued background jobs')
+    parser.add_argument('--forever', action='store_true', help='keep polling for new jobs')
+    parser.add_argument('--interval', type=float, default=2.0, help='seconds between polls with --forever')
+    args = parser.parse_args()
+    
+    app = create_app()
+    
+    with app.app_context():
+        try:
+            while True:
+                ran = jobs.run_pending()
+                if ran:
+                    print(f"✅ Ran {ran} job(s)")
+                if not args.forever:
+                    break
+                time.sleep(args.interval)
+            counts = jobs.get_queue().counts()
+            print(f"📋 {counts['pending']} pending, {counts['dead']} failed of {counts['total']} job(s)")
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            print(f"❌ Job runner failed: {e}")
+
+if __name__ == '__main__':
+    main()
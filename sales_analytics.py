@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Build and query the sales rollups (revenue, conversion, per-product sales).
+Rollups live in STATE_DIR/analytics as columnar files; `build` updates them
+incrementally and is cheap enough to run from cron every few minutes.
+
+    python sales_analytics.py build              # add orders since the last build
+    python sales_analytics.py build --rebuild    # recompute from all orders
+    python sales_analytics.py revenue --grain monthly --start 2024-01-01
+    python sales_analytics.py products --start 2024-06-01 --end 2024-07-01 --limit 10
+"""
+
+import argparse
+from app import create_app
+from app import analytics
+from app.models import Product
+
+def main():
+    parser = argparse.ArgumentParser(description='Build and query sales analytics rollups')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='update the rollups')
+    build.add_argument('--rebuild', action='store_true', help='recompute everything from the Order table')
+    for name in ('revenue', 'products'):
+        command = commands.add_parser(name, help=f'print {name} per period' if name == 'revenue' else 'print top products')
+        command.add_argument('--grain', choices=analytics.GRAINS, default='daily')
+        command.add_argument('--start', help='ISO date or datetime (inclusive)')
+        command.add_argument('--end', help='ISO date or datetime (exclusive)')
+        if name == 'revenue':
+            command.add_argument('--product-id', type=int)
+        else:
+            command.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+    
+    app = create_app()
+    
+    with app.app_context():
+        try:
+            if args.command == 'build':
+                meta = analytics.build(rebuild=args.rebuild)
+                rows = ', '.join(f"{grain} {count}" for grain, count in meta['rows'].items())
+                print(f"✅ Rollups built (generation {meta['generation']}): {rows} rows")
+            elif args.command == 'revenue':
+                series = analytics.revenue_series(args.grain, args.start, args.end, args.product_id)
+                print(f"{'period':<20}{'orders':>10}{'paid':>10}{'revenue':>14}{'conv.':>8}")
+                for row in zip(*(series[k] for k in ('buckets', 'orders', 'completed', 'revenue', 'conversion'))):
+                    print(f"{row[0]:<20}{row[1]:>10}{row[2]:>10}{row[3]:>14,.2f}{row[4]:>8.1%}")
+            else:
+                sales = analytics.product_sales(args.grain, args.start, args.end, args.limit)
+                names = dict(Product.query.with_entities(Product.id, Product.name)
+                             .filter(Product.id.in_([row['product_id'] for row in sales])))
+                for row in sales:
+                    name = names.get(row['product_id'], f"#{row['product_id']}")
+                    print(f"{name[:40]:<42}{row['completed']:>8} sold  ₹{row['revenue']:>12,.2f}  "
+                          f"{row['conversion']:>6.1%}")
+        except Exception as e:
+            print(f"❌ Analytics failed: {e}")
+
+if __name__ == '__main__':
+    main()
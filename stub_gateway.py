@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Razorpay REST API, for offline tests and benchmarks.
+
+Implements the endpoints the app uses (create order, fetch payment, list an
+order's payments) with configurable latency and failure injection:
+
+    python stub_gateway.py --port 9010 --latency 0.05 --failure-rate 0.1
+    RAZORPAY_BASE_URL=http://127.0.0.1:9010/v1 python run.py
+"""
+
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubGateway:
+    """In-memory gateway state shared by the request handler threads"""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.orders = {}
+        self.payments = {}
+        self.requests = 0
+        self._ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = None
+
+    def new_id(self, prefix):
+        with self._lock:
+            return f'{prefix}_stub{next(self._ids):010d}'
+
+    def add_payment(self, order_id, status='captured'):
+        """Attach a payment to an order, as if the customer had paid"""
+        payment = {'id': self.new_id('pay'), 'entity': 'payment', 'order_id': order_id,
+                   'status': status, 'amount': self.orders.get(order_id, {}).get('amount', 0)}
+        self.payments[payment['id']] = payment
+        if order_id in self.orders and status == 'captured':
+            self.orders[order_id]['status'] = 'paid'
+        return payment
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve in a background thread; returns the base URL for RAZORPAY_BASE_URL"""
+        gateway = self
+
+        class Handler(StubHandler):
+            stub = gateway
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f'http://{host}:{self.server.server_address[1]}/v1'
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    stub = None
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; avoid Nagle stalls on keep-alive
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _preamble(self):
+        stub = self.stub
+        with stub._lock:
+            stub.requests += 1
+            fail = stub._random.random() < stub.failure_rate
+        if stub.latency:
+            time.sleep(stub.latency)
+        if fail:
+            self._reply(502, {'error': {'code': 'SERVER_ERROR', 'description': 'Injected failure'}})
+            return False
+        return True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = json.loads(self.rfile.read(length) or b'{}')
+        if not self._preamble():
+            return
+        if self.path.rstrip('/') == '/v1/orders':
+            order = {'id': self.stub.new_id('order'), 'entity': 'order', 'status': 'created',
+                     'amount': data.get('amount'), 'currency': data.get('currency', 'INR'),
+                     'created_at': int(time.time())}
+            self.stub.orders[order['id']] = order
+            return self._reply(200, order)
+        self._reply(404, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': 'Not found'}})
+
+    def do_GET(self):
+        if not self._preamble():
+            return
+        path = self.path.split('?', 1)[0].rstrip('/')
+        match = re.fullmatch(r'/v1/payments/(\w+)', path)
+        if match and match.group(1) in self.stub.payments:
+            return self._reply(200, self.stub.payments[match.group(1)])
+        match = re.fullmatch(r'/v1/orders/(\w+)/payments', path)
+        if match and match.group(1) in self.stub.orders:
+            items = [p for p in self.stub.payments.values() if p['order_id'] == match.group(1)]
+            return self._reply(200, {'entity': 'collection', 'count': len(items), 'items': items})
+        match = re.fullmatch(r'/v1/orders/(\w+)', path)
+        if match and match.group(1) in self.stub.orders:
+            return self._reply(200, self.stub.orders[match.group(1)])
+        self._reply(400, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': 'The id provided does not exist'}})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stub of the Razorpay API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9010)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of requests answered with 502')
+    args = parser.parse_args()
+
+    gateway = StubGateway(args.latency, args.failure_rate)
+    print(f"Stub gateway listening on {gateway.start(args.host, args.port)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        gateway.stop()
+
+if __name__ == '__main__':
+    main()
@@ -3,9 +3,19 @@
 Simple test script for Skill2Wealth MVP Flask application
 """
 
+import re
+from urllib.parse import unquote
 from app import create_app
 from app.models import User, Product, Order
 from app.extensions import db
+from config import Config
+
+def make_test_app(tmp_path, **overrides):
+    """Create an app bound to a throwaway SQLite database"""
+    attrs = {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.sqlite'}",
+             'STATE_DIR': str(tmp_path / 'state'), 'TESTING': True}
+    attrs.update(overrides)
+    return create_app(type('TestConfig', (Config,), attrs))
 
 def test_basic_functionality():
     """Test basic application functionality"""
@@ -68,5 +78,1247 @@ def test_basic_functionality():
         import traceback
         traceback.print_exc()
 
+def test_entitlement_index(tmp_path):
+    """Completed orders grant access through the entitlement index"""
+    from app.entitlements import grant_for_order, has_access, backfill
+    app = make_test_app(tmp_path)
+    
+    with app.app_context():
+        user = User(username='buyer', email='buyer@skill2wealth.com')
+        product = Product(name='Guide', description='PDF', price=49.0,
+                          category='ebook', file_url='/content/ebooks/guide.pdf')
+        db.session.add_all([user, product])
+        db.session.flush()
+        old = Order(user_id=user.id, product_id=product.id, amount=49.0, payment_status='completed')
+        db.session.add(old)
+        db.session.commit()
+        
+        # Orders completed before the index existed are picked up by backfill
+        assert not has_access(user.id, product.file_url)
+        assert backfill() == 1
+        assert has_access(user.id, product.file_url)
+        assert not has_access(user.id, '/content/ebooks/other.pdf')
+        
+        order = Order(user_id=user.id, product_id=product.id, amount=49.0, payment_status='completed')
+        db.session.add(order)
+        grant_for_order(order)
+        db.session.commit()
+        assert backfill() == 0
+
+class count_queries:
+    """Context manager counting SQL statements sent to the app's engine"""
+    def __init__(self, app):
+        self.app = app
+        self.count = 0
+        self.statements = []
+    
+    def _on_execute(self, conn, cursor, statement, *args):
+        self.count += 1
+        self.statements.append(statement)
+    
+    def __enter__(self):
+        from sqlalchemy import event
+        with self.app.app_context():
+            self.engine = db.engine
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+    
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+def login_as(client, user_id):
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+
+def test_video_range_streaming(tmp_path):
+    """Range, conditional and playback-token handling for course videos"""
+    from unittest import mock
+    videos = tmp_path / 'content' / 'videos'
+    videos.mkdir(parents=True)
+    payload = bytes(range(256)) * 64
+    (videos / 'lesson.mp4').write_bytes(payload)
+    app = make_test_app(tmp_path, CONTENT_DIR=str(tmp_path / 'content'))
+    
+    with app.app_context():
+        user = User(username='viewer', email='viewer@skill2wealth.com')
+        product = Product(name='Course', description='Video', price=199.0,
+                          category='course', file_url='/content/videos/lesson.mp4')
+        db.session.add_all([user, product])
+        db.session.flush()
+        db.session.add(Order(user_id=user.id, product_id=product.id, amount=199.0,
+                             payment_status='completed'))
+        db.session.commit()
+        from app.entitlements import backfill
+        backfill()
+        user_id = user.id
+    
+    client = app.test_client()
+    login_as(client, user_id)
+    url = '/content/videos/lesson.mp4'
+    
+    first = client.get(url, headers={'Range': 'bytes=0-99'})
+    assert first.status_code == 206
+    assert first.data == payload[:100]
+    assert first.headers['Content-Range'] == f'bytes 0-99/{len(payload)}'
+    etag = first.headers['ETag']
+    
+    # Follow-up ranges ride on the playback cookie and skip the entitlement lookup
+    with mock.patch('app.main.content_routes.has_access', side_effect=AssertionError):
+        multi = client.get(url, headers={'Range': 'bytes=0-9,-10'})
+    assert multi.status_code == 206
+    assert multi.mimetype == 'multipart/byteranges'
+    assert payload[:10] in multi.data and payload[-10:] in multi.data
+    assert int(multi.headers['Content-Length']) == len(multi.data)
+    
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+    stale = client.get(url, headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert stale.status_code == 200 and stale.data == payload
+    assert client.get(url, headers={'Range': f'bytes={len(payload)}-'}).status_code == 416
+    
+    # A token minted for another user is not accepted
+    stranger = app.test_client()
+    login_as(stranger, user_id + 1)
+    stranger.set_cookie('playback_token', client.get_cookie('playback_token', path=url).value, path=url)
+    assert stranger.get(url).status_code in (302, 403)
+
+def test_signed_download_offload(tmp_path):
+    """download_content issues a signed URL served in Python or offloaded to the proxy"""
+    ebooks = tmp_path / 'content' / 'ebooks'
+    ebooks.mkdir(parents=True)
+    (ebooks / 'guide.pdf').write_bytes(b'%PDF-1.4 test')
+    app = make_test_app(tmp_path, CONTENT_DIR=str(tmp_path / 'content'))
+    
+    with app.app_context():
+        user = User(username='reader', email='reader@skill2wealth.com')
+        product = Product(name='Guide', description='PDF', price=49.0,
+                          category='ebook', file_url='/content/ebooks/guide.pdf')
+        db.session.add_all([user, product])
+        db.session.flush()
+        order = Order(user_id=user.id, product_id=product.id, amount=49.0, payment_status='completed')
+        db.session.add(order)
+        db.session.commit()
+        user_id, order_id = user.id, order.id
+    
+    client = app.test_client()
+    login_as(client, user_id)
+    signed_url = client.get(f'/dashboard/download/{order_id}').headers['Location']
+    assert signed_url.startswith('/content/signed/ebooks/guide.pdf?')
+    
+    anonymous = app.test_client()
+    assert anonymous.get(signed_url).data == b'%PDF-1.4 test'
+    assert anonymous.get(signed_url.replace('sig=', 'sig=0')).status_code == 403
+    
+    app.config['CONTENT_OFFLOAD'] = 'x-accel-redirect'
+    offloaded = anonymous.get(signed_url)
+    assert offloaded.headers['X-Accel-Redirect'] == '/protected/ebooks/guide.pdf'
+    assert offloaded.data == b''
+
+def test_catalog_cache_versioning(tmp_path):
+    """Catalog pages run no queries until an admin write bumps the version"""
+    from app.catalog import bump_version
+    app = make_test_app(tmp_path, PAGE_CACHE_ENABLED=False)
+    
+    with app.app_context():
+        db.session.add(Product(name='Cached eBook', description='PDF', price=49.0, category='ebook'))
+        db.session.commit()
+    
+    client = app.test_client()
+    assert b'Cached eBook' in client.get('/ebooks').data
+    with count_queries(app) as counter:
+        for url in ('/', '/ebooks', '/courses'):
+            assert client.get(url).status_code == 200
+    assert counter.count == 0
+    
+    with app.app_context():
+        db.session.add(Product(name='Fresh eBook', description='PDF', price=99.0, category='ebook'))
+        db.session.commit()
+        assert b'Fresh eBook' not in client.get('/ebooks').data
+        bump_version()
+    assert b'Fresh eBook' in client.get('/ebooks').data
+
+def test_product_repository_lookup(tmp_path):
+    """Database, store and ebooks_catalog products resolve by id from one cached catalog"""
+    from app.catalog import bump_version, get_catalog, get_product
+    app = make_test_app(tmp_path, PAGE_CACHE_ENABLED=False)
+    with app.app_context():
+        draft = Product(name='Draft eBook', description='PDF', price=49.0, category='ebook', is_active=False)
+        shadow = Product(id=202, name='Database Course', description='Video', price=499.0, category='course')
+        db.session.add_all([draft, shadow])
+        db.session.commit()
+        draft_id = draft.id
+        bump_version()
+
+        catalog = get_catalog()
+        assert get_product(draft_id).name == 'Draft eBook' and catalog.category('ebook') == ()
+        assert get_product(201).title == 'Trading Starter Course' and get_product(201).price == 199.0
+        assert get_product(202).name == 'Database Course'  # database rows win over static entries
+        assert get_product(3).name == 'Psychology of Success'  # ebooks_catalog.EBOOKS
+        assert [p.id for p in catalog.category('course')] == [202]
+        try:
+            catalog.by_id[999] = None
+            assert False, 'catalog indexes are read-only'
+        except TypeError:
+            pass
+
+        # Ids written without a version bump still resolve, through one query
+        late = Product(name='Late eBook', description='PDF', price=9.0, category='ebook')
+        db.session.add(late)
+        db.session.commit()
+        with count_queries(app) as counter:
+            assert get_product(late.id).name == 'Late eBook'
+            assert get_product(12345) is None
+        assert counter.count == 2
+
+    client = app.test_client()
+    client.get('/store/product/201')
+    with count_queries(app) as counter:
+        for product_id in (201, 202, draft_id):
+            assert client.get(f'/store/product/{product_id}').status_code == 200
+    assert counter.count == 0
+
+def test_page_cache_fragments_and_purge(tmp_path):
+    """Cached storefront pages revalidate, personalise the navbar and purge by surrogate key"""
+    from unittest import mock
+    from app.catalog import bump_version
+    from app.page_cache import purge_products
+    app = make_test_app(tmp_path, PAGE_CACHE_BACKEND='sqlite')
+    
+    with app.app_context():
+        user = User(username='shopper', email='shopper@skill2wealth.com')
+        product = Product(name='Old Title', description='PDF', price=49.0, category='ebook')
+        db.session.add_all([user, product])
+        db.session.commit()
+        user_id, product_id = user.id, product.id
+    
+    url = f'/store/product/{product_id}'
+    anonymous = app.test_client()
+    first = anonymous.get(url)
+    assert first.headers['X-Page-Cache'] == 'MISS'
+    assert b'Login to Purchase' in first.data and b'<!--fragment' not in first.data
+    
+    with count_queries(app) as counter:
+        hit = anonymous.get(url)
+    assert hit.headers['X-Page-Cache'] == 'HIT' and counter.count == 0
+    # Query parameters the view does not read share the entry
+    assert anonymous.get(f'{url}?utm_source=mail&_={product_id}').headers['X-Page-Cache'] == 'HIT'
+    assert anonymous.get(url, headers={'If-None-Match': hit.headers['ETag']}).status_code == 304
+    
+    member = app.test_client()
+    login_as(member, user_id)
+    personalised = member.get(url)
+    assert personalised.headers['X-Page-Cache'] == 'HIT'
+    assert b'shopper' in personalised.data and b'Login to Purchase' not in personalised.data
+    
+    with app.app_context():
+        product = db.session.get(Product, product_id)
+        product.name = 'New Title'
+        db.session.commit()
+        assert b'Old Title' in anonymous.get(url).data
+        bump_version()
+        purge_products(product)
+    refreshed = anonymous.get(url)
+    assert refreshed.headers['X-Page-Cache'] == 'MISS' and b'New Title' in refreshed.data
+    
+    # The fallback rendered while the database is down is not stored
+    with mock.patch('app.main.routes.get_catalog', side_effect=RuntimeError('down')), \
+            mock.patch('app.main.routes.db.create_all', side_effect=RuntimeError('down')):
+        assert b'Unable to load eBooks' in anonymous.get('/ebooks').data
+    recovered = anonymous.get('/ebooks')
+    assert recovered.headers['X-Page-Cache'] == 'MISS' and b'Unable to load eBooks' not in recovered.data
+    
+    # Expired rows are deleted from the shared file as new pages are stored
+    backend = app.extensions['page_cache'].backend
+    entry = backend.get(url)
+    backend.set('/stale', entry._replace(expires_at=entry.expires_at - 3600, tags=('stale',)))
+    backend.set('/fresh', entry)
+    keys = {row[0] for row in backend._connect().execute('SELECT key FROM page')}
+    tags = {row[0] for row in backend._connect().execute('SELECT tag FROM page_tag')}
+    assert '/stale' not in keys and '/fresh' in keys and 'stale' not in tags
+
+def test_dashboard_constant_statement_count(tmp_path):
+    """Dashboard and order history cost the same number of statements for 1 or 30 purchases"""
+    app = make_test_app(tmp_path)
+    
+    with app.app_context():
+        light = User(username='light', email='light@skill2wealth.com')
+        heavy = User(username='heavy', email='heavy@skill2wealth.com')
+        db.session.add_all([light, heavy])
+        products = [Product(name=f'Item {i}', description='x', price=49.0,
+                            category='ebook' if i % 2 else 'course') for i in range(30)]
+        db.session.add_all(products)
+        db.session.flush()
+        db.session.add(Order(user_id=light.id, product_id=products[0].id, amount=49.0,
+                             payment_status='completed'))
+        for product in products:
+            db.session.add(Order(user_id=heavy.id, product_id=product.id, amount=49.0,
+                                 payment_status='completed'))
+        db.session.commit()
+        user_ids = (light.id, heavy.id)
+    
+    counts = {}
+    for user_id in user_ids:
+        client = app.test_client()
+        login_as(client, user_id)
+        for url in ('/dashboard/', '/dashboard/orders'):
+            with count_queries(app) as counter:
+                assert client.get(url).status_code == 200
+            counts.setdefault(url, []).append(counter.count)
+    assert counts['/dashboard/'][0] == counts['/dashboard/'][1]
+    assert counts['/dashboard/orders'][0] == counts['/dashboard/orders'][1]
+    
+    # Keyset pagination walks the full history without repeats
+    client = app.test_client()
+    login_as(client, user_ids[1])
+    page = client.get('/dashboard/orders')
+    assert b'Older Orders' in page.data
+    cursor = re.search(rb'before=([^"]+)"', page.data).group(1).decode().replace('&amp;', '&')
+    older = client.get('/dashboard/orders', query_string={'before': unquote(cursor)})
+    assert older.data.count(b'fa-calendar') == 10 and b'Older Orders' not in older.data
+
+def test_resumable_upload_and_background_activation(tmp_path):
+    """Chunked uploads resume after a dropped connection and publish the product via a job"""
+    import base64, hashlib
+    from app import jobs, packaging
+    from app.models import Upload
+    app = make_test_app(tmp_path, CONTENT_DIR=str(tmp_path / 'content'), JOBS_WORKER=False)
+    with app.app_context():
+        admin = User(username='admin', email='admin@skill2wealth.com')
+        db.session.add(admin)
+        db.session.commit()
+        admin_id = admin.id
+    client = app.test_client()
+    login_as(client, admin_id)
+    
+    payload = bytes(range(256)) * 12289  # ~3MB, not a multiple of the server chunk size
+    metadata = ','.join(f'{key} {base64.b64encode(value.encode()).decode()}'
+                        for key, value in (('filename', 'lesson 1.mp4'), ('kind', 'videos')))
+    created = client.post('/admin/uploads', headers={'Upload-Length': str(len(payload)),
+                                                     'Upload-Metadata': metadata})
+    assert created.status_code == 201 and created.headers['Upload-Offset'] == '0'
+    location = created.headers['Location']
+    
+    def patch(offset, body, **headers):
+        return client.patch(location, data=body, content_type='application/offset+octet-stream',
+                            headers={'Upload-Offset': str(offset), **headers})
+    
+    assert patch(0, payload[:1000]).headers['Upload-Offset'] == '1000'
+    # Connection drops mid-chunk: the bytes that arrived are kept
+    patch(1000, payload[1000:1500000], **{'Content-Length': str(len(payload))})
+    resume_at = int(client.head(location).headers['Upload-Offset'])
+    assert resume_at == 1500000
+    conflict = patch(0, payload)
+    assert conflict.status_code == 409 and conflict.headers['Upload-Offset'] == str(resume_at)
+    done = patch(resume_at, payload[resume_at:])
+    assert done.status_code == 204 and done.headers['Upload-Status'] == 'processing'
+    
+    upload_id = location.rsplit('/', 1)[1]
+    response = client.post('/admin/upload', data={'name': 'Lesson', 'description': 'Video',
+                                                  'price': '99', 'category': 'course',
+                                                  'upload_id': upload_id})
+    assert response.status_code == 302
+    with app.app_context():
+        upload = db.session.get(Upload, upload_id)
+        assert upload.sha256 == hashlib.sha256(payload).hexdigest()
+        product = Product.query.filter_by(name='Lesson').one()
+        assert not product.is_active and product.file_url is None
+        
+        # media.process, and videos.package where ffmpeg is installed
+        assert jobs.run_pending() == (2 if packaging.ffmpeg_available() else 1)
+        db.session.expire_all()
+        product = db.session.get(Product, product.id)
+        assert product.is_active and product.file_url == upload.file_url
+        final_path = tmp_path / 'content' / upload.file_url[len('/content/'):]
+        assert final_path.read_bytes() == payload
+        assert not any((tmp_path / 'content' / 'videos' / '.uploads').iterdir())
+
+def test_duplicate_final_chunk_does_not_finish_an_upload_twice(tmp_path):
+    """A retried last PATCH that raced the first one neither re-stores the file nor re-creates the part"""
+    import base64
+    import pytest
+    from io import BytesIO
+    from app import jobs, uploads
+    from app.models import Upload
+    app = make_test_app(tmp_path, CONTENT_DIR=str(tmp_path / 'content'), JOBS_WORKER=False)
+    with app.app_context():
+        admin = User(username='admin', email='admin@skill2wealth.com')
+        db.session.add(admin)
+        db.session.commit()
+        admin_id = admin.id
+    client = app.test_client()
+    login_as(client, admin_id)
+    
+    payload = make_pdf(3)
+    metadata = ','.join(f'{key} {base64.b64encode(value.encode()).decode()}'
+                        for key, value in (('filename', 'guide.pdf'), ('kind', 'ebooks')))
+    location = client.post('/admin/uploads', headers={'Upload-Length': str(len(payload)),
+                                                      'Upload-Metadata': metadata}).headers['Location']
+    upload_id = location.rsplit('/', 1)[1]
+    with app.app_context():
+        stale = db.session.get(Upload, upload_id)  # read by the duplicate request before the first one finished
+        db.session.expunge(stale)
+    assert client.patch(location, data=payload, content_type='application/offset+octet-stream',
+                        headers={'Upload-Offset': '0'}).status_code == 204
+    part = tmp_path / 'content' / 'ebooks' / '.uploads' / f'{upload_id}.part'
+    
+    with app.app_context():
+        for opened_before_move in (False, True):
+            if opened_before_move:
+                part.write_bytes(payload)  # the duplicate still had the partial file open
+            upload = db.session.merge(stale, load=False)
+            assert upload.status == 'uploading'
+            with pytest.raises(uploads.OffsetMismatch):
+                uploads.append_chunk(upload, len(payload), BytesIO(b''))
+            assert upload.status == 'processing' and part.exists() == opened_before_move
+            db.session.expunge(upload)
+        part.unlink()
+        assert jobs.run_pending() == 2  # one ebooks.index and one media.process job
+    assert not any((tmp_path / 'content' / 'ebooks' / '.uploads').iterdir())
+
+def test_content_store_dedup_refcount_and_gc(tmp_path):
+    """Identical uploads share one hash-named file; gc removes it once unreferenced"""
+    import hashlib
+    from io import BytesIO
+    from app import blobs
+    from app.models import Blob, Entitlement
+    from app.entitlements import grant_for_order
+    app = make_test_app(tmp_path, CONTENT_DIR=str(tmp_path / 'content'))
+    with app.app_context():
+        admin = User(username='admin', email='admin@skill2wealth.com')
+        buyer = User(username='buyer', email='buyer@skill2wealth.com')
+        db.session.add_all([admin, buyer])
+        db.session.commit()
+        admin_id, buyer_id = admin.id, buyer.id
+    client = app.test_client()
+    login_as(client, admin_id)
+    
+    pdf = b'%PDF-1.4 same bytes'
+    digest = hashlib.sha256(pdf).hexdigest()
+    for name in ('First', 'Second'):
+        client.post('/admin/upload', data={'name': name, 'description': 'x', 'price': '49',
+                                           'category': 'ebook',
+                                           'content_file': (BytesIO(pdf), 'guide.pdf')})
+    client.post('/admin/bulk-upload', data={'category': 'ebook', 'default_price': '49',
+                                            'files': [(BytesIO(pdf), 'guide-copy.pdf')]})
+    assert [p.name for p in (tmp_path / 'content' / 'ebooks').iterdir() if p.is_file()] == [f'{digest}.pdf']
+    
+    with app.app_context():
+        products = Product.query.order_by(Product.id).all()
+        assert {p.file_url for p in products} == {f'/content/ebooks/{digest}.pdf'}
+        assert db.session.get(Blob, products[0].file_url).refcount == 3
+        order = Order(user_id=buyer_id, product_id=products[0].id, amount=49.0, payment_status='completed')
+        db.session.add(order)
+        grant_for_order(order)
+        db.session.commit()
+        product_ids = [p.id for p in products]
+    
+    served = client.get(f'/admin/content/ebooks/{digest}.pdf')
+    assert served.headers['ETag'] == f'"{digest}"' and 'immutable' in served.headers['Cache-Control']
+    assert client.get(f'/admin/content/ebooks/{digest}.pdf',
+                      headers={'If-None-Match': f'"{digest}"'}).status_code == 304
+    
+    # Replacing a shared file adds the new copy for that product's buyers and keeps the old grant
+    client.post(f'/admin/product/{product_ids[0]}/edit', data={
+        'name': 'First', 'description': 'x', 'price': '49', 'is_active': 'on',
+        'content_file': (BytesIO(b'%PDF-1.4 v2'), 'guide-v2.pdf')})
+    for product_id in product_ids[1:]:
+        client.post(f'/admin/product/{product_id}/delete')
+    with app.app_context():
+        old_path = f'/content/ebooks/{digest}.pdf'
+        new_path = db.session.get(Product, product_ids[0]).file_url
+        grants = {e.content_path for e in Entitlement.query.filter_by(user_id=buyer_id)}
+        assert grants == {old_path, new_path}
+        assert db.session.get(Blob, old_path).refcount == 0
+        assert blobs.gc(grace=0) == [old_path]
+        assert db.session.get(Blob, new_path).refcount == 1
+    assert not (tmp_path / 'content' / 'ebooks' / f'{digest}.pdf').exists()
+
+def test_replacing_shared_files_only_moves_that_products_grants(tmp_path):
+    """Buyers of A keep their grants, and get none for B's files, as A then B replace a shared file"""
+    import hashlib
+    from io import BytesIO
+    from app.models import Entitlement
+    from app.entitlements import grant_for_order
+    app = make_test_app(tmp_path, CONTENT_DIR=str(tmp_path / 'content'), JOBS_WORKER=False)
+    with app.app_context():
+        admin = User(username='admin', email='admin@skill2wealth.com')
+        buyers = [User(username=f'buyer{n}', email=f'buyer{n}@skill2wealth.com') for n in range(2)]
+        db.session.add_all([admin, *buyers])
+        db.session.commit()
+        admin_id, buyer_ids = admin.id, [buyer.id for buyer in buyers]
+    client = app.test_client()
+    login_as(client, admin_id)
+    
+    shared = f"/content/ebooks/{hashlib.sha256(b'%PDF-1.4 shared').hexdigest()}.pdf"
+    for name in ('A', 'B'):
+        client.post('/admin/upload', data={'name': name, 'description': 'x', 'price': '49', 'category': 'ebook',
+                                           'content_file': (BytesIO(b'%PDF-1.4 shared'), 'shared.pdf')})
+    with app.app_context():
+        product_ids = [Product.query.filter_by(name=name).one().id for name in ('A', 'B')]
+        for buyer_id, product_id in zip(buyer_ids, product_ids):
+            order = Order(user_id=buyer_id, product_id=product_id, amount=49.0, payment_status='completed')
+            db.session.add(order)
+            grant_for_order(order)
+        db.session.commit()
+    
+    def replace(product_id, name, body):
+        client.post(f'/admin/product/{product_id}/edit', data={
+            'name': name, 'description': 'x', 'price': '49', 'is_active': 'on',
+            'content_file': (BytesIO(body), f'{name}-v2.pdf')})
+        with app.app_context():
+            return db.session.get(Product, product_id).file_url
+    
+    def grants(user_id):
+        with app.app_context():
+            return {e.content_path for e in Entitlement.query.filter_by(user_id=user_id)}
+    
+    new_a = replace(product_ids[0], 'A', b'%PDF-1.4 A v2')
+    assert grants(buyer_ids[0]) == {shared, new_a} and grants(buyer_ids[1]) == {shared}
+    # The shared file now belongs to B alone; only B's buyers are moved to its new file
+    new_b = replace(product_ids[1], 'B', b'%PDF-1.4 B v2')
+    assert grants(buyer_ids[0]) == {shared, new_a}
+    assert grants(buyer_ids[1]) == {new_b}
+
+def test_reuploaded_blob_survives_gc_until_attached(tmp_path):
+    """Uploading bytes of a released blob again restarts its grace period and pins it until attached"""
+    import base64
+    from datetime import datetime, timedelta
+    from io import BytesIO
+    from app import blobs
+    from app.models import Blob, Upload
+    app = make_test_app(tmp_path, CONTENT_DIR=str(tmp_path / 'content'), JOBS_WORKER=False)
+    with app.app_context():
+        admin = User(username='admin', email='admin@skill2wealth.com')
+        db.session.add(admin)
+        db.session.commit()
+        admin_id = admin.id
+    client = app.test_client()
+    login_as(client, admin_id)
+    
+    pdf = b'%PDF-1.4 released then uploaded again'
+    client.post('/admin/upload', data={'name': 'Old', 'description': 'x', 'price': '49', 'category': 'ebook',
+                                       'content_file': (BytesIO(pdf), 'guide.pdf')})
+    with app.app_context():
+        product = Product.query.filter_by(name='Old').one()
+        path, product_id = product.file_url, product.id
+    client.post(f'/admin/product/{product_id}/delete')
+    with app.app_context():
+        blob = db.session.get(Blob, path)
+        assert blob.refcount == 0
+        blob.released_at = datetime.utcnow() - timedelta(days=2)
+        db.session.commit()
+    
+    metadata = ','.join(f'{key} {base64.b64encode(value.encode()).decode()}'
+                        for key, value in (('filename', 'guide.pdf'), ('kind', 'ebooks')))
+    location = client.post('/admin/uploads', headers={'Upload-Length': str(len(pdf)),
+                                                      'Upload-Metadata': metadata}).headers['Location']
+    client.patch(location, data=pdf, content_type='application/offset+octet-stream',
+                 headers={'Upload-Offset': '0'})
+    with app.app_context():
+        upload = db.session.get(Upload, location.rsplit('/', 1)[1])
+        assert upload.file_url == path and upload.product_id is None
+        assert db.session.get(Blob, path).released_at > datetime.utcnow() - timedelta(minutes=1)
+        assert blobs.gc(grace=3600) == []
+        # Still pinned by the finished upload once the grace period has passed
+        assert blobs.gc(grace=0) == [] and blobs.is_referenced(path)
+        db.session.delete(upload)
+        db.session.commit()
+        assert blobs.gc(grace=0) == [path]
+    assert not (tmp_path / 'content' / path[len('/content/'):]).exists()
+
+def test_columns_narrower_than_the_model_are_found(tmp_path):
+    """A user table from before scrypt hashes has a 128-character password_hash that startup widens"""
+    import sqlite3
+    from app import narrow_columns
+    conn = sqlite3.connect(tmp_path / 'test.sqlite')
+    conn.execute('CREATE TABLE user (id INTEGER PRIMARY KEY, username VARCHAR(80) NOT NULL UNIQUE, '
+                 'email VARCHAR(120) NOT NULL UNIQUE, password_hash VARCHAR(128), created_at DATETIME)')
+    conn.close()
+    app = make_test_app(tmp_path)
+    with app.app_context():
+        # SQLite does not enforce the length, so it is left alone; other databases get ALTER TABLE
+        assert narrow_columns() == [('user', 'password_hash', 128, 256)]
+
+def test_password_hashing_pool_rehash_and_backpressure(tmp_path):
+    """Logins verify in the process pool, upgrade stale hashes and shed load when the queue is full"""
+    from werkzeug.security import generate_password_hash
+    app = make_test_app(tmp_path, PASSWORD_HASH_METHOD='pbkdf2:sha256:2000',
+                        PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE=1, PASSWORD_HASH_TIMEOUT=0.05)
+    with app.app_context():
+        user = User(username='old', email='old@skill2wealth.com',
+                    password_hash=generate_password_hash('secret', 'pbkdf2:sha256:1000'))
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    
+    client = app.test_client()
+    assert client.post('/auth/login', data={'email': 'old@skill2wealth.com',
+                                            'password': 'wrong'}).status_code == 200
+    response = client.post('/auth/login', data={'email': 'old@skill2wealth.com', 'password': 'secret'})
+    assert response.status_code == 302
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        assert user.password_hash.startswith('pbkdf2:sha256:2000$') and user.check_password('secret')
+    
+    hasher = app.extensions['password_hasher']
+    hasher._slots.acquire()
+    try:
+        busy = app.test_client().post('/auth/login', data={'email': 'old@skill2wealth.com',
+                                                           'password': 'secret'})
+        assert busy.status_code == 503 and busy.headers['Retry-After'] == '5'
+    finally:
+        hasher._slots.release()
+
+def test_identity_cache_and_revocation(tmp_path):
+    """Logged-in requests skip the user query; revoked credentials stop working within the TTL"""
+    import time
+    from sqlalchemy import text
+    ttl = 0.5
+    for in_session in (False, True):
+        app = make_test_app(tmp_path / str(in_session), IDENTITY_CACHE_TTL=ttl, IDENTITY_IN_SESSION=in_session,
+                            PASSWORD_HASH_METHOD='pbkdf2:sha256:1000', PASSWORD_HASH_WORKERS=0)
+        with app.app_context():
+            for name in ('reader', 'admin'):
+                user = User(username=name, email=f'{name}@skill2wealth.com')
+                user.set_password('secret')
+                db.session.add(user)
+            db.session.commit()
+        
+        clients = {}
+        for name in ('reader', 'admin'):
+            clients[name] = app.test_client()
+            assert clients[name].post('/auth/login', data={'email': f'{name}@skill2wealth.com',
+                                                           'password': 'secret'}).status_code == 302
+        reader = clients['reader']
+        assert reader.get('/dashboard/').status_code == 200
+        assert clients['admin'].get('/admin/').status_code == 200
+        if in_session:
+            # Another worker with a cold cache trusts the signed session
+            app.extensions['identity'].cache.clear()
+        with count_queries(app) as counter:
+            assert reader.get('/dashboard/').status_code == 200
+            assert clients['admin'].get('/admin/').status_code == 200
+        assert not [s for s in counter.statements if re.search(r'FROM user\s+WHERE user.id', s)]
+        
+        # A password reset written outside the ORM: honoured once the cached identity expires
+        with app.app_context():
+            db.session.execute(text("UPDATE user SET password_hash = 'reset' WHERE username = 'reader'"))
+            db.session.commit()
+        assert reader.get('/dashboard/').status_code == 200
+        time.sleep(ttl + 0.1)
+        assert reader.get('/dashboard/').status_code == 302
+        
+        # ORM changes bump the version stamp, so the admin session ends straight away
+        if not in_session:
+            with app.app_context():
+                User.query.filter_by(username='admin').one().email = 'moved@skill2wealth.com'
+                db.session.commit()
+            assert clients['admin'].get('/admin/').status_code == 302
+
+def test_database_engine_profile(tmp_path):
+    """SQLite connections get the WAL profile; Postgres gets a sized, pre-pinged pool"""
+    from sqlalchemy import text
+    from app.database import engine_options
+    app = make_test_app(tmp_path, SQLITE_BUSY_TIMEOUT=1234)
+    with app.app_context():
+        pragma = lambda name: db.session.execute(text(f'PRAGMA {name}')).scalar()
+        assert pragma('journal_mode') == 'wal'
+        assert pragma('synchronous') == 1  # NORMAL
+        assert pragma('busy_timeout') == 1234
+    
+    options = engine_options(app.config, 'postgresql://app@db/skill2wealth')
+    assert options['pool_size'] == app.config['DB_POOL_SIZE'] and options['pool_pre_ping']
+    assert options['connect_args'] == {'options': '-c statement_timeout=5000'}
+
+def test_replica_routing_and_read_your_writes(tmp_path):
+    """Catalog, order history and admin listings read the replica; a buyer's own purchase sticks to the primary"""
+    import sqlite3
+    from app.routing import STICKY_COOKIE
+    replica_path = tmp_path / 'replica.sqlite'
+    app = make_test_app(tmp_path, SQLALCHEMY_REPLICA_URIS=[f'sqlite:///{replica_path}'],
+                        PAGE_CACHE_ENABLED=False)
+    with app.app_context():
+        admin = User(username='admin', email='admin@skill2wealth.com')
+        buyer = User(username='buyer', email='buyer@skill2wealth.com')
+        old = Product(name='Replicated Guide', description='x', price=49.0, category='ebook')
+        db.session.add_all([admin, buyer, old])
+        db.session.commit()
+        ids = admin.id, buyer.id, old.id
+        # Replicate, then write something the replica has not seen yet
+        with sqlite3.connect(tmp_path / 'test.sqlite') as source, sqlite3.connect(replica_path) as target:
+            source.backup(target)
+        new = Product(name='Lagging Guide', description='x', price=99.0, category='ebook')
+        db.session.add(new)
+        db.session.commit()
+    admin_id, buyer_id, old_id = ids
+    
+    shopper = app.test_client()
+    assert b'Replicated Guide' in shopper.get(f'/store/product/{old_id}').data
+    admin_client = app.test_client()
+    login_as(admin_client, admin_id)
+    listing = admin_client.get('/admin/products').data
+    assert b'Replicated Guide' in listing and b'Lagging Guide' not in listing
+    
+    buyer_client = app.test_client()
+    login_as(buyer_client, buyer_id)
+    assert b'Replicated Guide' not in buyer_client.get('/dashboard/orders').data
+    assert buyer_client.post(f'/store/buy/{old_id}', data={'payment_method': 'cod'}).status_code == 302
+    assert buyer_client.get_cookie(STICKY_COOKIE) is not None
+    assert b'Replicated Guide' in buyer_client.get('/dashboard/orders').data
+    # Other visitors keep reading the replica
+    assert admin_client.get_cookie(STICKY_COOKIE) is None
+    assert b'Lagging Guide' not in admin_client.get('/admin/products').data
+
+def test_admin_stats_counters(tmp_path):
+    """Dashboard totals come from counters kept by flush hooks; verify() repairs drift"""
+    from datetime import datetime
+    from sqlalchemy import text
+    from app import stats
+    app = make_test_app(tmp_path, JOBS_WORKER=False)
+    with app.app_context():
+        admin = User(username='admin', email='admin@skill2wealth.com')
+        products = [Product(name=f'Item {i}', description='x', price=100.0 * (i + 1),
+                            category='ebook' if i < 3 else 'course') for i in range(5)]
+        db.session.add(admin)
+        db.session.add_all(products)
+        db.session.flush()
+        orders = [Order(user_id=admin.id, product_id=p.id, amount=p.price) for p in products[:3]]
+        db.session.add_all(orders)
+        db.session.commit()
+        orders[0].payment_status = 'completed'
+        orders[1].payment_status = 'completed'
+        orders[2].payment_status = 'failed'
+        products[4].category = 'ebook'
+        db.session.delete(products[3])
+        db.session.commit()
+        
+        counters = stats.snapshot()
+        assert counters['products'] == 4 and counters['products:ebook'] == 4 and counters['products:course'] == 0
+        assert counters['users'] == 1 and counters['orders:pending'] == 0
+        assert counters['orders:completed'] == 2 and counters['orders:failed'] == 1
+        assert counters['revenue'] == 300.0
+        series = stats.daily(7)
+        assert series['days'][-1] == datetime.utcnow().date().isoformat()
+        assert series['series']['orders'][-1] == 3 and series['series']['revenue'][-1] == 300.0
+        assert stats.verify() == {}
+        
+        # Writes that bypass the ORM are caught by the periodic recount
+        db.session.execute(text("INSERT INTO user (username, email, created_at) VALUES ('raw', 'raw@skill2wealth.com', CURRENT_TIMESTAMP)"))
+        db.session.commit()
+        assert stats.verify() == {'users': (1, 2)}
+        assert stats.snapshot()['users'] == 2 and stats.daily(1)['series']['users'] == [2]
+        admin_id = admin.id
+    
+    client = app.test_client()
+    login_as(client, admin_id)
+    with count_queries(app) as counter:
+        page = client.get('/admin/')
+    assert page.status_code == 200 and b'Item 4' in page.data
+    assert not [s for s in counter.statements if 'count(' in s.lower()]
+    assert client.get('/admin/stats/daily?days=3').json['series']['users'] == [0, 0, 2]
+
+def test_sales_analytics_rollups(tmp_path):
+    """Columnar rollups answer revenue/product queries and rebuild incrementally"""
+    from datetime import datetime, timedelta
+    from app import analytics
+    app = make_test_app(tmp_path, JOBS_WORKER=False, ANALYTICS_SETTLE_HOURS=2)
+    now = datetime.utcnow().replace(hour=12, minute=30, second=0, microsecond=0)
+    old = now - timedelta(days=40)
+    with app.app_context():
+        admin = User(username='admin', email='admin@skill2wealth.com')
+        cheap = Product(name='Cheap', description='x', price=50.0, category='ebook')
+        dear = Product(name='Dear', description='x', price=300.0, category='course')
+        db.session.add_all([admin, cheap, dear])
+        db.session.flush()
+        def order(product, status, created_at):
+            return Order(user_id=admin.id, product_id=product.id, amount=product.price,
+                         payment_status=status, created_at=created_at)
+        old_orders = [order(cheap, 'completed', old), order(cheap, 'failed', old), order(dear, 'completed', old)]
+        recent = order(dear, 'pending', now)
+        db.session.add_all(old_orders + [recent, order(cheap, 'completed', now - timedelta(hours=1))])
+        db.session.commit()
+        
+        assert analytics.build()['rows'] == {'hourly': 4, 'daily': 4, 'monthly': 4}
+        series = analytics.revenue_series('daily', start=old.date().isoformat())
+        assert series['buckets'][0] == old.date().isoformat()
+        assert series['orders'][0] == 3 and series['completed'][0] == 2 and series['revenue'][0] == 350.0
+        assert series['conversion'][0] == round(2 / 3, 4)
+        assert analytics.revenue_series('hourly', product_id=dear.id)['revenue'] == [300.0, 0.0]
+        top = analytics.product_sales('monthly')
+        assert [row['product_id'] for row in top] == [dear.id, cheap.id]
+        assert top[1] == {'product_id': cheap.id, 'orders': 3, 'completed': 2, 'revenue': 100.0,
+                          'conversion': round(2 / 3, 4)}
+        
+        # Incremental build re-reads only the settle window; older rows are copied as they were
+        recent.payment_status = 'completed'
+        old_orders[1].payment_status = 'completed'
+        db.session.commit()
+        analytics.build()
+        assert analytics.revenue_series('hourly', start=now)['revenue'] == [300.0]
+        assert analytics.revenue_series('daily', end=old + timedelta(days=1))['completed'] == [2]
+        analytics.build(rebuild=True)
+        assert analytics.revenue_series('daily', end=old + timedelta(days=1))['completed'] == [3]
+        admin_id, dear_id = admin.id, dear.id
+    
+    client = app.test_client()
+    login_as(client, admin_id)
+    products = client.get('/admin/analytics/products?grain=daily&limit=1').json['products']
+    assert products == [{'product_id': dear_id, 'name': 'Dear', 'orders': 2, 'completed': 2,
+                         'revenue': 600.0, 'conversion': 1.0}]
+    assert client.get('/admin/analytics/products?grain=daily&limit=0').json['products'] == products
+    assert client.get('/admin/analytics/revenue?grain=monthly').json['revenue'] == [400.0, 350.0]
+    assert client.get('/admin/analytics/revenue?grain=weekly').status_code == 400
+
+def test_product_search_backends(tmp_path):
+    """FTS5 and in-process BM25 search follow admin writes and fold Hindi/Hinglish spellings"""
+    from app import search
+    for backend in ('fts5', 'memory'):
+        app = make_test_app(tmp_path / backend, SEARCH_BACKEND=backend)
+        with app.app_context():
+            assert app.extensions['search'].backend == backend
+            products = [
+                Product(name='Share Bazaar Trading Guide', description='Candlestick patterns for NSE stocks', price=99.0, category='ebook'),
+                Product(name='Paisa Kaise Bachaye', description='Budgeting aur saving seekhna in Hinglish', price=49.0, category='ebook'),
+                Product(name='Options Masterclass', description='Trading options with risk management', price=299.0, category='course'),
+            ]
+            db.session.add_all(products)
+            db.session.commit()
+            
+            hits = search.search('trading')
+            # Name matches (including the static courses) rank above a description-only match
+            assert {hit.name for hit in hits[:3]} == {'Share Bazaar Trading Guide', 'Trading Starter Course',
+                                                      'Advanced Trading Course'}
+            assert 'Options Masterclass' in {hit.name for hit in hits[3:]}
+            assert [hit.name for hit in search.search('सीखना')] == ['Paisa Kaise Bachaye']
+            assert [hit.name for hit in search.search('paissa sikhna')] == ['Paisa Kaise Bachaye']
+            assert search.search('psychology')[0].kind == 'ebook'
+            assert search.suggest('masterc') == ['Options Masterclass']
+            
+            products[0].name = 'Share Bazaar Basics'
+            products[2].is_active = False
+            db.session.delete(products[1])
+            db.session.commit()
+            assert [hit.name for hit in search.search('bazaar')] == ['Share Bazaar Basics']
+            assert search.search('masterclass') == [] and search.search('paisa') == []
+        
+        response = app.test_client().get('/search?q=bazaar+basics&format=json')
+        assert [hit['name'] for hit in response.json['results']] == ['Share Bazaar Basics']
+        assert b'Share Bazaar Basics' in app.test_client().get('/search?q=share+baz').data
+
+def test_admin_product_keyset_listing_and_bulk_actions(tmp_path):
+    """Admin listing pages by (created_at, id); bulk actions are set-based and keep counters/search in step"""
+    import re
+    from datetime import datetime, timedelta
+    from app import search, stats
+    app = make_test_app(tmp_path, JOBS_WORKER=False)
+    start = datetime(2024, 1, 1)
+    with app.app_context():
+        admin = User(username='admin', email='admin@skill2wealth.com')
+        db.session.add(admin)
+        # Pairs share a timestamp, so the id tie-break matters
+        db.session.add_all([Product(name=f'Bulk item {i}', description='imported', price=100.0,
+                                    category='ebook' if i % 3 else 'course', is_active=i % 2 == 0,
+                                    created_at=start + timedelta(minutes=i // 2)) for i in range(60)])
+        db.session.commit()
+        expected = [p.id for p in Product.query.order_by(Product.created_at.desc(), Product.id.desc())]
+        inactive_ebooks = {p.id for p in Product.query.filter_by(category='ebook', is_active=False)}
+        repriced = [p.id for p in Product.query.filter_by(category='ebook').order_by(Product.id.desc()).limit(3)]
+        sold = Product.query.filter_by(name='Bulk item 3').one()
+        db.session.add(Order(user_id=admin.id, product_id=sold.id, amount=100.0))
+        db.session.commit()
+        admin_id, sold_id = admin.id, sold.id
+    
+    client = app.test_client()
+    login_as(client, admin_id)
+    def page_ids(url):
+        html = client.get(url).get_data(as_text=True)
+        return ([int(i) for i in re.findall(r'name="product_ids" value="(\d+)"', html)],
+                dict(re.findall(r'(after|before)=([^&"]+)', html.replace('&amp;', '&'))))
+    seen, url = [], '/admin/products'
+    while url:
+        ids, cursors = page_ids(url)
+        seen += ids
+        url = f"/admin/products?after={cursors['after']}" if 'after' in cursors else None
+    assert seen == expected
+    ids, cursors = page_ids(f"/admin/products?after={page_ids('/admin/products')[1]['after']}")
+    assert page_ids(f"/admin/products?before={cursors['before']}")[0] == expected[:25]
+    assert set(page_ids('/admin/products?category=ebook&status=inactive')[0]) == inactive_ebooks
+    
+    with count_queries(app) as counter:
+        response = client.post('/admin/products/bulk', data={'action': 'activate', 'scope': 'filter',
+                                                              'category': 'ebook', 'status': 'inactive'})
+    assert response.status_code == 302
+    assert not [s for s in counter.statements if re.search(r'FROM product\s+WHERE product.id = ', s)]
+    client.post('/admin/products/bulk', data={'action': 'reprice', 'percent': '-10',
+                                              'product_ids': repriced})
+    client.post('/admin/products/bulk', data={'action': 'delete', 'scope': 'filter', 'category': 'course'})
+    # Without a filter the view is the whole catalog, which takes an explicit scope=all
+    for action in ('delete', 'reprice'):
+        response = client.post('/admin/products/bulk', data={'action': action, 'scope': 'filter', 'percent': '50'},
+                               follow_redirects=True)
+        assert b'Choose a category or status filter' in response.data
+    
+    with app.app_context():
+        assert Product.query.filter(Product.id.in_(inactive_ebooks), Product.is_active.is_(False)).count() == 0
+        assert [p.price for p in Product.query.filter(Product.id.in_(repriced))] == [90.0] * 3
+        assert [p.id for p in Product.query.filter_by(category='course')] == [sold_id]
+        assert stats.verify() == {}
+        assert [hit.name for hit in search.search('bulk item 1', prefix=False)] == ['Bulk item 1']
+        assert search.search('bulk item 6', prefix=False) == []
+    client.post('/admin/products/bulk', data={'action': 'deactivate', 'scope': 'all'})
+    with app.app_context():
+        assert Product.query.filter_by(is_active=True).count() == 0
+
 if __name__ == '__main__':
     test_basic_functionality()
+
+def test_bulk_import_manifest_and_partial_success(tmp_path):
+    """Bulk upload sniffs each file, takes details from the manifest and imports what it can"""
+    from io import BytesIO
+    from app import search, stats
+    from app.models import Blob, BlobRef
+    app = make_test_app(tmp_path, CONTENT_DIR=str(tmp_path / 'content'), BULK_IMPORT_BATCH=2)
+    with app.app_context():
+        admin = User(username='admin', email='admin@skill2wealth.com')
+        db.session.add(admin)
+        db.session.commit()
+        admin_id = admin.id
+    client = app.test_client()
+    login_as(client, admin_id)
+
+    manifest = (b'filename,name,price,description,active\n'
+                b'basics.pdf,Trading Basics,99,Candlesticks from scratch,yes\n'
+                b'options.pdf,Options 101,149.5,Calls and puts,no\n'
+                b'fake.pdf,Fake,10,Not really a PDF,yes\n'
+                b'absent.pdf,Absent,10,,yes\n')
+    files = [(BytesIO(b'%PDF-1.4 basics'), 'basics.pdf'),
+             (BytesIO(b'%PDF-1.7 options'), 'options.pdf'),
+             (BytesIO(b'MZ\x90\x00 renamed executable'), 'fake.pdf'),
+             (BytesIO(b'%PDF-1.4 basics'), 'basics-copy.pdf')]
+    # Without a manifest a default price is required
+    assert client.post('/admin/bulk-upload', data={
+        'category': 'ebook', 'files': [(BytesIO(b'%PDF-1.4 x'), 'x.pdf')]}).status_code == 302
+
+    response = client.post('/admin/bulk-upload?format=json', data={
+        'category': 'ebook', 'default_price': '25', 'manifest': (BytesIO(manifest), 'manifest.csv'), 'files': files})
+    report = {item['filename']: item for item in response.get_json()['results']}
+    assert response.get_json()['created'] == 3
+    assert [report[name]['status'] for name in ('basics.pdf', 'options.pdf', 'fake.pdf', 'basics-copy.pdf', 'absent.pdf')] \
+        == ['created', 'created', 'failed', 'created', 'missing']
+    assert 'Not a PDF' in report['fake.pdf']['message']
+
+    with app.app_context():
+        products = {p.name: p for p in Product.query}
+        assert set(products) == {'Trading Basics', 'Options 101', 'Basics Copy'}
+        basics, options, copy = products['Trading Basics'], products['Options 101'], products['Basics Copy']
+        assert (basics.price, basics.description, basics.is_active) == (99.0, 'Candlesticks from scratch', True)
+        assert (options.price, options.is_active) == (149.5, False)
+        assert (copy.price, copy.description, copy.is_active) == (25.0, '', False)
+        assert copy.file_url == basics.file_url and basics.file_url.endswith('.pdf')
+        assert db.session.get(Blob, basics.file_url).refcount == 2
+        assert BlobRef.query.count() == 3
+        assert stats.verify() == {}
+        assert [hit.id for hit in search.search('candlesticks', prefix=False)] == [basics.id]
+    assert not list((tmp_path / 'content' / 'ebooks' / '.uploads').iterdir())
+
+def test_static_assets_fingerprinted_and_precompressed(tmp_path):
+    """url_for('static') links to the hashed build, served precompressed with immutable caching"""
+    import gzip
+    import os
+    import shutil
+    from flask import url_for
+    from app import assets
+    static = tmp_path / 'static'
+    for folder in ('css', 'js'):
+        shutil.copytree(os.path.join(os.path.dirname(assets.__file__), 'static', folder), static / folder)
+    (static / 'images' / 'products').mkdir(parents=True)
+    (static / 'images' / 'products' / 'upload.png').write_bytes(b'\x89PNG upload')
+    source = (static / 'js' / 'resumable_upload.js').read_bytes()
+    manifest = assets.build(str(static))
+    hashed = manifest['files']['js/resumable_upload.js']
+    assert hashed == assets.fingerprint('js/resumable_upload.js', source)
+    assert 'gzip' in manifest['encodings'][hashed] and 'images/products/upload.png' not in manifest['files']
+    assert assets.build(str(static)) == manifest
+
+    app = make_test_app(tmp_path)
+    app.static_folder = str(static)
+    assets.init_app(app)
+    with app.test_request_context():
+        assert url_for('static', filename='js/resumable_upload.js') == f'/static/dist/{hashed}'
+    client = app.test_client()
+    # Storefront pages link their stylesheets and script through the build too
+    page = client.get('/ebooks').get_data(as_text=True)
+    for name in ('css/site.css', 'css/ebooks.css', 'js/site.js'):
+        assert f'/static/dist/{manifest["files"][name]}' in page
+    response = client.get(f'/static/dist/{hashed}', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in response.vary
+    assert 'immutable' in response.headers['Cache-Control'] and 'max-age=31536000' in response.headers['Cache-Control']
+    assert gzip.decompress(response.data) == source
+    response.close()
+    response = client.get(f'/static/dist/{hashed}', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers and response.data == source
+    response.close()
+    # Anything else is plain Flask static serving
+    response = client.get('/static/images/products/upload.png')
+    assert response.status_code == 200 and 'immutable' not in response.headers.get('Cache-Control', '')
+    response.close()
+
+def test_product_image_variants_and_derivative_cache(tmp_path):
+    """Catalog cards link to width-bucketed variants kept in a byte-bounded LRU disk cache"""
+    import os
+    import time
+    from io import BytesIO
+    from app import images, jobs
+    app = make_test_app(tmp_path, CONTENT_DIR=str(tmp_path / 'content'), JOBS_WORKER=False)
+    app.static_folder = str(tmp_path / 'static')
+    with app.app_context():
+        admin = User(username='admin', email='admin@skill2wealth.com')
+        db.session.add(admin)
+        db.session.commit()
+        admin_id = admin.id
+    client = app.test_client()
+    login_as(client, admin_id)
+
+    if images.Image is not None:
+        buffer = BytesIO()
+        images.Image.new('RGB', (1600, 900), (200, 80, 40)).save(buffer, 'PNG')
+        cover = buffer.getvalue()
+    else:
+        cover = b'\x89PNG original bytes'
+    client.post('/admin/upload', data={'name': 'Chart Patterns', 'description': 'x', 'price': '99',
+                                       'category': 'ebook', 'is_active': 'on',
+                                       'content_file': (BytesIO(b'%PDF-1.4 charts'), 'charts.pdf'),
+                                       'image_file': (BytesIO(cover), 'cover.png')})
+    with app.app_context():
+        image_url = Product.query.one().image_url
+    filename = image_url.rsplit('/', 1)[1]
+    page = client.get('/ebooks').get_data(as_text=True)
+    assert client.get(f'/images/products/333/{filename}.webp').status_code == 404
+    assert client.get('/images/products/320/missing.png.webp').status_code == 404
+
+    if images.Image is None:
+        # Without Pillow cards keep the placeholder rather than the full-size original
+        assert image_url not in page and 'fa-book fa-4x' in page
+        response = client.get(f'/images/products/320/{filename}.webp')
+        assert response.status_code == 302 and response.headers['Location'].endswith(image_url)
+    else:
+        assert f'/images/products/320/{filename}.webp 320w' in page
+        with app.app_context():
+            assert jobs.run_pending() == 2  # images.warm, and ebooks.index for the PDF
+        cached = tmp_path / 'state' / 'image_cache' / '320' / f'{filename}.webp'
+        assert cached.exists()
+        response = client.get(f'/images/products/320/{filename}.webp')
+        assert response.mimetype == 'image/webp' and 'immutable' in response.headers['Cache-Control']
+        assert images.Image.open(BytesIO(response.data)).size == (320, 180)
+        assert len(response.data) < len(cover)
+        response.close()
+
+    # The disk cache evicts least recently used variants once it is over budget
+    cache = images.DerivativeCache(str(tmp_path / 'lru'), max_bytes=350)
+    for n, key in enumerate(('160/a.jpg', '160/b.jpg', '320/c.jpg')):
+        cache.put(key, b'x' * 100)
+        os.utime(cache.path(key), (time.time() - 10000 + n, time.time() - 10000 + n))
+    assert cache.get('160/a.jpg')  # old enough that the hit refreshes its recency
+    cache.put('320/d.jpg', b'x' * 100)
+    assert [key for key in ('160/a.jpg', '160/b.jpg', '320/c.jpg', '320/d.jpg') if cache.get(key)] \
+        == ['160/a.jpg', '320/c.jpg', '320/d.jpg']
+
+
+def make_pdf(page_count):
+    """Small PDF with a classic xref; MediaBox and Resources are inherited from the page tree"""
+    objects = [b'<</Type /Catalog /Pages 2 0 R>>',
+               b'<</Type /Pages /Kids [%s] /Count %d /MediaBox [0 0 300 400] /Resources <</Font <</F1 3 0 R>>>>>>'
+               % (b' '.join(b'%d 0 R' % (4 + 2 * n) for n in range(page_count)), page_count),
+               b'<</Type /Font /Subtype /Type1 /BaseFont /Helvetica>>']
+    for n in range(page_count):
+        text = b'BT /F1 24 Tf 40 300 Td (Page %d) Tj ET' % (n + 1)
+        objects.append(b'<</Type /Page /Parent 2 0 R /Contents %d 0 R>>' % (5 + 2 * n))
+        objects.append(b'<</Length %d>>\nstream\n%s\nendstream' % (len(text), text))
+    body = b'%PDF-1.4\n'
+    offsets = []
+    for num, obj in enumerate(objects, 1):
+        offsets.append(len(body))
+        body += b'%d 0 obj\n%s\nendobj\n' % (num, obj)
+    xref = b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    xref += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    return body + xref + b'trailer\n<</Size %d /Root 1 0 R>>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, len(body))
+
+def test_ebook_page_index_excerpts_and_preview(tmp_path):
+    """PDF uploads are indexed by page; buyers get page excerpts and everyone a cached preview"""
+    import hashlib
+    from io import BytesIO
+    from app import blobs, ebook_pages, jobs
+    from app.pdf import PDFReader
+    from app.entitlements import grant_for_order
+    app = make_test_app(tmp_path, CONTENT_DIR=str(tmp_path / 'content'), JOBS_WORKER=False,
+                        PAGE_CACHE_ENABLED=False, EBOOK_PREVIEW_PAGES=3)
+    with app.app_context():
+        admin = User(username='admin', email='admin@skill2wealth.com')
+        buyer = User(username='buyer', email='buyer@skill2wealth.com')
+        other = User(username='other', email='other@skill2wealth.com')
+        db.session.add_all([admin, buyer, other])
+        db.session.commit()
+        admin_id, buyer_id, other_id = admin.id, buyer.id, other.id
+    client = app.test_client()
+    login_as(client, admin_id)
+
+    pdf = make_pdf(8)
+    digest = hashlib.sha256(pdf).hexdigest()
+    filename = f'{digest}.pdf'
+    client.post('/admin/upload', data={'name': 'Candlesticks', 'description': 'x', 'price': '49',
+                                       'category': 'ebook', 'is_active': 'on',
+                                       'content_file': (BytesIO(pdf), 'candles.pdf')})
+    with app.app_context():
+        product_id = Product.query.one().id
+    # Storefront requests never index: until the job has run there is no preview to link or serve
+    assert 'preview.pdf' not in client.get(f'/store/product/{product_id}').get_data(as_text=True)
+    assert client.get(f'/store/product/{product_id}/preview.pdf').status_code == 404
+    derived = tmp_path / 'content' / 'ebooks' / '.pages'
+    assert not derived.exists()
+    with app.app_context():
+        assert jobs.run_pending() == 2  # queued by the upload, and again by the product page (a no-op)
+        order = Order(user_id=buyer_id, product_id=product_id, amount=49.0, payment_status='completed')
+        db.session.add(order)
+        grant_for_order(order)
+        db.session.commit()
+    assert sorted(p.name for p in derived.iterdir()) == [f'{digest}.json', f'{digest}.preview-3.pdf']
+
+    # The preview is linked from the product page and needs no login
+    client.get('/auth/logout')
+    assert f'/store/product/{product_id}/preview.pdf' in client.get(f'/store/product/{product_id}').get_data(as_text=True)
+    preview = tmp_path / 'preview.pdf'
+    preview.write_bytes(client.get(f'/store/product/{product_id}/preview.pdf').data)
+    with PDFReader(str(preview)) as reader:
+        pages = reader.pages()
+        assert len(pages) == 3
+        first = reader.get(pages[0][0])
+        assert first['MediaBox'] == [0, 0, 300, 400] and 'F1' in first['Resources']['Font']
+    assert b'(Page 3)' in preview.read_bytes() and b'(Page 4)' not in preview.read_bytes()
+
+    login_as(client, other_id)
+    assert client.get(f'/content/ebooks/{filename}/pages/2-3').status_code == 403
+    login_as(client, buyer_id)
+    index = client.get(f'/content/ebooks/{filename}/index').get_json()
+    assert index['pages'] == 8 and index['size'] == len(pdf)
+    start, end = index['ranges'][4][-1]
+    assert b'(Page 5)' in pdf[start:end]
+    response = client.get(f'/content/ebooks/{filename}/pages/2-3')
+    assert response.mimetype == 'application/pdf' and response.headers['X-Total-Pages'] == '8'
+    excerpt = tmp_path / 'excerpt.pdf'
+    excerpt.write_bytes(response.data)
+    with PDFReader(str(excerpt)) as reader:
+        assert len(reader.pages()) == 2
+    assert [f'(Page {n})'.encode() in response.data for n in (1, 2, 3, 4)] == [False, True, True, False]
+    assert client.get(f'/content/ebooks/{filename}/pages/7-9').status_code == 404
+
+    # Removing the blob removes its index and previews
+    with app.app_context():
+        Order.query.delete()
+        db.session.commit()
+    login_as(client, admin_id)
+    client.post(f'/admin/product/{product_id}/delete')
+    with app.app_context():
+        assert ebook_pages.get_index(filename) is not None
+        assert blobs.gc(grace=0) == [f'/content/ebooks/{filename}']
+        assert ebook_pages.get_index(filename) is None
+    assert list(derived.iterdir()) == []
+
+def test_video_packaging_and_signed_stream_urls(tmp_path):
+    """Packaged course videos stream after one purchase check, through signed segment URLs"""
+    import shutil
+    import subprocess
+    from io import BytesIO
+    from app import blobs, jobs, packaging
+    from app.models import VideoPackage
+    from app.entitlements import grant_for_order
+    app = make_test_app(tmp_path, CONTENT_DIR=str(tmp_path / 'content'), JOBS_WORKER=False)
+    with app.app_context():
+        admin = User(username='admin', email='admin@skill2wealth.com')
+        buyer = User(username='buyer', email='buyer@skill2wealth.com')
+        other = User(username='other', email='other@skill2wealth.com')
+        db.session.add_all([admin, buyer, other])
+        db.session.commit()
+        admin_id, buyer_id, other_id = admin.id, buyer.id, other.id
+    client = app.test_client()
+    login_as(client, admin_id)
+
+    ffmpeg = packaging.ffmpeg_available()
+    if ffmpeg:
+        clip = tmp_path / 'clip.mp4'
+        subprocess.run([shutil.which('ffmpeg'), '-v', 'error', '-f', 'lavfi', '-i', 'testsrc=size=640x360:rate=25',
+                        '-f', 'lavfi', '-i', 'sine', '-t', '6', '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
+                        '-c:a', 'aac', '-shortest', str(clip)], check=True)
+        video = clip.read_bytes()
+    else:
+        video = b'\x00\x00\x00\x18ftypmp42 sample clip'
+    client.post('/admin/upload', data={'name': 'Price Action', 'description': 'x', 'price': '199',
+                                       'category': 'course', 'is_active': 'on',
+                                       'content_file': (BytesIO(video), 'lesson.mp4')})
+    with app.app_context():
+        product = Product.query.one()
+        product_id, content_path = product.id, product.file_url
+        order = Order(user_id=buyer_id, product_id=product_id, amount=199.0, payment_status='completed')
+        db.session.add(order)
+        grant_for_order(order)
+        db.session.commit()
+    filename = content_path.rsplit('/', 1)[1]
+    sha256 = filename.split('.')[0]
+
+    if ffmpeg:
+        with app.app_context():
+            assert jobs.run_pending() == 1
+    else:
+        # Without ffmpeg nothing is queued and /stream plays the original file
+        with app.app_context():
+            assert jobs.run_pending() == 0
+        assert client.get(f'/admin/product/{product_id}/packaging').get_json()['status'] == 'unavailable'
+        response = client.get(f'/content/videos/{filename}/stream')
+        assert response.status_code == 302 and response.headers['Location'].endswith(content_path)
+        # Stand in for the job's output
+        package = tmp_path / 'content' / 'videos' / sha256
+        package.mkdir()
+        (package / 'master.m3u8').write_text('#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=931729\nmedia_0.m3u8\n')
+        (package / 'media_0.m3u8').write_text('#EXTM3U\n#EXT-X-MAP:URI="init-0.m4s"\n#EXTINF:4.0,\n'
+                                              'seg-0-00001.m4s\n#EXT-X-ENDLIST\n')
+        (package / 'init-0.m4s').write_bytes(b'init')
+        (package / 'seg-0-00001.m4s').write_bytes(b'segment' * 100)
+        with app.app_context():
+            db.session.add(VideoPackage(sha256=sha256, content_path=content_path, status='ready', progress=1.0))
+            db.session.commit()
+    status = client.get(f'/admin/product/{product_id}/packaging').get_json()
+    assert status['status'] == 'ready' and status['progress'] == 1.0
+
+    login_as(client, other_id)
+    assert client.get(f'/content/videos/{filename}/stream').status_code == 403
+    login_as(client, buyer_id)
+    response = client.get(f'/content/videos/{filename}/stream')
+    manifest_url = response.headers['Location']
+    assert response.status_code == 302 and manifest_url.startswith(f'/content/stream/{sha256}/')
+    assert client.get(f'/content/videos/{filename}/stream?format=dash').headers['Location'].endswith('/manifest.mpd')
+
+    # Playlists and segments need no session: the token in the path is the only check
+    client.get('/auth/logout')
+    master = client.get(manifest_url)
+    assert master.mimetype == 'application/vnd.apple.mpegurl' and 'immutable' in master.headers['Cache-Control']
+    base = manifest_url.rsplit('/', 1)[0]
+    playlist = next(line for line in master.get_data(as_text=True).splitlines() if line.endswith('.m3u8'))
+    segment = next(line for line in client.get(f'{base}/{playlist}').get_data(as_text=True).splitlines()
+                   if line.endswith('.m4s'))
+    response = client.get(f'{base}/{segment}')
+    assert response.status_code == 200 and response.mimetype == 'video/iso.segment'
+    response.close()
+    token = base.rsplit('/', 1)[1]
+    user_id, expires, signature = token.split('-')
+    assert client.get(f'/content/stream/{sha256}/{other_id}-{expires}-{signature}/{segment}').status_code == 403
+
+    # Removing the blob removes its package
+    with app.app_context():
+        Order.query.delete()
+        db.session.commit()
+    login_as(client, admin_id)
+    client.post(f'/admin/product/{product_id}/delete')
+    with app.app_context():
+        assert blobs.gc(grace=0) == [content_path]
+        assert db.session.get(VideoPackage, sha256) is None
+    assert not (tmp_path / 'content' / 'videos' / sha256).exists()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Payment gateway tests, run offline against stub_gateway.py
+"""
+
+import hashlib
+import hmac
+import json
+import time
+import pytest
+import requests
+from razorpay.errors import ServerError
+from app.payments import GatewayClient, CircuitBreaker, RetryBudget, GatewayUnavailable, get_gateway, get_order_pool
+from app.utils import create_razorpay_order
+from app import webhooks, stats
+from app.extensions import db
+from app.models import User, Product, Order, Entitlement
+from stub_gateway import StubGateway
+from test_app import make_test_app
+
+@pytest.fixture
+def stub():
+    gateway = StubGateway(seed=1)
+    gateway.base_url = gateway.start()
+    yield gateway
+    gateway.stop()
+
+def test_pooled_client_reuses_connections(stub):
+    """Sequential calls share one keep-alive connection"""
+    client = GatewayClient('key', 'secret', base_url=stub.base_url)
+    orders = [client.create_order(4900) for _ in range(20)]
+    assert len({order['id'] for order in orders}) == 20
+    adapter = client.client.session.get_adapter(stub.base_url)
+    assert len(adapter.poolmanager.pools) == 1
+    snapshot = client.metrics.snapshot()
+    assert snapshot['calls']['order.create.ok'] == 20
+    assert snapshot['latency_ms']['p99'] is not None
+
+def test_circuit_breaker_stops_calling_a_failing_gateway(stub):
+    """Failures are retried within budget, then the breaker fails fast"""
+    stub.failure_rate = 1.0
+    client = GatewayClient('key', 'secret', base_url=stub.base_url, max_retries=1,
+                           breaker=CircuitBreaker(threshold=4, reset_timeout=0.2))
+    for _ in range(2):
+        with pytest.raises(ServerError):
+            client.order_payments('order_x')
+    assert stub.requests == 4 and client.breaker.state == 'open'
+    
+    with pytest.raises(GatewayUnavailable):
+        client.create_order(4900)
+    assert stub.requests == 4
+    
+    # After the reset timeout a single probe closes the breaker again
+    stub.failure_rate = 0.0
+    time.sleep(0.25)
+    assert client.create_order(4900)['status'] == 'created'
+    assert client.breaker.state == 'closed'
+
+def test_order_create_is_only_retried_before_it_is_sent(stub):
+    """An error after order.create reached the gateway may hide a created order, so it is not retried"""
+    stub.failure_rate = 1.0
+    client = GatewayClient('key', 'secret', base_url=stub.base_url, max_retries=2)
+    with pytest.raises(ServerError):
+        client.create_order(4900)
+    assert stub.requests == 1
+    
+    # Nothing listens on the discard port: the connection is refused before anything is sent
+    unreachable = GatewayClient('key', 'secret', base_url='http://127.0.0.1:9/v1', max_retries=2)
+    with pytest.raises(requests.ConnectionError):
+        unreachable.create_order(4900)
+    assert unreachable.metrics.snapshot()['calls']['order.create.error'] == 3
+
+def test_retry_budget_caps_retries():
+    budget = RetryBudget(ratio=0.5, minimum=1, window=60)
+    for _ in range(4):
+        budget.record_call()
+    assert [budget.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+def test_order_pool_serves_precreated_orders(stub, tmp_path):
+    """With the pool enabled, checkout takes a ready gateway order"""
+    app = make_test_app(tmp_path, RAZORPAY_BASE_URL=stub.base_url, RAZORPAY_ORDER_POOL_SIZE=3)
+    with app.app_context():
+        first = create_razorpay_order(49.0)
+        assert first['amount'] == 4900
+        deadline = time.time() + 5
+        while len(get_order_pool()._orders[(4900, 'INR')]) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        pooled = create_razorpay_order(49.0)
+        assert pooled['amount'] == 4900 and pooled['id'] != first['id']
+        assert get_gateway().metrics.snapshot()['calls']['order.create.ok'] >= 4
+
+def post_webhook(client, event, razorpay_order_id, event_id, secret='whsec'):
+    body = json.dumps({'event': event, 'payload': {'payment': {'entity': {
+        'id': f'pay_{event_id}', 'order_id': razorpay_order_id}}}}).encode()
+    signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return client.post('/store/webhook/razorpay', data=body, content_type='application/json',
+                       headers={'X-Razorpay-Signature': signature, 'X-Razorpay-Event-Id': event_id})
+
+def test_webhooks_are_queued_deduplicated_and_replayable(tmp_path):
+    """Webhooks are only queued by the endpoint; batches apply them idempotently"""
+    app = make_test_app(tmp_path, RAZORPAY_WEBHOOK_SECRET='whsec', WEBHOOK_WORKER=False)
+    with app.app_context():
+        user = User(username='buyer', email='buyer@skill2wealth.com')
+        product = Product(name='Guide', description='x', price=49.0, category='ebook',
+                          file_url='/content/ebooks/guide.pdf')
+        db.session.add_all([user, product])
+        db.session.flush()
+        order = Order(user_id=user.id, product_id=product.id, amount=49.0,
+                      razorpay_order_id='order_abc')
+        db.session.add(order)
+        db.session.commit()
+        order_id = order.id
+    
+    client = app.test_client()
+    assert post_webhook(client, 'payment.captured', 'order_abc', 'evt_1').json == {'status': 'queued'}
+    assert post_webhook(client, 'payment.captured', 'order_abc', 'evt_1').json == {'status': 'duplicate'}
+    assert post_webhook(client, 'payment.failed', 'order_abc', 'evt_2').json == {'status': 'queued'}
+    assert post_webhook(client, 'payment.captured', 'order_abc', 'evt_3', secret='wrong').status_code == 400
+    
+    with app.app_context():
+        assert db.session.get(Order, order_id).payment_status == 'pending'
+        assert webhooks.process_pending() == 2
+        order = db.session.get(Order, order_id)
+        assert order.payment_status == 'completed' and order.razorpay_payment_id == 'pay_evt_1'
+        assert Entitlement.query.count() == 1
+        
+        # Replaying everything leaves the order and its grant unchanged
+        assert webhooks.get_queue().reset() == 2
+        assert webhooks.process_pending() == 2
+        db.session.expire_all()
+        assert db.session.get(Order, order_id).payment_status == 'completed'
+        assert Entitlement.query.count() == 1
+        assert webhooks.get_queue().counts() == {'total': 2, 'pending': 0, 'dead': 0}
+
+def test_webhook_worker_applies_events_in_background(tmp_path):
+    app = make_test_app(tmp_path, WEBHOOK_POLL_INTERVAL=0.05)
+    with app.app_context():
+        user = User(username='buyer', email='buyer@skill2wealth.com')
+        product = Product(name='Guide', description='x', price=49.0, category='ebook')
+        db.session.add_all([user, product])
+        db.session.flush()
+        order = Order(user_id=user.id, product_id=product.id, amount=49.0,
+                      razorpay_order_id='order_bg')
+        db.session.add(order)
+        db.session.commit()
+        order_id = order.id
+    
+    client = app.test_client()
+    assert post_webhook(client, 'payment.captured', 'order_bg', 'evt_bg', secret='').status_code == 200
+    with app.app_context():
+        deadline = time.time() + 5
+        while webhooks.get_queue().counts()['pending'] and time.time() < deadline:
+            time.sleep(0.01)
+        assert db.session.get(Order, order_id).payment_status == 'completed'
+
+def test_reconcile_settles_pending_orders_and_resumes(stub, tmp_path):
+    """Pending orders are settled from the gateway in batches, resuming from the checkpoint"""
+    from datetime import datetime, timedelta
+    from app import reconcile
+    app = make_test_app(tmp_path, RAZORPAY_BASE_URL=stub.base_url, RAZORPAY_MAX_RETRIES=0,
+                        RAZORPAY_BREAKER_THRESHOLD=1000, RECONCILE_MIN_AGE=0, RECONCILE_CONCURRENCY=4)
+    with app.app_context():
+        user = User(username='buyer', email='buyer@skill2wealth.com')
+        product = Product(name='Guide', description='x', price=49.0, category='ebook',
+                          file_url='/content/ebooks/guide.pdf')
+        db.session.add_all([user, product])
+        db.session.flush()
+        old = datetime.utcnow() - timedelta(days=2)
+        expected = {}
+        for i in range(30):
+            razorpay_order_id = stub.new_id('order')
+            stub.orders[razorpay_order_id] = {'id': razorpay_order_id, 'amount': 4900, 'status': 'created'}
+            if i % 3 == 0:
+                stub.add_payment(razorpay_order_id)
+            elif i % 3 == 1:
+                stub.add_payment(razorpay_order_id, status='failed')
+            created_at = old if i < 15 else datetime.utcnow()
+            order = Order(user_id=user.id, product_id=product.id, amount=49.0,
+                          razorpay_order_id=razorpay_order_id, created_at=created_at)
+            db.session.add(order)
+            db.session.flush()
+            expected[order.id] = ('completed' if i % 3 == 0 else 'failed' if i < 15 else 'pending')
+        # Unknown to the gateway and old: failed; already completed: untouched
+        stale = Order(user_id=user.id, product_id=product.id, amount=49.0,
+                      razorpay_order_id='order_missing', created_at=old)
+        done = Order(user_id=user.id, product_id=product.id, amount=49.0,
+                     razorpay_order_id='order_done', payment_status='completed')
+        db.session.add_all([stale, done])
+        db.session.commit()
+        expected[stale.id], expected[done.id] = 'failed', 'completed'
+        
+        first = reconcile.reconcile(batch_size=10, max_batches=1)
+        assert first['checked'] == 10 and not first['finished']
+        checkpoint = reconcile.load_checkpoint()
+        assert checkpoint == sorted(expected)[9]
+        
+        # The gateway goes down: nothing is skipped, the checkpoint stays put
+        stub.failure_rate = 1.0
+        assert reconcile.reconcile(batch_size=10)['errors'] == 1
+        assert reconcile.load_checkpoint() == checkpoint
+        
+        stub.failure_rate = 0.0
+        rest = reconcile.reconcile(batch_size=10)
+        assert rest['finished'] and rest['checked'] == 21 and reconcile.load_checkpoint() == 0
+        db.session.expire_all()
+        statuses = dict(db.session.query(Order.id, Order.payment_status))
+        assert statuses == expected
+        captured = Order.query.filter(Order.razorpay_order_id != 'order_done',
+                                      Order.payment_status == 'completed').all()
+        assert all(order.razorpay_payment_id.startswith('pay_') for order in captured)
+        assert Entitlement.query.count() == 1
+        assert stats.verify() == {}
+
+def test_reconcile_settles_only_orders_still_pending(tmp_path):
+    """A webhook that settles an order mid-batch is not granted or counted again by reconciliation"""
+    from sqlalchemy import select
+    from app import reconcile
+    app = make_test_app(tmp_path, CONTENT_DIR=str(tmp_path / 'content'), JOBS_WORKER=False)
+    with app.app_context():
+        buyer = User(username='buyer', email='buyer@skill2wealth.com')
+        product = Product(name='Guide', description='x', price=49.0, category='ebook',
+                          file_url='/content/ebooks/guide.pdf')
+        db.session.add_all([buyer, product])
+        db.session.commit()
+        orders = [Order(user_id=buyer.id, product_id=product.id, amount=49.0, razorpay_order_id=f'order_{n}')
+                  for n in range(3)]
+        db.session.add_all(orders)
+        db.session.commit()
+        rows = db.session.execute(select(Order.id, Order.razorpay_order_id, Order.created_at, Order.amount)
+                                  .order_by(Order.id)).all()
+        
+        # The webhook completes the first order after the batch was read
+        orders[0].payment_status, orders[0].transaction_id = 'completed', 'pay_webhook'
+        db.session.commit()
+        completed, failed = reconcile._apply([(rows[0], 'pay_a'), (rows[1], 'pay_b')], [rows[2]])
+        assert completed == {rows[1].id} and failed == {rows[2].id}
+        
+        db.session.expire_all()
+        assert [o.transaction_id for o in Order.query.order_by(Order.id)] == ['pay_webhook', 'pay_b', None]
+        assert Entitlement.query.filter_by(user_id=buyer.id).count() == 1
+        counters = stats.snapshot()
+        assert counters['orders:completed'] == 2 and counters['orders:failed'] == 1
+        assert counters['orders:pending'] == 0 and counters['revenue'] == 98.0
+        assert stats.verify() == {}